@@ -0,0 +1,399 @@
+"""
+Batch licence extraction.
+
+Runs the licence analysis over a folder or an archive (.zip, .tar, .tgz) of
+scans, for digitising a backlog. At most `concurrency` files are analysed at
+a time; transient model failures (rate limits, unavailable upstream) are
+retried with exponential backoff and jitter. Results are produced per
+document as they finish, and the valid ones can be written straight into
+the licenses table. Files already analysed are served by the analysis cache
+(see ai_cache.py).
+
+Model calls go through a ModelService (see ai_service.py), so they get its
+deadline, concurrency cap and circuit breaker, and run on its thread pool:
+the API passes the worker's shared model_service, so batches and /ai/analyze
+draw from the same slots. While the circuit is open a retry waits for the
+cooldown. The model client is pluggable (see ai_client.py): with --client
+fake the whole pipeline runs offline against a deterministic stand-in.
+
+Usage:
+    python -m backend.ai_batch scans/ --concurrency 8 --write --username admin > results.ndjson
+    python -m backend.ai_batch scans.zip --client fake --fake-latency 0.8
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import mimetypes
+import os
+import random
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+
+from . import models, schemas, database, logger, ai_client, image_prep
+from .ai_cache import analysis_cache
+from .ai_service import ModelService
+from .image_prep import image_preprocessor
+from .status_cache import invalidate_status
+from .utils.rut import normalize_rut
+
+CONCURRENCY = int(os.getenv("AI_BATCH_CONCURRENCY", "4"))
+MAX_CONCURRENCY = int(os.getenv("AI_BATCH_MAX_CONCURRENCY", "16"))
+RETRIES = int(os.getenv("AI_BATCH_RETRIES", "3"))
+BACKOFF_SECONDS = float(os.getenv("AI_BATCH_BACKOFF_SECONDS", "1"))
+MAX_UPLOAD_FILES = int(os.getenv("AI_BATCH_MAX_FILES", "500")) # Parts per /ai/analyze-batch request
+MAX_UPLOAD_BYTES = int(os.getenv("AI_BATCH_MAX_UPLOAD_MB", "1024")) * 1024 * 1024 # Per part: archives are large
+MAX_FILE_BYTES = int(os.getenv("AI_BATCH_MAX_FILE_MB", "20")) * 1024 * 1024 # Gemini inline data limit
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz")
+
+
+class Source:
+    """
+    One scan of a batch. The content is only read when it is analysed.
+    """
+
+    def __init__(self, name: str, mime_type: str, size: int, read):
+        self.name = name
+        self.mime_type = mime_type
+        self.size = size
+        self.read = read
+
+
+def guess_mime(name: str) -> str:
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+def is_scan(name: str, mime_type: str) -> bool:
+    hidden = any(part.startswith((".", "__MACOSX")) for part in name.split("/"))
+    return not hidden and (mime_type.startswith("image/") or mime_type == "application/pdf")
+
+
+def is_archive(name: str) -> bool:
+    return name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def file_source(path: str, name: str = None, mime_type: str = None) -> Source:
+    def read():
+        with open(path, "rb") as f:
+            return f.read()
+    name = name or os.path.basename(path)
+    return Source(name, mime_type or guess_mime(name), os.path.getsize(path), read)
+
+
+def iter_folder(path: str):
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for filename in sorted(files):
+            full = os.path.join(root, filename)
+            name = os.path.relpath(full, path).replace(os.sep, "/")
+            if is_scan(name, guess_mime(name)):
+                yield file_source(full, name)
+
+
+def iter_archive(path: str):
+    """
+    Scans inside a zip or tar archive. Members are read one at a time
+    (archive handles are not thread safe); the archive is closed once every
+    member has been yielded and read.
+    """
+    lock = threading.Lock()
+
+    if zipfile.is_zipfile(path):
+        archive = zipfile.ZipFile(path)
+        members = [(info.filename, info.file_size, info) for info in archive.infolist() if not info.is_dir()]
+        open_member = archive.open
+    else:
+        archive = tarfile.open(path)
+        members = [(info.name, info.size, info) for info in archive.getmembers() if info.isfile()]
+        open_member = archive.extractfile
+
+    def reader(info):
+        def read():
+            with lock, open_member(info) as f:
+                return f.read()
+        return read
+
+    try:
+        for name, size, info in members:
+            mime_type = guess_mime(name)
+            if is_scan(name, mime_type):
+                yield Source(name, mime_type, size, reader(info))
+    finally:
+        with lock:
+            archive.close()
+
+
+def iter_uploads(files):
+    """
+    Sources of staged multipart files (see utils/multipart_stream.py):
+    archives are expanded, other parts are taken as single scans.
+    """
+    for staged in files:
+        if is_archive(staged.filename):
+            yield from iter_archive(staged.path)
+            continue
+        mime_type = staged.content_type
+        if mime_type in ("", "application/octet-stream"):
+            mime_type = guess_mime(staged.filename)
+        if is_scan(staged.filename, mime_type):
+            yield file_source(staged.path, staged.filename, mime_type)
+
+
+def iter_sources(path: str):
+    if os.path.isdir(path):
+        return iter_folder(path)
+    if is_archive(path):
+        return iter_archive(path)
+    return iter([file_source(path)])
+
+
+def to_license(analysis: dict):
+    """
+    (LicenseCreate, None) for an analysis, or (None, reason) when a
+    required field is unreadable or invalid.
+    """
+    if analysis.get("fullName") in (None, "", "N/A") or analysis.get("rut") in (None, "", "N/A"):
+        return None, "Nombre o RUT ilegible"
+    if analysis.get("category") not in ai_client.CATEGORIES:
+        return None, f"Categoría inválida: {analysis.get('category')}"
+
+    process_status = models.ProcessStatus.__members__.get(analysis.get("processStatus"), models.ProcessStatus.PENDING)
+    status = analysis.get("status")
+    if status not in [s.value for s in models.LicenseStatus]:
+        status = models.LicenseStatus.VALID.value
+    try:
+        return schemas.LicenseCreate(
+            full_name=analysis["fullName"],
+            rut=analysis["rut"],
+            license_number=analysis.get("licenseNumber") or "",
+            category=analysis["category"],
+            last_control_date=analysis.get("lastControlDate") or "",
+            status=status,
+            process_status=process_status.value,
+        ), None
+    except ValidationError as e:
+        return None, e.errors()[0]["msg"]
+
+
+def write_license(session_factory, license: schemas.LicenseCreate, username: str) -> dict:
+    db = session_factory()
+    try:
+        existing = db.query(models.License.is_deleted).filter(
+            models.License.rut_key == normalize_rut(license.rut)
+        ).first()
+        if existing is not None:
+            return {"written": False, "error": "Licencia en papelera" if existing.is_deleted else "Licencia ya existe"}
+        db.add(models.License(**license.dict(), id=license.rut, upload_date=int(time.time()), uploaded_by=username))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Same RUT written meanwhile (duplicate scan in the batch)
+            db.rollback()
+            return {"written": False, "error": "Licencia ya existe"}
+        invalidate_status(db, license.rut)
+        return {"written": True, "id": license.rut}
+    finally:
+        db.close()
+
+
+class BatchExtractor:
+
+    def __init__(self, service: ModelService, concurrency: int = CONCURRENCY, retries: int = RETRIES,
+                 backoff: float = BACKOFF_SECONDS, use_cache: bool = True, write: bool = False,
+                 username: str = "SYSTEM", session_factory=database.SessionLocal, prepare: bool = image_prep.FOR_AI):
+        self.service = service
+        self.prepare = prepare
+        # More workers than model slots would only queue for them and time out
+        self.concurrency = max(1, min(concurrency, service.max_concurrent))
+        self.retries = retries
+        self.backoff = backoff
+        self.use_cache = use_cache
+        self.write = write
+        self.username = username
+        self.session_factory = session_factory
+        self.summary = {"total": 0, "ok": 0, "failed": 0, "written": 0, "rejected": 0, "retries": 0}
+        self.latencies = []
+
+    async def _call_model(self, content: bytes, mime_type: str, content_sha256: str) -> dict:
+        async def compute():
+            if self.prepare:
+                data, media_type = await image_preprocessor.prepare_bytes(content, mime_type)
+            else:
+                data, media_type = content, mime_type
+            return await self.service.analyze(data, media_type)
+
+        if not self.use_cache:
+            return await compute()
+        return await analysis_cache.get_or_compute(
+            content_sha256, self.service.client.model_name, ai_client.PROMPT_VERSION, compute
+        )
+
+    async def _analyze(self, content: bytes, mime_type: str, result: dict) -> dict:
+        for attempt in range(self.retries + 1):
+            result["attempts"] = attempt + 1
+            try:
+                return await self._call_model(content, mime_type, result["sha256"])
+            except Exception as e:
+                if attempt == self.retries or not ai_client.is_transient(e):
+                    raise
+                # An open circuit refuses every call until its cooldown is over
+                retry_after = getattr(e, "retry_after", 0)
+            self.summary["retries"] += 1
+            # Exponential backoff with jitter, so throttled workers do not retry in lockstep
+            await asyncio.sleep(max(self.backoff * 2 ** attempt * random.uniform(0.5, 1), retry_after))
+
+    async def process(self, source: Source) -> dict:
+        started = time.monotonic()
+        result = {"file": source.name, "status": "failed", "attempts": 0}
+        try:
+            if source.size > MAX_FILE_BYTES:
+                raise ValueError(f"Archivo demasiado grande ({source.size} bytes)")
+            content = await run_in_threadpool(source.read)
+            result["sha256"] = hashlib.sha256(content).hexdigest()
+            analysis = await self._analyze(content, source.mime_type, result)
+            result["status"] = "ok"
+            result["data"] = analysis
+
+            if self.write:
+                license, error = to_license(analysis)
+                if license is None:
+                    result["license"] = {"written": False, "error": error}
+                else:
+                    result["license"] = await run_in_threadpool(write_license, self.session_factory, license, self.username)
+        except Exception as e:
+            result["error"] = str(e)
+
+        result["elapsed_ms"] = int((time.monotonic() - started) * 1000)
+        self.summary["total"] += 1
+        self.summary[result["status"]] += 1
+        if "license" in result:
+            self.summary["written" if result["license"]["written"] else "rejected"] += 1
+        self.latencies.append(result["elapsed_ms"])
+        return result
+
+    async def run(self, sources):
+        """
+        Async generator of per-document results, in completion order.
+        """
+        started = time.monotonic()
+        iterator = iter(sources)
+        advancing = asyncio.Lock()
+        results = asyncio.Queue()
+        finished = object()
+        failures = []
+
+        async def next_source():
+            # Listing a folder or archive blocks: done off the loop, one worker at a time
+            async with advancing:
+                return await run_in_threadpool(next, iterator, None)
+
+        async def worker():
+            try:
+                while True:
+                    source = await next_source()
+                    if source is None:
+                        return
+                    await results.put(await self.process(source))
+            except Exception as e:
+                # Unreadable folder or archive; per-document errors never get here
+                failures.append(e)
+            finally:
+                results.put_nowait(finished)
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(self.concurrency)]
+        running = len(workers)
+        try:
+            while running:
+                item = await results.get()
+                if item is finished:
+                    running -= 1
+                else:
+                    yield item
+        finally:
+            for task in workers:
+                task.cancel()
+            self.summary["elapsed_seconds"] = round(time.monotonic() - started, 3)
+
+        if failures:
+            raise failures[0]
+        await run_in_threadpool(self._log)
+
+    def _log(self):
+        db = self.session_factory()
+        try:
+            logger.log_action(
+                db, username=self.username, action="AI_BATCH_EXTRACTION",
+                details=", ".join(f"{key}: {value}" for key, value in self.report().items())
+            )
+        finally:
+            db.close()
+
+    def report(self) -> dict:
+        """
+        Summary with throughput and per-document latency percentiles.
+        """
+        report = dict(self.summary)
+        latencies = sorted(self.latencies)
+        elapsed = report.get("elapsed_seconds")
+        if latencies:
+            report["p50_ms"] = latencies[len(latencies) // 2]
+            report["p95_ms"] = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+        if elapsed:
+            report["docs_per_second"] = round(report["total"] / elapsed, 2)
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract licence data from a folder or archive of scans")
+    parser.add_argument("path", help="Folder, .zip/.tar archive or single file")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--retries", type=int, default=RETRIES)
+    parser.add_argument("--backoff", type=float, default=BACKOFF_SECONDS, help="Initial retry delay in seconds")
+    parser.add_argument("--client", choices=["gemini", "fake"], default=os.getenv("AI_CLIENT", "gemini"))
+    parser.add_argument("--fake-latency", type=float, default=0.5, help="Seconds per call of the fake client")
+    parser.add_argument("--fake-failure-rate", type=float, default=0.0,
+                        help="Fraction of files whose first call to the fake client fails")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the model")
+    parser.add_argument("--no-prep", action="store_true", help="Send images as they are (see image_prep.py)")
+    parser.add_argument("--write", action="store_true", help="Insert valid results into licenses")
+    parser.add_argument("--username", default="SYSTEM")
+    parser.add_argument("--output", help="NDJSON output file (default: stdout)")
+    args = parser.parse_args()
+
+    options = {"latency": args.fake_latency, "failure_rate": args.fake_failure_rate} if args.client == "fake" else {}
+    client = ai_client.create_client(args.client, **options)
+    # This process's guard: one call slot per document in flight
+    service = ModelService(client_factory=lambda: client, max_concurrent=args.concurrency)
+    extractor = BatchExtractor(
+        service, concurrency=args.concurrency, retries=args.retries, backoff=args.backoff,
+        use_cache=not args.no_cache, write=args.write, username=args.username,
+        prepare=image_prep.FOR_AI and not args.no_prep
+    )
+    models.Base.metadata.create_all(bind=database.engine)
+
+    async def run():
+        output = open(args.output, "w") if args.output else sys.stdout
+        try:
+            async for result in extractor.run(iter_sources(args.path)):
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+        finally:
+            if args.output:
+                output.close()
+
+    asyncio.run(run())
+    service.shutdown()
+    image_preprocessor.shutdown()
+    logger.shutdown()
+    print(json.dumps(extractor.report(), indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Result cache for Gemini licence analysis.
+
+Analysing the same scan twice (double clicks on "analizar", re-uploads after
+a failed save) returns the stored result instead of calling the model again.
+Entries are keyed by the SHA-256 of the file bytes plus the model name and
+prompt version, so changing either invalidates them. They live in the
+ai_analysis_cache table, shared by all workers, expire after
+AI_CACHE_TTL_SECONDS and are evicted least-recently-used beyond
+AI_CACHE_MAX_ENTRIES.
+
+Identical requests arriving while the model call for that key is running
+wait for it instead of starting their own (per worker). If the request
+running it is cancelled (e.g. the client went away), one of the waiting
+requests takes the call over.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+from sqlalchemy import func
+from starlette.concurrency import run_in_threadpool
+
+from . import models, database
+
+TTL_SECONDS = int(os.getenv("AI_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "20000"))
+
+
+def cache_key(content_sha256: str, model: str, prompt_version: str) -> str:
+    return hashlib.sha256(f"{content_sha256}:{model}:{prompt_version}".encode()).hexdigest()
+
+
+class AnalysisCache:
+
+    def __init__(self, session_factory=database.SessionLocal, ttl: int = TTL_SECONDS,
+                 max_entries: int = MAX_ENTRIES):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._in_flight = {} # key -> asyncio.Future (this worker's event loop)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.saved_seconds = 0.0
+        self.model_seconds = 0.0
+
+    def lookup(self, key: str):
+        """
+        Returns (result, latency_ms) of a live entry, or None. Records the hit.
+        """
+        db = self.session_factory()
+        try:
+            now = int(time.time())
+            entry = db.query(models.AnalysisCacheEntry).filter(
+                models.AnalysisCacheEntry.key == key,
+                models.AnalysisCacheEntry.expires_at > now
+            ).first()
+            if entry is None:
+                return None
+            entry.hits = (entry.hits or 0) + 1
+            entry.last_hit_at = now
+            db.commit()
+            return json.loads(entry.result), entry.latency_ms or 0
+        finally:
+            db.close()
+
+    def store(self, key: str, content_sha256: str, model: str, prompt_version: str,
+              result: dict, latency_ms: int):
+        db = self.session_factory()
+        try:
+            now = int(time.time())
+            entry = db.query(models.AnalysisCacheEntry).filter(models.AnalysisCacheEntry.key == key).first()
+            if entry is None:
+                entry = models.AnalysisCacheEntry(key=key, hits=0)
+                db.add(entry)
+            entry.content_sha256 = content_sha256
+            entry.model = model
+            entry.prompt_version = prompt_version
+            entry.result = json.dumps(result, ensure_ascii=False)
+            entry.latency_ms = latency_ms
+            entry.created_at = now
+            entry.expires_at = now + self.ttl
+            entry.last_hit_at = now
+            db.commit()
+            self.evict(db)
+        finally:
+            db.close()
+
+    def evict(self, db) -> int:
+        """
+        Drops expired entries, then the least recently used beyond max_entries.
+        """
+        removed = db.query(models.AnalysisCacheEntry).filter(
+            models.AnalysisCacheEntry.expires_at <= int(time.time())
+        ).delete(synchronize_session=False)
+        excess = db.query(func.count(models.AnalysisCacheEntry.key)).scalar() - self.max_entries
+        if excess > 0:
+            oldest = [row.key for row in db.query(models.AnalysisCacheEntry.key)
+                      .order_by(models.AnalysisCacheEntry.last_hit_at).limit(excess).all()]
+            removed += db.query(models.AnalysisCacheEntry).filter(
+                models.AnalysisCacheEntry.key.in_(oldest)
+            ).delete(synchronize_session=False)
+        db.commit()
+        return removed
+
+    async def get_or_compute(self, content_sha256: str, model: str, prompt_version: str, compute,
+                             refresh: bool = False) -> dict:
+        """
+        Cached result for the file with this SHA-256, or the result of
+        `await compute()`, which is then stored. refresh=True skips the lookup.
+        """
+        key = cache_key(content_sha256, model, prompt_version)
+
+        while key in self._in_flight:
+            pending = self._in_flight[key]
+            try:
+                result, latency_ms = await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise # This caller was cancelled
+                # The caller running it was cancelled: the first waiter to wake up takes over
+                continue
+            self.coalesced += 1
+            # A model call avoided, even though this caller waited for the shared one
+            self.saved_seconds += latency_ms / 1000
+            return result
+
+        # Registered before any await so identical requests coalesce from here on
+        future = asyncio.get_event_loop().create_future() # (result, latency_ms)
+        future.add_done_callback(lambda f: f.cancelled() or f.exception()) # Never "unretrieved"
+        self._in_flight[key] = future
+        try:
+            cached = None if refresh else await run_in_threadpool(self.lookup, key)
+            if cached is not None:
+                result, latency_ms = cached
+                self.hits += 1
+                self.saved_seconds += latency_ms / 1000
+            else:
+                started = time.monotonic()
+                result = await compute()
+                elapsed = time.monotonic() - started
+                latency_ms = int(elapsed * 1000)
+                self.misses += 1
+                self.model_seconds += elapsed
+                await run_in_threadpool(self.store, key, content_sha256, model, prompt_version,
+                                        result, latency_ms)
+            future.set_result((result, latency_ms))
+            return result
+        except asyncio.CancelledError:
+            # Waiters retry instead of being cancelled with this caller
+            future.cancel()
+            raise
+        except BaseException as e:
+            self.errors += 1
+            future.set_exception(e)
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    def stats(self) -> dict:
+        served = self.hits + self.misses + self.coalesced
+        db = self.session_factory()
+        try:
+            entries, total_hits, saved_ms = db.query(
+                func.count(models.AnalysisCacheEntry.key),
+                func.coalesce(func.sum(models.AnalysisCacheEntry.hits), 0),
+                func.coalesce(func.sum(models.AnalysisCacheEntry.hits * models.AnalysisCacheEntry.latency_ms), 0),
+            ).one()
+        finally:
+            db.close()
+        return {
+            "worker": {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+                "in_flight": len(self._in_flight),
+                "hit_rate": round((self.hits + self.coalesced) / served, 4) if served else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "model_seconds": round(self.model_seconds, 3),
+                "avg_model_seconds": round(self.model_seconds / self.misses, 3) if self.misses else None,
+            },
+            # Across all workers, since the entries were created
+            "persistent": {
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": int(total_hits),
+                "saved_seconds": round(int(saved_ms) / 1000, 3),
+            },
+        }
+
+
+analysis_cache = AnalysisCache()
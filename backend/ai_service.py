@@ -0,0 +1,276 @@
+"""
+Guarded access to the licence analysis model for the API.
+
+The model client (see ai_client.py) is built once per worker and its
+blocking calls run in a dedicated thread pool, so a slow model never stalls
+the event loop serving the rest of the API. Around every call:
+
+- at most AI_MAX_CONCURRENT_CALLS calls per worker reach the model; a call
+  keeps its slot until the model actually returns, even after its caller
+  gave up. A call that waits AI_CALL_TIMEOUT_SECONDS for a slot is
+  rejected (ModelUnavailable) without counting against the model;
+- once it has a slot, each call has a deadline of AI_CALL_TIMEOUT_SECONDS;
+- a circuit breaker opens when at least AI_BREAKER_FAILURE_RATE of the
+  calls in the last AI_BREAKER_WINDOW_SECONDS failed (timeouts and upstream
+  errors; unreadable answers do not count). While open, calls fail at once
+  with ModelUnavailable. After AI_BREAKER_COOLDOWN_SECONDS a single probe
+  call is let through, and its result closes or reopens the circuit.
+
+Counts and latencies per outcome (ok, invalid, timeout, error, rejected)
+are kept for GET /ai/metrics.
+"""
+import asyncio
+import functools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from . import ai_client
+
+CALL_TIMEOUT_SECONDS = float(os.getenv("AI_CALL_TIMEOUT_SECONDS", "30"))
+MAX_CONCURRENT_CALLS = int(os.getenv("AI_MAX_CONCURRENT_CALLS", "4"))
+BREAKER_WINDOW_SECONDS = float(os.getenv("AI_BREAKER_WINDOW_SECONDS", "60"))
+BREAKER_MIN_CALLS = int(os.getenv("AI_BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("AI_BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("AI_BREAKER_COOLDOWN_SECONDS", "30"))
+OUTCOMES = ["ok", "invalid", "timeout", "error", "rejected"]
+RECENT_LATENCIES = 500 # Per outcome, for the percentiles
+
+
+class ModelUnavailable(ai_client.TransientError):
+    def __init__(self, retry_after: int):
+        super().__init__("IA no disponible")
+        self.retry_after = retry_after
+
+
+class ModelTimeout(TimeoutError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Failure-rate breaker over a sliding time window. Not thread safe: used
+    from the event loop only.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, window: float = BREAKER_WINDOW_SECONDS, min_calls: int = BREAKER_MIN_CALLS,
+                 failure_rate: float = BREAKER_FAILURE_RATE, cooldown: float = BREAKER_COOLDOWN_SECONDS):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.times_opened = 0
+        self._calls = deque() # (monotonic time, succeeded)
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def retry_after(self) -> int:
+        if self.state != self.OPEN:
+            return 1
+        return max(int(self.cooldown - (time.monotonic() - self.opened_at)) + 1, 1)
+
+    def record(self, succeeded):
+        """
+        Result of an allowed call: True, False, or None when it ended
+        without a verdict (cancelled).
+        """
+        now = time.monotonic()
+        if self.state == self.HALF_OPEN:
+            self._probing = False
+            if succeeded:
+                self.state = self.CLOSED
+                self._calls.clear()
+            elif succeeded is False:
+                self._open(now)
+            return
+        if succeeded is None:
+            return
+
+        self._calls.append((now, succeeded))
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+        failures = sum(1 for _, ok in self._calls if not ok)
+        if len(self._calls) >= self.min_calls and failures / len(self._calls) >= self.failure_rate:
+            self._open(now)
+
+    def _open(self, now: float):
+        self.state = self.OPEN
+        self.opened_at = now
+        self.times_opened += 1
+        self._calls.clear()
+        print(f"AI circuit breaker opened for {self.cooldown}s")
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "times_opened": self.times_opened,
+            "window_calls": len(self._calls),
+            "window_failures": sum(1 for _, ok in self._calls if not ok),
+            "retry_after": self.retry_after() if self.state == self.OPEN else None,
+        }
+
+
+class ModelService:
+
+    def __init__(self, client_factory=ai_client.create_client, timeout: float = CALL_TIMEOUT_SECONDS,
+                 max_concurrent: int = MAX_CONCURRENT_CALLS, breaker: CircuitBreaker = None):
+        self.client_factory = client_factory
+        self.timeout = timeout
+        self.max_concurrent = max_concurrent
+        self.breaker = breaker or CircuitBreaker()
+        self.in_flight = 0
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        self._metrics = {
+            outcome: {"count": 0, "seconds": 0.0, "recent": deque(maxlen=RECENT_LATENCIES), "last_error": None}
+            for outcome in OUTCOMES
+        }
+
+    @property
+    def client(self):
+        """
+        The worker's model client, built on first use.
+        """
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self.client_factory()
+        return self._client
+
+    async def _acquire(self):
+        """
+        Takes a model slot, waiting up to the call timeout. Returns the
+        semaphore to release, or None when no slot freed up in time.
+        """
+        if self._slots is None:
+            # Created on first use, inside the worker's event loop
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="ai-model")
+        slots = self._slots
+        try:
+            await asyncio.wait_for(slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            return None
+        return slots
+
+    def _call(self, slots, content: bytes, mime_type: str):
+        """
+        Starts the model call on a taken slot; the slot is released when the
+        model returns. Returns the shielded future of its result.
+        """
+        try:
+            future = asyncio.get_event_loop().run_in_executor(
+                self._executor, functools.partial(self.client.analyze, content, mime_type, timeout=self.timeout)
+            )
+        except BaseException:
+            slots.release()
+            raise
+        self.in_flight += 1
+
+        def done(finished):
+            self.in_flight -= 1
+            slots.release()
+            if not finished.cancelled():
+                finished.exception() # Retrieved, even when the caller timed out
+
+        future.add_done_callback(done)
+        # Shielded: a caller hitting its deadline leaves the call (and its slot) to finish
+        return asyncio.shield(future)
+
+    async def analyze(self, content: bytes, mime_type: str) -> dict:
+        """
+        LicenseAnalysisResponse fields for a scan. Raises ModelUnavailable
+        while the circuit is open or no slot frees up in time, and
+        ModelTimeout when the model misses the deadline.
+        """
+        if not self.breaker.allow():
+            self._record("rejected", 0.0, "Circuito abierto")
+            raise ModelUnavailable(self.breaker.retry_after())
+
+        started = time.monotonic()
+        outcome, error = None, None
+        try:
+            slots = await self._acquire()
+            if slots is None:
+                # Busy here, not failing upstream: no verdict for the breaker
+                outcome, error = "rejected", f"Sin turno libre en {self.timeout}s"
+                raise ModelUnavailable(1)
+            result = await asyncio.wait_for(self._call(slots, content, mime_type), self.timeout)
+            outcome = "ok"
+            return result
+        except ModelUnavailable:
+            raise
+        except asyncio.TimeoutError:
+            outcome, error = "timeout", f"Sin respuesta en {self.timeout}s"
+            raise ModelTimeout(error) from None
+        except (ValueError, TypeError, AttributeError) as e:
+            # The model answered, but not with usable JSON (or the answer was blocked)
+            outcome, error = "invalid", str(e)
+            raise
+        except Exception as e:
+            outcome, error = "error", str(e)
+            raise
+        finally:
+            if outcome in (None, "rejected"):
+                self.breaker.record(None)
+            else:
+                self.breaker.record(outcome in ("ok", "invalid"))
+            if outcome is not None:
+                self._record(outcome, time.monotonic() - started, error)
+
+    def _record(self, outcome: str, seconds: float, error: str = None):
+        metric = self._metrics[outcome]
+        metric["count"] += 1
+        metric["seconds"] += seconds
+        metric["recent"].append(seconds)
+        if error:
+            metric["last_error"] = error
+
+    def stats(self) -> dict:
+        outcomes = {}
+        for outcome, metric in self._metrics.items():
+            recent = sorted(metric["recent"])
+            outcomes[outcome] = {
+                "count": metric["count"],
+                "avg_ms": round(metric["seconds"] / metric["count"] * 1000) if metric["count"] else None,
+                "p50_ms": round(recent[len(recent) // 2] * 1000) if recent else None,
+                "p95_ms": round(recent[min(int(len(recent) * 0.95), len(recent) - 1)] * 1000) if recent else None,
+                "last_error": metric["last_error"],
+            }
+        total = sum(metric["count"] for metric in self._metrics.values())
+        failed = self._metrics["timeout"]["count"] + self._metrics["error"]["count"]
+        return {
+            "model": self._client.model_name if self._client is not None else None,
+            "in_flight": self.in_flight,
+            "max_concurrent": self.max_concurrent,
+            "timeout_seconds": self.timeout,
+            "error_rate": round(failed / total, 4) if total else 0.0,
+            "breaker": self.breaker.stats(),
+            "outcomes": outcomes,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+model_service = ModelService()
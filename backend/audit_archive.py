@@ -0,0 +1,328 @@
+"""
+Cold storage for the audit trail.
+
+Audit rows older than the retention window are moved out of the audit_logs
+table into immutable, day-partitioned segment files under AUDIT_ARCHIVE_PATH:
+
+    audit-2024-03-01.0.jsonl.gz   rows sorted by (timestamp, id), written as
+                                  independent gzip members of BLOCK_ROWS rows
+    audit-2024-03-01.0.idx.json   sparse index: time range, offset, length
+                                  and row count per hour of every block
+
+Queries read the index first and only decompress the blocks whose time range
+overlaps the request, slicing them out of a memory-mapped segment. Counts
+and the per-day histogram come from the index alone when no column filter
+is given. Parsed indexes are kept in memory until the directory changes.
+
+Archiving is idempotent: rows are deleted only after their segment is on
+disk, and rows already present in a segment of their day (a run that
+crashed before deleting them) are deleted without being written again.
+Segment files are created with O_EXCL, so concurrent runs pick distinct
+sequence numbers.
+
+Usage:
+    python -m backend.audit_archive --days 180
+"""
+import argparse
+import datetime
+import gzip
+import json
+import mmap
+import os
+import threading
+import time
+
+from . import models, database
+
+ARCHIVE_PATH = os.getenv("AUDIT_ARCHIVE_PATH", "audit_archive")
+RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", "180"))
+BLOCK_ROWS = 1000
+DELETE_BATCH_SIZE = 500
+SECONDS_PER_DAY = 86400
+SECONDS_PER_HOUR = 3600
+
+COLUMNS = [column.key for column in models.AuditLog.__table__.columns]
+
+_indexes_lock = threading.Lock()
+_indexes_cache = {"mtime": None, "indexes": []}
+
+
+def _day_start(timestamp: int) -> int:
+    return timestamp - timestamp % SECONDS_PER_DAY
+
+
+def _create_segment(day_start: int):
+    """
+    Picks the next free sequence number of the day and creates its data file
+    with O_EXCL, so concurrent archive runs never write the same segment.
+    Returns (name, open file).
+    """
+    day = datetime.datetime.utcfromtimestamp(day_start).strftime("%Y-%m-%d")
+    sequence = 0
+    while True:
+        name = f"audit-{day}.{sequence}"
+        try:
+            return name, open(os.path.join(ARCHIVE_PATH, f"{name}.jsonl.gz"), "xb")
+        except FileExistsError:
+            sequence += 1
+
+
+def write_segment(rows: list) -> str:
+    """
+    Writes rows (dicts sorted by timestamp, id) as a new immutable segment.
+    The data file is written first and the index last (via rename), so a
+    segment without an index is an interrupted write and is ignored.
+    Every block records its row count per UTC hour for the histogram.
+    """
+    os.makedirs(ARCHIVE_PATH, exist_ok=True)
+    day_start = _day_start(rows[0]["timestamp"])
+    name, f = _create_segment(day_start)
+    data_path = os.path.join(ARCHIVE_PATH, f"{name}.jsonl.gz")
+    index_path = os.path.join(ARCHIVE_PATH, f"{name}.idx.json")
+
+    blocks = []
+    offset = 0
+    with f:
+        for start in range(0, len(rows), BLOCK_ROWS):
+            block = rows[start:start + BLOCK_ROWS]
+            payload = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in block)
+            compressed = gzip.compress(payload.encode("utf-8"))
+            f.write(compressed)
+            hours = [0] * 24
+            for row in block:
+                hours[(row["timestamp"] - day_start) // SECONDS_PER_HOUR] += 1
+            blocks.append({
+                "offset": offset,
+                "length": len(compressed),
+                "min_ts": block[0]["timestamp"],
+                "max_ts": block[-1]["timestamp"],
+                "count": len(block),
+                "hours": hours,
+            })
+            offset += len(compressed)
+        f.flush()
+        os.fsync(f.fileno())
+
+    index = {
+        "data": os.path.basename(data_path),
+        "day_start": day_start,
+        "min_ts": rows[0]["timestamp"],
+        "max_ts": rows[-1]["timestamp"],
+        "count": len(rows),
+        "blocks": blocks,
+    }
+    with open(index_path + ".tmp", "w") as f:
+        json.dump(index, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(index_path + ".tmp", index_path)
+    invalidate_indexes()
+    return name
+
+
+def _archived_ids(day_start: int) -> set:
+    """
+    Ids already stored in the segments of the day.
+    """
+    ids = set()
+    for block, read in _iter_blocks(day_start, day_start + SECONDS_PER_DAY):
+        ids.update(row["id"] for row in read())
+    return ids
+
+
+def archive_audit_logs(db, older_than_days: int = RETENTION_DAYS) -> dict:
+    """
+    Moves audit rows older than older_than_days into segment files, one day
+    at a time. Rows are only deleted after their segment is on disk.
+    """
+    cutoff = int(time.time()) - older_than_days * SECONDS_PER_DAY
+    archived = 0
+    segments = []
+
+    while True:
+        oldest = db.query(models.AuditLog.timestamp).filter(
+            models.AuditLog.timestamp < cutoff
+        ).order_by(models.AuditLog.timestamp).limit(1).scalar()
+        if oldest is None:
+            break
+
+        day_end = min(_day_start(oldest) + SECONDS_PER_DAY, cutoff)
+        rows = db.query(models.AuditLog).filter(
+            models.AuditLog.timestamp >= oldest,
+            models.AuditLog.timestamp < day_end
+        ).order_by(models.AuditLog.timestamp, models.AuditLog.id).all()
+
+        ids = [row.id for row in rows]
+        # Left behind by a run that wrote their segment but crashed before deleting them
+        already_archived = _archived_ids(_day_start(oldest))
+        records = [{c: getattr(row, c) for c in COLUMNS} for row in rows if row.id not in already_archived]
+        if records:
+            segments.append(write_segment(records))
+
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            db.query(models.AuditLog).filter(
+                models.AuditLog.id.in_(ids[start:start + DELETE_BATCH_SIZE])
+            ).delete(synchronize_session=False)
+        db.commit()
+        db.expunge_all()
+        archived += len(records)
+
+    return {"archived": archived, "segments": segments, "cutoff": cutoff}
+
+
+def invalidate_indexes():
+    with _indexes_lock:
+        _indexes_cache["mtime"] = None
+
+
+def load_indexes() -> list:
+    """
+    Segment indexes sorted newest first. Parsed once, and again whenever a
+    file is added to or removed from the directory.
+    """
+    try:
+        mtime = os.stat(ARCHIVE_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    with _indexes_lock:
+        if _indexes_cache["mtime"] == mtime:
+            return _indexes_cache["indexes"]
+    indexes = []
+    for name in os.listdir(ARCHIVE_PATH):
+        if name.endswith(".idx.json"):
+            with open(os.path.join(ARCHIVE_PATH, name)) as f:
+                indexes.append(json.load(f))
+    indexes.sort(key=lambda index: index["max_ts"], reverse=True)
+    with _indexes_lock:
+        _indexes_cache["mtime"] = mtime
+        _indexes_cache["indexes"] = indexes
+    return indexes
+
+
+def archive_horizon() -> int:
+    """
+    Newest archived timestamp, or None if nothing has been archived.
+    Anything at or before it may live in the archive.
+    """
+    indexes = load_indexes()
+    return indexes[0]["max_ts"] if indexes else None
+
+
+def _matches(row: dict, username, action, entity_id, since, until) -> bool:
+    if username and row["username"] != username:
+        return False
+    if action and row["action"] != action:
+        return False
+    if entity_id and row["entity_id"] != entity_id:
+        return False
+    if since is not None and row["timestamp"] < since:
+        return False
+    if until is not None and row["timestamp"] >= until:
+        return False
+    return True
+
+
+def _overlaps(entry: dict, since, upper) -> bool:
+    if since is not None and entry["max_ts"] < since:
+        return False
+    if upper is not None and entry["min_ts"] >= upper:
+        return False
+    return True
+
+
+def _iter_blocks(since, upper):
+    """
+    Yields (block, read) for every archived block overlapping [since, upper),
+    newest first. Rows are in ascending (timestamp, id) order.
+    Blocks fully outside the range are never read.
+    """
+    for index in load_indexes():
+        if not _overlaps(index, since, upper):
+            continue
+        with open(os.path.join(ARCHIVE_PATH, index["data"]), "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for block in reversed(index["blocks"]):
+                    if not _overlaps(block, since, upper):
+                        continue
+                    yield {**block, "day_start": index.get("day_start")}, \
+                        lambda block=block, data=data: _read_block(data, block)
+
+
+def _read_block(data, block: dict) -> list:
+    raw = gzip.decompress(data[block["offset"]:block["offset"] + block["length"]])
+    return [json.loads(line) for line in raw.decode("utf-8").splitlines()]
+
+
+def iter_archived(username: str = None, action: str = None, entity_id: str = None,
+                  since: int = None, until: int = None, before: tuple = None):
+    """
+    Yields archived rows matching the /logs filters, newest first.
+    `before` is an exclusive (timestamp, id) keyset bound.
+    """
+    upper = until
+    if before is not None:
+        upper = before[0] + 1 if upper is None else min(upper, before[0] + 1)
+
+    for block, read in _iter_blocks(since, upper):
+        for row in reversed(read()):
+            if before is not None and (row["timestamp"], row["id"]) >= tuple(before):
+                continue
+            if _matches(row, username, action, entity_id, since, until):
+                yield row
+
+
+def count_archived(username: str = None, action: str = None, entity_id: str = None,
+                   since: int = None, until: int = None) -> int:
+    """
+    Counts archived rows. Without column filters, blocks fully inside the
+    time range are counted from the index without decompressing them.
+    """
+    total = 0
+    for block, read in _iter_blocks(since, until):
+        inside = (since is None or block["min_ts"] >= since) and (until is None or block["max_ts"] < until)
+        if inside and not (username or action or entity_id):
+            total += block["count"]
+        else:
+            total += sum(1 for row in read() if _matches(row, username, action, entity_id, since, until))
+    return total
+
+
+def histogram_archived(username: str = None, action: str = None, entity_id: str = None,
+                       since: int = None, until: int = None, utc_offset: int = 0) -> dict:
+    """
+    Archived rows per day number, days shifted by utc_offset seconds.
+    Without column filters, blocks fully inside the time range are counted
+    from their per-hour counts when the offset is a whole number of hours.
+    """
+    counts = {}
+    whole_hours = utc_offset % SECONDS_PER_HOUR == 0
+    for block, read in _iter_blocks(since, until):
+        inside = (since is None or block["min_ts"] >= since) and (until is None or block["max_ts"] < until)
+        if inside and whole_hours and "hours" in block and not (username or action or entity_id):
+            for hour, count in enumerate(block["hours"]):
+                if count:
+                    day_number = (block["day_start"] + hour * SECONDS_PER_HOUR + utc_offset) // SECONDS_PER_DAY
+                    counts[day_number] = counts.get(day_number, 0) + count
+            continue
+        for row in read():
+            if _matches(row, username, action, entity_id, since, until):
+                day_number = (row["timestamp"] + utc_offset) // SECONDS_PER_DAY
+                counts[day_number] = counts.get(day_number, 0) + 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old audit logs into compressed segment files")
+    parser.add_argument("--days", type=int, default=RETENTION_DAYS, help="Keep this many days in the database")
+    args = parser.parse_args()
+
+    db = database.SessionLocal()
+    try:
+        result = archive_audit_logs(db, args.days)
+    finally:
+        db.close()
+    print(f"Archived {result['archived']} audit logs into {len(result['segments'])} segments")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Content-addressed storage for the simulation Drive.
+
+Every file is stored once under DRIVE_SIM_PATH/.blobs/<aa>/<sha256>, where the
+SHA-256 is computed while streaming the content in fixed-size chunks. The
+sim_files table maps (username, name) to a blob with a stable id, so the same
+scan uploaded by several users, or twice by one, occupies disk only once and a
+re-upload under the same name keeps its id.
+
+Staged uploads are moved into place with a rename, so a new blob costs no
+extra copy and a duplicate is not written at all. Blobs (and their
+thumbnails) no longer referenced by sim_files or the document catalogue are
+reclaimed by gc(); recently touched blobs are kept for a grace period so an
+upload whose row is not yet committed is never lost.
+
+Usage:
+    python -m backend.blob_store --gc
+    python -m backend.blob_store --import-legacy
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+from sqlalchemy.exc import IntegrityError
+
+from . import models, database
+from .drive_client import DRIVE_SIM_PATH
+
+BLOB_PATH = os.path.join(DRIVE_SIM_PATH, ".blobs")
+CHUNK_SIZE = 1024 * 1024
+GC_GRACE_SECONDS = int(os.getenv("BLOB_GC_GRACE_SECONDS", "3600"))
+
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(BLOB_PATH, sha256[:2], sha256)
+
+
+def hash_file(path: str, progress=None) -> tuple:
+    """
+    SHA-256 and size of a file, read in CHUNK_SIZE chunks.
+    progress(bytes_read) is called after every chunk.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+            if progress:
+                progress(size)
+    return digest.hexdigest(), size
+
+
+def put_file(path: str, move: bool = False, progress=None) -> tuple:
+    """
+    Stores a local file as a blob. Returns (sha256, size, created).
+    With move=True the file is renamed into the store (it must be on the
+    same filesystem, as the upload staging area is); otherwise it is copied.
+    When the blob already exists nothing is written and the source is left alone.
+    """
+    sha256, size = hash_file(path, progress)
+    target = blob_path(sha256)
+
+    if os.path.exists(target):
+        # Refresh mtime so gc() keeps it until the referencing row is committed
+        os.utime(target)
+        return sha256, size, False
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if move:
+        os.replace(path, target)
+    else:
+        temp = f"{target}.{uuid.uuid4().hex}.part"
+        shutil.copyfile(path, temp)
+        os.replace(temp, target)
+    return sha256, size, True
+
+
+def open_blob(sha256: str):
+    return open(blob_path(sha256), "rb")
+
+
+def save_file(db, username: str, name: str, sha256: str, size: int, mime_type: str = None):
+    """
+    Points (username, name) at a blob, creating the entry or updating it in
+    place so its id stays the same. Commits.
+    """
+    entry = db.query(models.SimFile).filter(
+        models.SimFile.username == username,
+        models.SimFile.name == name
+    ).first()
+    if entry is None:
+        entry = models.SimFile(
+            id=str(uuid.uuid4()), username=username, name=name,
+            sha256=sha256, size=size, mime_type=mime_type
+        )
+        db.add(entry)
+        try:
+            db.commit()
+            return entry
+        except IntegrityError:
+            # Another worker created the same (username, name) meanwhile
+            db.rollback()
+            entry = db.query(models.SimFile).filter(
+                models.SimFile.username == username,
+                models.SimFile.name == name
+            ).one()
+
+    entry.sha256 = sha256
+    entry.size = size
+    entry.mime_type = mime_type
+    entry.updated_at = int(time.time())
+    db.commit()
+    return entry
+
+
+def iter_blobs():
+    """
+    Yields (name, path) for every file in the store: blobs are named by
+    their hash, derived files (thumbnails, .part) as "<sha256>.<suffix>".
+    """
+    if not os.path.isdir(BLOB_PATH):
+        return
+    for prefix in os.listdir(BLOB_PATH):
+        folder = os.path.join(BLOB_PATH, prefix)
+        if not os.path.isdir(folder):
+            continue
+        for name in os.listdir(folder):
+            yield name, os.path.join(folder, name)
+
+
+def gc(db, grace_seconds: int = GC_GRACE_SECONDS) -> dict:
+    """
+    Deletes blobs, and files derived from them, whose hash is referenced by
+    neither sim_files nor the document catalogue and that were not touched
+    within the grace period. Abandoned .part files are removed too.
+    """
+    referenced = {row.sha256 for row in db.query(models.SimFile.sha256).distinct()}
+    referenced.update(
+        row.sha256 for row in db.query(models.Document.sha256).filter(
+            models.Document.sha256 != None, models.Document.missing == False
+        ).distinct()
+    )
+    cutoff = time.time() - grace_seconds
+    result = {"scanned": 0, "removed": 0, "bytes_freed": 0}
+
+    for name, path in iter_blobs():
+        result["scanned"] += 1
+        if name.split(".", 1)[0] in referenced and not name.endswith(".part"):
+            continue
+        try:
+            stat = os.stat(path)
+            if stat.st_mtime > cutoff:
+                continue
+            os.remove(path)
+        except OSError:
+            continue
+        result["removed"] += 1
+        result["bytes_freed"] += stat.st_size
+    return result
+
+
+def import_legacy(db) -> int:
+    """
+    Moves files of the old drive_simulation/<username>/<filename> layout into
+    the blob store. Returns the number of files imported.
+    """
+    imported = 0
+    for username in os.listdir(DRIVE_SIM_PATH):
+        user_path = os.path.join(DRIVE_SIM_PATH, username)
+        if username.startswith(".") or not os.path.isdir(user_path):
+            continue
+        for name in os.listdir(user_path):
+            path = os.path.join(user_path, name)
+            if not os.path.isfile(path) or name.endswith(".part"):
+                continue
+            sha256, size, created = put_file(path, move=True)
+            save_file(db, username, name, sha256, size)
+            if not created:
+                os.remove(path)
+            imported += 1
+        if not os.listdir(user_path):
+            os.rmdir(user_path)
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the simulation blob store")
+    parser.add_argument("--gc", action="store_true", help="Delete unreferenced blobs")
+    parser.add_argument("--grace", type=int, default=GC_GRACE_SECONDS,
+                        help="Keep unreferenced blobs touched within this many seconds")
+    parser.add_argument("--import-legacy", action="store_true",
+                        help="Move drive_simulation/<username>/ files into the store")
+    args = parser.parse_args()
+    if not args.gc and not args.import_legacy:
+        parser.error("--gc or --import-legacy is required")
+
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        if args.import_legacy:
+            print(f"Imported {import_legacy(db)} files")
+        if args.gc:
+            print(json.dumps(gc(db, args.grace), indent=2))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
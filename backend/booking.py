@@ -0,0 +1,182 @@
+"""
+Counter appointments.
+
+A counter appointment is a step on the scheduler's "meson" resource (see
+scheduler.py) at a time the citizen picks: POST /appointments/book claims a
+free counter unit for that interval, and the time itself ("meson_horas",
+APPOINTMENT_SLOT_CAPACITY appointments per time, default 1), conditionally
+on the occupation it read. Concurrent requests for the last place of a time
+cannot both succeed, whichever worker or process serves them, and /book and
+/schedule never hand out the same counter twice. The bookable times are the
+counter's starts on that weekday (09:00-14:00 every 20 minutes by default),
+none on holidays.
+
+GET /appointments/availability answers a whole date range from one range
+scan of the counter occupation. Answers are cached per worker for
+APPOINTMENT_AVAILABILITY_TTL_SECONDS; bookings, scheduled visits and
+cancellations clear the worker's cache, other workers converge within the
+TTL.
+"""
+import datetime
+import os
+
+from sqlalchemy import and_, or_
+
+from . import models
+from .scheduler import scheduler, COUNTER, COUNTER_TIMES, InvalidTramite, NoAvailability
+from .utils.cache import TTLCache
+from .utils.rut import normalize_rut
+
+MAX_RANGE_DAYS = int(os.getenv("APPOINTMENT_AVAILABILITY_MAX_DAYS", "92"))
+BOOK_STEPS = [COUNTER, COUNTER_TIMES] # A counter, and a place at the time
+
+
+class InvalidSlot(ValueError):
+    pass
+
+
+class SlotUnavailable(Exception):
+    pass
+
+
+class AppointmentNotFound(LookupError):
+    pass
+
+
+class AlreadyBooked(Exception):
+    pass
+
+
+# (from, to) -> availability(); short-lived, cleared on every booking change
+availability_cache = TTLCache(
+    max_size=1000,
+    ttl=float(os.getenv("APPOINTMENT_AVAILABILITY_TTL_SECONDS", "15")),
+)
+
+
+def _parse_date(date: str) -> datetime.date:
+    try:
+        return datetime.date.fromisoformat(date)
+    except (TypeError, ValueError):
+        raise InvalidSlot("Fecha inválida, use YYYY-MM-DD")
+
+
+def available_times(db, date: str) -> list:
+    day = _parse_date(date)
+    return scheduler.free_times(db, BOOK_STEPS, day, day)[date]
+
+
+def book(db, rut: str, date: str, time: str):
+    """
+    Takes a counter at the given time and creates the appointment, atomically.
+    Raises InvalidSlot or SlotUnavailable (SchedulingConflict under heavy
+    contention). Commits.
+    """
+    day = _parse_date(date)
+    try:
+        appointment = scheduler.reserve_at(db, rut, BOOK_STEPS, day, time)
+    except InvalidTramite:
+        raise InvalidSlot("Horario no disponible")
+    except NoAvailability:
+        raise SlotUnavailable("Horario ya reservado")
+    availability_cache.clear()
+    return appointment
+
+
+def _other_appointment(db, appointment):
+    """
+    A confirmed appointment of the same citizen, from today on, made before
+    this one (ties broken by id).
+    """
+    return db.query(models.Appointment.id).filter(
+        models.Appointment.rut_key == appointment.rut_key,
+        models.Appointment.id != appointment.id,
+        models.Appointment.status == "CONFIRMED",
+        models.Appointment.date >= datetime.date.today().isoformat(),
+        or_(
+            models.Appointment.created_at < appointment.created_at,
+            and_(models.Appointment.created_at == appointment.created_at, models.Appointment.id < appointment.id)
+        )
+    ).first()
+
+
+def schedule(db, rut: str, steps, start: datetime.date = None, ordered: bool = True):
+    """
+    Schedules a visit (scheduler.schedule) for a citizen with no other
+    confirmed appointment. Returns (appointment, plan description). Raises
+    AlreadyBooked or what scheduler.schedule raises. Commits.
+    """
+    rut_key = normalize_rut(rut)
+    if db.query(models.Appointment.id).filter(
+        models.Appointment.rut_key == rut_key,
+        models.Appointment.status == "CONFIRMED",
+        models.Appointment.date >= datetime.date.today().isoformat()
+    ).first():
+        raise AlreadyBooked("Ya tiene una cita confirmada")
+    appointment, plan = scheduler.schedule(db, rut, steps, start, ordered)
+    availability_cache.clear()
+    # Two concurrent requests of the citizen both pass the check above: all but the first withdraw
+    if _other_appointment(db, appointment):
+        cancel(db, appointment.id, rut_key)
+        raise AlreadyBooked("Ya tiene una cita confirmada")
+    return appointment, plan
+
+
+def cancel(db, appointment_id: str, rut_key: str):
+    """
+    Cancels a confirmed appointment of the citizen and frees the resources
+    it holds. Raises AppointmentNotFound. Commits.
+    """
+    appointment = db.query(models.Appointment).filter(
+        models.Appointment.id == appointment_id,
+        models.Appointment.rut_key == rut_key,
+        models.Appointment.status == "CONFIRMED"
+    ).first()
+    if appointment is None:
+        raise AppointmentNotFound("Cita no encontrada")
+
+    # Conditional as well: of two concurrent cancellations only one frees the place
+    cancelled = db.query(models.Appointment).filter(
+        models.Appointment.id == appointment_id,
+        models.Appointment.status == "CONFIRMED"
+    ).update({"status": "CANCELLED"}, synchronize_session=False)
+    if cancelled != 1:
+        db.rollback()
+        raise AppointmentNotFound("Cita no encontrada")
+    try:
+        scheduler.release(db, appointment_id)
+    except Exception:
+        db.rollback()
+        raise
+    db.commit()
+    availability_cache.clear()
+    db.refresh(appointment)
+    return appointment
+
+
+def availability(db, start: str, end: str) -> dict:
+    """
+    Free counter times of every day from start to end (inclusive), from one
+    range query over the counter occupation.
+    """
+    first, last = _parse_date(start), _parse_date(end)
+    if last < first:
+        raise InvalidSlot("El rango de fechas es inválido")
+    if (last - first).days + 1 > MAX_RANGE_DAYS:
+        raise InvalidSlot(f"El rango no puede superar {MAX_RANGE_DAYS} días")
+
+    key = (start, end)
+    cached = availability_cache.get(key)
+    if cached is not None:
+        return cached
+
+    # Not stored if a booking change cleared the cache while the range was read
+    generation = availability_cache.generation()
+    free = scheduler.free_times(db, BOOK_STEPS, first, last)
+    result = {
+        "from": start,
+        "to": end,
+        "days": [{"date": date, "available": len(times), "slots": times} for date, times in free.items()],
+    }
+    availability_cache.set(key, result, generation)
+    return result
@@ -0,0 +1,314 @@
+"""
+Bulk notification campaigns ("lista para entrega", "próxima a vencer").
+
+Target licenses are selected with an indexed query, walked in id order in
+chunks. Each chunk is rendered from templates compiled once per campaign and
+bulk inserted into the email outbox in the same transaction that advances
+the campaign cursor. Delivery (pooled SMTP, throttling, retries) is done by
+the outbox sender. A single audit entry is written when the campaign is
+fully queued.
+
+One runner at a time: a runner holds the "campaign:<id>" lease (see
+leases.py), renewed before every chunk, and the cursor only advances from
+the value the runner read, so a runner whose lease ran out and was taken
+over stops instead of queueing the same chunk again.
+
+Usage:
+    python -m backend.campaigns ready_for_pickup
+    python -m backend.campaigns near_expiry --days 30
+    python -m backend.campaigns --resume <campaign_id>
+"""
+import argparse
+import datetime
+import json
+import os
+import time
+import uuid
+from string import Template
+
+from sqlalchemy import func
+
+from . import models, database, logger, leases
+
+CHUNK_SIZE = 500
+# Longer than queueing one chunk takes; a crashed runner's campaign can be resumed after this
+LEASE_SECONDS = int(os.getenv("CAMPAIGN_LEASE_SECONDS", "120"))
+
+
+class CampaignBusy(Exception):
+    """
+    Another runner holds the campaign.
+    """
+
+TEMPLATES = {
+    "ready_for_pickup": {
+        "subject": "Su Licencia está Lista - LicenciaManager",
+        "body": (
+            "Estimado/a $full_name,\n\n"
+            "Su licencia de conducir (RUT: $rut) ya se encuentra LISTA PARA ENTREGA en nuestras oficinas.\n\n"
+            "Por favor acérquese a retirar.\n\n"
+            "Atte,\nDepartamento de Tránsito"
+        ),
+    },
+    "near_expiry": {
+        "subject": "Su Licencia está Próxima a Vencer - LicenciaManager",
+        "body": (
+            "Estimado/a $full_name,\n\n"
+            "Le recordamos que el próximo control de su licencia de conducir (RUT: $rut) "
+            "es el $fecha_control.\n\n"
+            "Puede agendar su hora en el portal de la Municipalidad.\n\n"
+            "Atte,\nDepartamento de Tránsito"
+        ),
+    },
+}
+
+
+def render(kind: str, license) -> tuple:
+    """
+    Renders (subject, body) of a template for one license.
+    """
+    template = TEMPLATES[kind]
+    values = _template_values(license)
+    return Template(template["subject"]).safe_substitute(values), Template(template["body"]).safe_substitute(values)
+
+
+def _template_values(license) -> dict:
+    return {
+        "full_name": license.full_name or "",
+        "rut": license.rut or "",
+        "fecha_control": license.fecha_control or "",
+    }
+
+
+def default_filters(kind: str, days: int = 30) -> dict:
+    if kind == "ready_for_pickup":
+        return {"process_status": models.ProcessStatus.READY_FOR_PICKUP.value}
+    today = datetime.date.today()
+    return {
+        "control_date_from": today.isoformat(),
+        "control_date_to": (today + datetime.timedelta(days=days)).isoformat(),
+    }
+
+
+def target_query(db, filters: dict):
+    """
+    Licenses targeted by a campaign. process_status and fecha_control
+    filters are served by their (column, id) indexes.
+    """
+    query = db.query(models.License).filter(models.License.is_deleted == False)
+    if filters.get("process_status"):
+        query = query.filter(models.License.process_status == filters["process_status"])
+    if filters.get("status"):
+        query = query.filter(models.License.status == filters["status"])
+    if filters.get("control_date_from"):
+        query = query.filter(models.License.fecha_control >= filters["control_date_from"])
+    if filters.get("control_date_to"):
+        query = query.filter(models.License.fecha_control <= filters["control_date_to"])
+    return query
+
+
+def create_campaign(db, kind: str, filters: dict, username: str):
+    if kind not in TEMPLATES:
+        raise ValueError(f"Tipo de campaña desconocido: {kind}")
+    campaign = models.Campaign(
+        id=str(uuid.uuid4()),
+        kind=kind,
+        filters=json.dumps(filters),
+        status=models.CampaignStatus.RUNNING,
+        queued=0,
+        skipped=0,
+        created_by=username,
+    )
+    db.add(campaign)
+    db.commit()
+    return campaign
+
+
+def lease_name(campaign_id: str) -> str:
+    return f"campaign:{campaign_id}"
+
+
+def claim(db, campaign_id: str):
+    """
+    Takes the campaign's lease for a new runner. Returns the runner's owner
+    token, or None while another runner holds it.
+    """
+    owner = str(uuid.uuid4())
+    if not leases.acquire(db, lease_name(campaign_id), owner, LEASE_SECONDS):
+        return None
+    return owner
+
+
+def run_campaign(db, campaign_id: str, owner: str = None):
+    """
+    Queues the remaining recipients of a campaign, resuming from its cursor.
+    `owner` is the token of a claim() already made by the caller; without
+    it the campaign is claimed here. Raises CampaignBusy when another runner
+    holds the campaign.
+    """
+    if owner is None:
+        owner = claim(db, campaign_id)
+        if owner is None:
+            raise CampaignBusy(campaign_id)
+    try:
+        return _run_claimed(db, campaign_id, owner)
+    finally:
+        leases.release(db, lease_name(campaign_id), owner)
+
+
+def _run_claimed(db, campaign_id: str, owner: str):
+    campaign = db.query(models.Campaign).filter(models.Campaign.id == campaign_id).first()
+    if not campaign or campaign.status == models.CampaignStatus.QUEUED:
+        return campaign
+
+    campaign.status = models.CampaignStatus.RUNNING
+    db.commit()
+
+    template = TEMPLATES[campaign.kind]
+    subject = Template(template["subject"])
+    body = Template(template["body"])
+    query = target_query(db, json.loads(campaign.filters))
+    cursor = campaign.cursor
+
+    try:
+        while True:
+            if not leases.acquire(db, lease_name(campaign_id), owner, LEASE_SECONDS):
+                raise CampaignBusy(campaign_id)
+
+            chunk_query = query
+            if cursor:
+                chunk_query = chunk_query.filter(models.License.id > cursor)
+            licenses = chunk_query.order_by(models.License.id).limit(CHUNK_SIZE).all()
+            if not licenses:
+                break
+
+            now = int(time.time())
+            rows = []
+            skipped = 0
+            for license in licenses:
+                if not license.email:
+                    skipped += 1
+                    continue
+                values = _template_values(license)
+                rows.append({
+                    "id": str(uuid.uuid4()),
+                    "to_email": license.email,
+                    "subject": subject.safe_substitute(values),
+                    "body": body.safe_substitute(values),
+                    "status": models.EmailStatus.PENDING.value,
+                    "attempts": 0,
+                    "created_at": now,
+                    "next_attempt_at": now,
+                    "entity_id": license.id,
+                    "campaign_id": campaign.id,
+                })
+            if rows:
+                db.execute(models.EmailOutbox.__table__.insert(), rows)
+
+            # Outbox rows and cursor commit together, and the cursor only moves
+            # from where this runner read it: if another runner got here first
+            # the chunk is rolled back instead of queued twice
+            advanced = db.query(models.Campaign).filter(
+                models.Campaign.id == campaign_id,
+                models.Campaign.cursor == cursor if cursor else models.Campaign.cursor.is_(None)
+            ).update({
+                "cursor": licenses[-1].id,
+                "queued": models.Campaign.queued + len(rows),
+                "skipped": models.Campaign.skipped + skipped,
+            }, synchronize_session=False)
+            if not advanced:
+                db.rollback()
+                raise CampaignBusy(campaign_id)
+            db.commit()
+            cursor = licenses[-1].id
+    except CampaignBusy:
+        # Taken over by another runner, which owns the campaign status now
+        db.rollback()
+        print(f"⚠️ Campaign {campaign_id} taken over by another runner")
+        db.refresh(campaign)
+        return campaign
+    except Exception as e:
+        db.rollback()
+        db.refresh(campaign)
+        campaign.status = models.CampaignStatus.FAILED
+        campaign.last_error = str(e)[:500]
+        db.commit()
+        print(f"❌ Campaign {campaign.id} interrupted: {e}")
+        return campaign
+
+    db.refresh(campaign)
+    campaign.status = models.CampaignStatus.QUEUED
+    campaign.finished_at = int(time.time())
+    db.commit()
+
+    logger.log_action(
+        db, username=campaign.created_by, action="NOTIFICATION_CAMPAIGN",
+        details=f"Campaign {campaign.kind}: {campaign.queued} emails queued, {campaign.skipped} without email",
+        entity_id=campaign.id
+    )
+    return campaign
+
+
+def campaign_progress(db, campaign) -> dict:
+    """
+    Campaign state plus delivery counts of its outbox messages.
+    """
+    delivery = dict(
+        db.query(models.EmailOutbox.status, func.count(models.EmailOutbox.id))
+        .filter(models.EmailOutbox.campaign_id == campaign.id)
+        .group_by(models.EmailOutbox.status).all()
+    )
+    return {
+        "id": campaign.id,
+        "kind": campaign.kind,
+        "filters": json.loads(campaign.filters),
+        "status": campaign.status,
+        "queued": campaign.queued,
+        "skipped": campaign.skipped,
+        "delivery": delivery,
+        "created_by": campaign.created_by,
+        "created_at": campaign.created_at,
+        "finished_at": campaign.finished_at,
+        "last_error": campaign.last_error,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queue a bulk notification campaign")
+    parser.add_argument("kind", nargs="?", choices=sorted(TEMPLATES))
+    parser.add_argument("--days", type=int, default=30, help="near_expiry: controls within this many days")
+    parser.add_argument("--process-status", help="Override the process_status filter")
+    parser.add_argument("--status", help="Filter by license status")
+    parser.add_argument("--resume", metavar="CAMPAIGN_ID", help="Resume an interrupted campaign")
+    parser.add_argument("--username", default="SYSTEM")
+    args = parser.parse_args()
+
+    db = database.SessionLocal()
+    try:
+        if args.resume:
+            campaign_id = args.resume
+        elif args.kind:
+            filters = default_filters(args.kind, args.days)
+            if args.process_status:
+                filters["process_status"] = args.process_status
+            if args.status:
+                filters["status"] = args.status
+            campaign_id = create_campaign(db, args.kind, filters, args.username).id
+        else:
+            parser.error("kind or --resume is required")
+
+        try:
+            campaign = run_campaign(db, campaign_id)
+        except CampaignBusy:
+            print(f"Campaign {campaign_id} is being queued by another runner")
+            return
+        if not campaign:
+            print(f"Campaign {campaign_id} not found")
+            return
+        print(json.dumps(campaign_progress(db, campaign), indent=2, ensure_ascii=False))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
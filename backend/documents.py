@@ -0,0 +1,223 @@
+"""
+Document catalogue.
+
+Every finished upload is recorded in the documents table (owner, licence RUT,
+Drive id, size, SHA-256, mime type, time), so listing documents is an indexed
+query instead of a directory scan or an unpaginated Drive search.
+
+reconcile() compares the catalogue against the storage that is actually in
+use: files found in Drive or the simulation store without a catalogue entry
+are added, and entries whose file is gone are flagged as missing.
+
+Usage:
+    python -m backend.documents --reconcile
+"""
+import argparse
+import datetime
+import json
+import os
+import uuid
+
+from . import models, database, blob_store
+from .drive_client import drive_client, DRIVE_FOLDER_ID
+from .utils.rut import normalize_rut
+
+DRIVE_PAGE_SIZE = 1000
+UPDATE_CHUNK = 500
+DRIVE_RANGE_CHUNK = 4 * 1024 * 1024
+API_URL = os.getenv("PUBLIC_API_URL", "http://localhost:8000").rstrip("/")
+
+
+def content_url(document_id: str) -> str:
+    """
+    Download URL of a document (GET /drive/documents/{id}/content).
+    """
+    return f"{API_URL}/drive/documents/{document_id}/content"
+
+
+def etag(document) -> str:
+    """
+    Strong ETag of a document's content, or None when its hash is unknown.
+    """
+    return f'"{document.sha256}"' if document.sha256 else None
+
+
+def iter_drive_range(service, drive_id: str, start: int, end: int):
+    """
+    Yields bytes [start, end] of a Drive file with ranged media requests,
+    DRIVE_RANGE_CHUNK at a time. Blocking: iterate it in a thread pool.
+    """
+    position = start
+    while position <= end:
+        last = min(position + DRIVE_RANGE_CHUNK - 1, end)
+        request = service.files().get_media(fileId=drive_id)
+        request.headers["Range"] = f"bytes={position}-{last}"
+        chunk = request.execute()
+        if not chunk:
+            return
+        yield chunk
+        position += len(chunk)
+
+
+def record_upload(db, job, sha256: str):
+    """
+    Adds the catalogue entry of a finished UploadJob. Commits.
+    """
+    document_id = str(uuid.uuid4())
+    if job.mode == "simulation":
+        # Simulated files are served by the download endpoint
+        job.web_link = content_url(document_id)
+    document = models.Document(
+        id=document_id,
+        username=job.username,
+        name=job.file_name,
+        license_rut=job.license_rut,
+        drive_id=job.drive_id,
+        mode=job.mode,
+        size=job.size,
+        sha256=sha256,
+        mime_type=job.mime_type,
+        web_link=job.web_link,
+        upload_job_id=job.id,
+    )
+    db.add(document)
+    db.commit()
+    return document
+
+
+def filter_documents(query, username: str = None, rut: str = None, mime_type: str = None,
+                     mode: str = None, include_missing: bool = False):
+    """
+    Applies the /drive/list filters. username and rut are served by their
+    (column, created_at, id) indexes.
+    """
+    if username:
+        query = query.filter(models.Document.username == username)
+    if rut:
+        query = query.filter(models.Document.rut_key == normalize_rut(rut))
+    if mime_type:
+        query = query.filter(models.Document.mime_type == mime_type)
+    if mode:
+        query = query.filter(models.Document.mode == mode)
+    if not include_missing:
+        query = query.filter(models.Document.missing == False)
+    return query
+
+
+def _parse_drive_time(value: str) -> int:
+    if not value:
+        return None
+    return int(datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp())
+
+
+def _drive_files(service) -> dict:
+    """
+    All files the app can see in Drive, by id, fetched page by page.
+    """
+    query = "trashed = false and mimeType != 'application/vnd.google-apps.folder'"
+    if DRIVE_FOLDER_ID:
+        query += f" and '{DRIVE_FOLDER_ID}' in parents"
+    files = {}
+    page_token = None
+    while True:
+        results = service.files().list(
+            q=query, pageSize=DRIVE_PAGE_SIZE, pageToken=page_token,
+            fields="nextPageToken, files(id, name, mimeType, size, createdTime, webViewLink)"
+        ).execute()
+        for item in results.get("files", []):
+            files[item["id"]] = item
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            return files
+
+
+def _simulation_files(db) -> dict:
+    """
+    Simulation store entries whose blob exists, by id.
+    """
+    return {
+        entry.id: entry
+        for entry in db.query(models.SimFile).all()
+        if os.path.exists(blob_store.blob_path(entry.sha256))
+    }
+
+
+def _set_missing(db, ids: list, missing: bool):
+    for start in range(0, len(ids), UPDATE_CHUNK):
+        db.query(models.Document).filter(models.Document.id.in_(ids[start:start + UPDATE_CHUNK]))\
+            .update({"missing": missing}, synchronize_session=False)
+
+
+def reconcile(db, service=None) -> dict:
+    """
+    Brings the catalogue in line with the storage in use (Drive when a
+    service is given, otherwise the simulation store). Commits.
+    """
+    if service is not None:
+        mode = "real"
+        stored = _drive_files(service)
+    else:
+        mode = "simulation"
+        stored = _simulation_files(db)
+
+    entries = db.query(models.Document.id, models.Document.drive_id, models.Document.sha256,
+                       models.Document.missing).filter(models.Document.mode == mode).all()
+
+    def present(entry) -> bool:
+        if entry.drive_id not in stored:
+            return False
+        # A simulation file re-uploaded with new content keeps its id; older
+        # versions are only present while their blob is
+        return mode == "real" or os.path.exists(blob_store.blob_path(entry.sha256))
+
+    gone, back = [], []
+    for entry in entries:
+        is_present = present(entry)
+        if not is_present and not entry.missing:
+            gone.append(entry.id)
+        elif is_present and entry.missing:
+            back.append(entry.id)
+    _set_missing(db, gone, True)
+    _set_missing(db, back, False)
+
+    known = {entry.drive_id for entry in entries}
+    added = 0
+    for drive_id, item in stored.items():
+        if drive_id in known:
+            continue
+        if mode == "real":
+            document = models.Document(
+                id=str(uuid.uuid4()), username=None, name=item.get("name"), drive_id=drive_id,
+                mode=mode, size=int(item.get("size") or 0), mime_type=item.get("mimeType"),
+                web_link=item.get("webViewLink"), created_at=_parse_drive_time(item.get("createdTime")),
+            )
+        else:
+            document_id = str(uuid.uuid4())
+            document = models.Document(
+                id=document_id, username=item.username, name=item.name, drive_id=drive_id,
+                mode=mode, size=item.size, sha256=item.sha256, mime_type=item.mime_type,
+                web_link=content_url(document_id), created_at=item.updated_at,
+            )
+        db.add(document)
+        added += 1
+    db.commit()
+
+    return {"mode": mode, "checked": len(entries), "added": added, "missing": len(gone), "restored": len(back)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the document catalogue")
+    parser.add_argument("--reconcile", action="store_true", help="Reconcile the catalogue against storage")
+    args = parser.parse_args()
+    if not args.reconcile:
+        parser.error("--reconcile is required")
+
+    db = database.SessionLocal()
+    try:
+        print(json.dumps(reconcile(db, drive_client.get_service()), indent=2))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Process-wide Google Drive client.
+
+The Drive service is built once per worker from the static discovery document
+bundled with google-api-python-client (no discovery fetch), and rebuilt only
+when credentials.json changes. HTTP connections are reused per thread:
+httplib2 is not thread-safe, so every thread gets its own authorized
+transport while sharing the parsed service and credentials.
+
+state() reports whether the worker runs against real Drive or the local
+simulation, so requests no longer re-read the credentials file to decide.
+
+DRIVE_API_ENDPOINT points the client at another Drive endpoint (e.g.
+fake_drive_server.py); batch_uri() derives the batch endpoint from it or
+from the discovery document.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from urllib.parse import urljoin
+
+import google_auth_httplib2
+import httplib2
+from google.oauth2 import service_account
+from googleapiclient.discovery import build
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import HttpRequest
+
+CREDENTIALS_FILE = os.path.join(os.path.dirname(__file__), "credentials.json")
+SCOPES = ['https://www.googleapis.com/auth/drive.file']
+HTTP_TIMEOUT = float(os.getenv("DRIVE_HTTP_TIMEOUT_SECONDS", "60"))
+# How often the credentials file is stat()ed for changes
+CHECK_INTERVAL = float(os.getenv("DRIVE_CREDENTIALS_CHECK_SECONDS", "5"))
+
+# Service endpoint, e.g. http://localhost:8080/drive/v3/ (empty: Google's)
+API_ENDPOINT = os.getenv("DRIVE_API_ENDPOINT", "")
+
+# Local storage used when Drive is not configured or fails
+DRIVE_SIM_PATH = "drive_simulation"
+# If you want a specific folder in Drive, set ID here. PROD: Load from ENV
+DRIVE_FOLDER_ID = None
+
+MODE_REAL = "real"
+MODE_SIMULATION = "simulation"
+
+
+@functools.lru_cache(maxsize=None)
+def _discovery() -> dict:
+    return json.loads(get_static_doc('drive', 'v3'))
+
+
+def batch_uri(api_endpoint: str = API_ENDPOINT) -> str:
+    """
+    Batch endpoint of the Drive API: the discovery document's batchPath
+    under its rootUrl, or under the host of api_endpoint when given.
+    """
+    root = urljoin(api_endpoint, "/") if api_endpoint else _discovery()['rootUrl']
+    return urljoin(root, _discovery()['batchPath'])
+
+
+class DriveClient:
+
+    def __init__(self, credentials_file: str = CREDENTIALS_FILE):
+        self.credentials_file = credentials_file
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._service = None
+        self._credentials = None
+        self._signature = None
+        self._checked_at = 0.0
+        self.mode = MODE_SIMULATION
+        self.reason = "not initialised"
+        self.built_at = None
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.credentials_file)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def _thread_http(self, credentials):
+        """
+        Authorized httplib2 transport owned by the calling thread,
+        reused across requests (keep-alive connections).
+        """
+        http = getattr(self._local, "http", None)
+        if http is None or getattr(self._local, "credentials", None) is not credentials:
+            http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+            self._local.http = http
+            self._local.credentials = credentials
+        return http
+
+    def _build(self, signature):
+        """
+        Builds the service for the credentials file as of signature.
+        Returns (service, credentials, mode, reason); changes nothing.
+        """
+        if signature is None:
+            return None, None, MODE_SIMULATION, f"Credentials not found at {self.credentials_file}"
+
+        try:
+            with open(self.credentials_file, 'r') as f:
+                content = json.load(f)
+            if "project_id" not in content and "INSTRUCCIONES" in content:
+                return None, None, MODE_SIMULATION, "Credentials file is placeholder"
+
+            credentials = service_account.Credentials.from_service_account_info(content, scopes=SCOPES)
+
+            def build_request(http, *args, **kwargs):
+                # Ignore the http the service was built with and use this thread's own
+                return HttpRequest(self._thread_http(credentials), *args, **kwargs)
+
+            service = build(
+                'drive', 'v3',
+                http=google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http(timeout=HTTP_TIMEOUT)),
+                requestBuilder=build_request,
+                static_discovery=True,
+                cache_discovery=False,
+                client_options={"api_endpoint": API_ENDPOINT} if API_ENDPOINT else None,
+            )
+            return service, credentials, MODE_REAL, "ok"
+        except Exception as e:
+            return None, None, MODE_SIMULATION, f"Failed to create Drive Service: {e}"
+
+    def get_service(self):
+        """
+        Returns the shared Drive service, or None in simulation mode.
+        A rebuild happens under the lock and is swapped in whole, so callers
+        that skip the check keep getting the previous service meanwhile.
+        """
+        now = time.monotonic()
+        if now - self._checked_at >= CHECK_INTERVAL:
+            signature = self._file_signature()
+            with self._lock:
+                self._checked_at = now
+                if signature != self._signature or self.built_at is None:
+                    service, credentials, mode, reason = self._build(signature)
+                    self._service, self._credentials = service, credentials
+                    self.mode, self.reason = mode, reason
+                    self._signature = signature
+                    self.built_at = time.time()
+                    print(f"Drive client: {self.mode} ({self.reason})")
+        return self._service
+
+    def refresh(self):
+        """
+        Forces a rebuild on the next get_service() call.
+        """
+        with self._lock:
+            self._checked_at = 0.0
+            self.built_at = None
+
+    def state(self) -> dict:
+        self.get_service()
+        return {
+            "mode": self.mode,
+            "reason": self.reason,
+            "credentials_file": self.credentials_file,
+            "built_at": self.built_at,
+        }
+
+
+drive_client = DriveClient()
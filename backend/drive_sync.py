@@ -0,0 +1,474 @@
+"""
+Incremental mirror of the LICENCIA_MANAGER_SYSTEM tree in Google Drive.
+
+The first cycle makes sure the folder structure exists, walks the tree once
+and saves a changes page token taken before the walk. Every later cycle only
+reads the Drive changes feed from the saved token and applies the deltas to
+the drive_mirror table; the token is saved together with each page of
+changes, so an interrupted cycle resumes where it stopped.
+
+Folder lookups and creations are sent as batched HTTP requests (one batch per
+tree level instead of one request per folder) and the resulting folder ids
+are cached in sync_state, so a cycle normally issues a single changes.list.
+
+Only one worker runs a cycle at a time (the "drive_sync" lease, see
+leases.py). The lease is renewed with every page, in the transaction that
+writes it, so a long walk or changes backlog keeps it; a cycle that finds it
+taken over stops. The background loop, and POST /drive/sync, run cycles
+through DriveSyncer.run_once(); the loop runs every
+DRIVE_SYNC_INTERVAL_SECONDS when Drive is configured (0 disables it).
+
+Usage:
+    python -m backend.drive_sync            # one cycle
+    python -m backend.drive_sync --reset    # forget the token, full resync
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+
+from googleapiclient.http import BatchHttpRequest
+
+from . import models, database, leases
+from .drive_client import drive_client, batch_uri as drive_batch_uri
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+ROOT_FOLDER = 'LICENCIA_MANAGER_SYSTEM'
+
+FOLDER_STRUCTURE = {
+    'name': ROOT_FOLDER,
+    'subfolders': [
+        {
+            'name': '01_ESCANEADAS_PENDIENTES',
+            'subfolders': [
+                {'name': 'JUAN_PEREZ'},
+                {'name': 'MARIA_GONZALEZ'},
+                {'name': 'PEDRO_SOTO'},
+                {'name': 'ANA_ROJAS'}
+            ]
+        },
+        {
+            'name': '02_BASE_DATOS_EXCEL',
+            'subfolders': []
+        },
+        {
+            'name': '03_SUBIDAS_CONASET',
+            'subfolders': []
+        }
+    ]
+}
+
+BATCH_LIMIT = 100 # Drive accepts at most 100 calls per batch request
+PAGE_SIZE = 1000
+PARENTS_PER_QUERY = 25 # Folders listed together in one "'a' in parents or ..." query
+FILE_FIELDS = "id, name, mimeType, parents, size, md5Checksum, modifiedTime, trashed"
+SYNC_LEASE = "drive_sync"
+LEASE_SECONDS = 300
+SYNC_INTERVAL = float(os.getenv("DRIVE_SYNC_INTERVAL_SECONDS", "0"))
+
+
+def get_state(db, key: str):
+    row = db.query(models.SyncState).filter(models.SyncState.key == key).first()
+    return row.value if row else None
+
+
+def set_state(db, key: str, value: str):
+    """
+    Stores a sync_state value. Does not commit.
+    """
+    row = db.query(models.SyncState).filter(models.SyncState.key == key).first()
+    if row is None:
+        row = models.SyncState(key=key)
+        db.add(row)
+    row.value = value
+    row.updated_at = int(time.time())
+
+
+class LeaseLost(Exception):
+    """
+    Another worker took the sync lease over during the cycle.
+    """
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+class DriveMirror:
+
+    def __init__(self, service, structure: dict = FOLDER_STRUCTURE, batch_uri: str = None,
+                 lease_owner: str = None):
+        self.service = service
+        self.structure = structure
+        self.batch_uri = batch_uri or drive_batch_uri()
+        # When set, the sync lease is renewed with every page written
+        self.lease_owner = lease_owner
+
+    def _renew_lease(self, db):
+        if self.lease_owner is not None and not leases.renew(db, SYNC_LEASE, self.lease_owner, LEASE_SECONDS):
+            raise LeaseLost(self.lease_owner)
+
+    def _execute_batch(self, requests: list) -> list:
+        """
+        Executes Drive requests as batches of BATCH_LIMIT.
+        Returns the responses in request order; raises the first error.
+        """
+        results = [None] * len(requests)
+        errors = []
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                errors.append(exception)
+            else:
+                results[int(request_id)] = response
+
+        for start in range(0, len(requests), BATCH_LIMIT):
+            batch = BatchHttpRequest(callback=callback, batch_uri=self.batch_uri)
+            for index in range(start, min(start + BATCH_LIMIT, len(requests))):
+                batch.add(requests[index], request_id=str(index))
+            batch.execute()
+        if errors:
+            raise errors[0]
+        return results
+
+    # --- Folder structure ---
+
+    def ensure_structure(self, db) -> dict:
+        """
+        Makes sure every folder of the structure exists and returns their
+        ids by path ("A/B/C"). Cached ids are reused; the rest are looked up,
+        and created when missing, one batch per tree level. Commits.
+        Without a db session nothing is cached.
+        """
+        files = self.service.files()
+        folders = {}
+        level = [(self.structure, self.structure['name'], None)]
+
+        while level:
+            unresolved = []
+            for node, path, parent_id in level:
+                cached = get_state(db, f"folder:{path}") if db is not None else None
+                if cached:
+                    folders[path] = cached
+                else:
+                    unresolved.append((node, path, parent_id))
+
+            lookups = []
+            for node, path, parent_id in unresolved:
+                query = f"name = {_quote(node['name'])} and mimeType = '{FOLDER_MIME}' and trashed = false"
+                if parent_id:
+                    query += f" and {_quote(parent_id)} in parents"
+                lookups.append(files.list(q=query, pageSize=1, fields="files(id)"))
+
+            missing = []
+            for (node, path, parent_id), response in zip(unresolved, self._execute_batch(lookups)):
+                found = response.get('files', [])
+                if found:
+                    folders[path] = found[0]['id']
+                else:
+                    missing.append((node, path, parent_id))
+
+            creations = []
+            for node, path, parent_id in missing:
+                metadata = {'name': node['name'], 'mimeType': FOLDER_MIME}
+                if parent_id:
+                    metadata['parents'] = [parent_id]
+                creations.append(files.create(body=metadata, fields='id'))
+            for (node, path, parent_id), response in zip(missing, self._execute_batch(creations)):
+                folders[path] = response['id']
+                print(f"✨ Carpeta creada: {path}")
+
+            if db is not None:
+                for node, path, parent_id in unresolved:
+                    set_state(db, f"folder:{path}", folders[path])
+
+            level = [
+                (child, f"{path}/{child['name']}", folders[path])
+                for node, path, parent_id in level
+                for child in node.get('subfolders', [])
+            ]
+
+        if db is not None:
+            db.commit()
+        return folders
+
+    def _forget_folder(self, db, file_id: str):
+        """
+        Drops cached folder ids pointing at a removed folder.
+        """
+        db.query(models.SyncState).filter(
+            models.SyncState.key.like("folder:%"),
+            models.SyncState.value == file_id
+        ).delete(synchronize_session=False)
+
+    # --- Mirror ---
+
+    def _upsert(self, db, item: dict, parent_id: str):
+        entry = db.query(models.DriveMirrorEntry).filter(models.DriveMirrorEntry.id == item['id']).first()
+        if entry is None:
+            entry = models.DriveMirrorEntry(id=item['id'])
+            db.add(entry)
+        entry.name = item.get('name')
+        entry.mime_type = item.get('mimeType')
+        entry.parent_id = parent_id
+        entry.size = int(item['size']) if item.get('size') else None
+        entry.md5 = item.get('md5Checksum')
+        entry.modified_time = item.get('modifiedTime')
+        entry.synced_at = int(time.time())
+        return entry
+
+    def _list_children(self, parent_ids: list):
+        """
+        Yields the non-trashed children of the given folders. The first page
+        of every group of parents is fetched in one batch.
+        """
+        files = self.service.files()
+        groups = [parent_ids[i:i + PARENTS_PER_QUERY] for i in range(0, len(parent_ids), PARENTS_PER_QUERY)]
+        queries = [
+            "(" + " or ".join(f"{_quote(parent)} in parents" for parent in group) + ") and trashed = false"
+            for group in groups
+        ]
+        fields = f"nextPageToken, files({FILE_FIELDS})"
+
+        first_pages = self._execute_batch([
+            files.list(q=query, pageSize=PAGE_SIZE, fields=fields) for query in queries
+        ])
+        for query, response in zip(queries, first_pages):
+            while True:
+                yield from response.get('files', [])
+                page_token = response.get('nextPageToken')
+                if not page_token:
+                    break
+                response = files.list(q=query, pageSize=PAGE_SIZE, pageToken=page_token, fields=fields).execute()
+
+    def _walk(self, db, folder_ids: list, known: set) -> int:
+        """
+        Mirrors everything below the given folders. Returns the entries written.
+        """
+        written = 0
+        frontier = list(folder_ids)
+        while frontier:
+            next_frontier = []
+            self._renew_lease(db)
+            for item in self._list_children(frontier):
+                parent_id = next((p for p in item.get('parents', []) if p in known), None)
+                self._upsert(db, item, parent_id)
+                written += 1
+                if written % PAGE_SIZE == 0:
+                    self._renew_lease(db)
+                if item.get('mimeType') == FOLDER_MIME:
+                    known.add(item['id'])
+                    next_frontier.append(item['id'])
+            frontier = next_frontier
+        return written
+
+    def _remove_subtree(self, db, file_id: str) -> int:
+        removed = 0
+        frontier = [file_id]
+        while frontier:
+            children = [row.id for row in db.query(models.DriveMirrorEntry.id).filter(
+                models.DriveMirrorEntry.parent_id.in_(frontier)
+            ).all()]
+            removed += db.query(models.DriveMirrorEntry).filter(
+                models.DriveMirrorEntry.id.in_(frontier)
+            ).delete(synchronize_session=False)
+            frontier = children
+        return removed
+
+    def full_sync(self, db, root_id: str) -> dict:
+        """
+        Rebuilds the mirror from a full walk of the tree. Commits.
+        """
+        # Token first: changes made during the walk are replayed next cycle
+        token = self.service.changes().getStartPageToken().execute()['startPageToken']
+
+        db.query(models.DriveMirrorEntry).delete(synchronize_session=False)
+        root = self.service.files().get(fileId=root_id, fields=FILE_FIELDS).execute()
+        self._upsert(db, root, None)
+        written = 1 + self._walk(db, [root_id], {root_id})
+
+        set_state(db, "page_token", token)
+        set_state(db, "root_id", root_id)
+        db.commit()
+        return {"mode": "full", "entries": written}
+
+    def _in_tree(self, db, item: dict, root_id: str):
+        """
+        Parent through which the item belongs to the mirrored tree, or None.
+        """
+        for parent in item.get('parents', []):
+            if parent == root_id or db.query(models.DriveMirrorEntry.id).filter(
+                    models.DriveMirrorEntry.id == parent).first():
+                return parent
+        return None
+
+    def _apply(self, db, change: dict, root_id: str) -> None:
+        file_id = change['fileId']
+        item = change.get('file')
+        entry = db.query(models.DriveMirrorEntry).filter(models.DriveMirrorEntry.id == file_id).first()
+
+        if change.get('removed') or not item or item.get('trashed'):
+            if entry is not None:
+                self._remove_subtree(db, file_id)
+            self._forget_folder(db, file_id)
+            return
+
+        if file_id == root_id:
+            self._upsert(db, item, None)
+            return
+
+        parent_id = self._in_tree(db, item, root_id)
+        if parent_id is None:
+            # Moved out of the tree (or never in it)
+            if entry is not None:
+                self._remove_subtree(db, file_id)
+            return
+
+        self._upsert(db, item, parent_id)
+        if entry is None and item.get('mimeType') == FOLDER_MIME:
+            # A folder moved in brings its contents, which raise no changes of their own
+            self._walk(db, [file_id], {file_id})
+
+    def sync_changes(self, db, root_id: str) -> dict:
+        """
+        Applies the changes since the saved page token. Commits per page.
+        """
+        token = get_state(db, "page_token")
+        applied = 0
+        fields = f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}))"
+        while True:
+            response = self.service.changes().list(
+                pageToken=token, pageSize=PAGE_SIZE, spaces='drive', fields=fields
+            ).execute()
+            for change in response.get('changes', []):
+                self._apply(db, change, root_id)
+                applied += 1
+            token = response.get('nextPageToken') or response['newStartPageToken']
+            # The page's deltas, the token and the lease renewal commit together
+            set_state(db, "page_token", token)
+            self._renew_lease(db)
+            db.commit()
+            if 'newStartPageToken' in response:
+                return {"mode": "incremental", "changes": applied}
+
+    def sync(self, db) -> dict:
+        """
+        One sync cycle: folder structure, then a full walk on first run (or
+        when the root folder changed) and the changes feed otherwise.
+        """
+        folders = self.ensure_structure(db)
+        root_id = folders[self.structure['name']]
+        if get_state(db, "page_token") is None or get_state(db, "root_id") != root_id:
+            result = self.full_sync(db, root_id)
+        else:
+            result = self.sync_changes(db, root_id)
+        # The root may have been trashed by this cycle's changes
+        if get_state(db, f"folder:{self.structure['name']}") is None:
+            set_state(db, "root_id", "")
+            db.commit()
+        result["folders"] = len(folders)
+        return result
+
+    def reset(self, db):
+        db.query(models.SyncState).delete(synchronize_session=False)
+        db.query(models.DriveMirrorEntry).delete(synchronize_session=False)
+        db.commit()
+
+
+class DriveSyncer:
+    """
+    Background loop running a sync cycle every `interval` seconds.
+    """
+
+    def __init__(self, session_factory=database.SessionLocal, interval: float = SYNC_INTERVAL):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.owner = str(uuid.uuid4())
+        self._stop = threading.Event()
+        self._thread = None
+        self._cycle_lock = threading.Lock()
+        self.last_result = None
+
+    def run_once(self):
+        """
+        One cycle, unless another one is running (in this worker or, per
+        the lease, in another). Returns its result, or None if skipped.
+        """
+        service = drive_client.get_service()
+        if service is None:
+            return None
+        # The loop and POST /drive/sync share the owner, so the lease alone cannot tell them apart
+        if not self._cycle_lock.acquire(blocking=False):
+            return None
+        db = self.session_factory()
+        try:
+            if not leases.acquire(db, SYNC_LEASE, self.owner, LEASE_SECONDS):
+                return None
+            try:
+                self.last_result = DriveMirror(service, lease_owner=self.owner).sync(db)
+                return self.last_result
+            finally:
+                db.rollback()
+                leases.release(db, SYNC_LEASE, self.owner)
+        finally:
+            db.close()
+            self._cycle_lock.release()
+
+    def running(self, db) -> bool:
+        """
+        Whether a cycle is running in this worker or holds the lease elsewhere.
+        """
+        return self._cycle_lock.locked() or leases.holder(db, SYNC_LEASE) is not None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"❌ Drive sync cycle failed: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self.interval > 0 and (self._thread is None or not self._thread.is_alive()):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="drive-sync", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+drive_syncer = DriveSyncer()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync the local mirror of the Drive folder tree")
+    parser.add_argument("--reset", action="store_true", help="Forget the page token and cached ids first")
+    args = parser.parse_args()
+
+    service = drive_client.get_service()
+    if service is None:
+        print(f"Drive not configured: {drive_client.reason}")
+        return
+
+    models.Base.metadata.create_all(bind=database.engine)
+    if args.reset:
+        db = database.SessionLocal()
+        try:
+            DriveMirror(service).reset(db)
+        finally:
+            db.close()
+    result = drive_syncer.run_once()
+    if result is None:
+        print("Another worker is syncing, try again later")
+    else:
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
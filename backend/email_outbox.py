@@ -0,0 +1,230 @@
+"""
+Background sender for the email_outbox table.
+
+Each cycle claims a batch of due messages, delivers them over a single
+authenticated SMTP session at no more than EMAIL_MAX_PER_SECOND, and records
+the outcome per message. Failures are retried with exponential backoff up to
+EMAIL_MAX_ATTEMPTS.
+
+Only one sender delivers at a time, so EMAIL_MAX_PER_SECOND is the rate of
+the whole deployment, not of each gunicorn worker: every worker runs a
+sender, but a sender only works while it holds the "email_sender" lease
+(see leases.py). The holder renews it before every message and abandons the
+rest of its batch if the renewal fails. The others stand by and take over
+within SENDER_LEASE_SECONDS if the holder dies.
+
+Claims are safe across processes as well: a sender stamps its claim_token on
+rows that are still due and pushes next_attempt_at forward by the lease, so
+another sender will not pick them up unless this one dies mid-batch.
+
+Usage (standalone sender process):
+    python -m backend.email_outbox
+"""
+import os
+import smtplib
+import threading
+import time
+import uuid
+
+from . import models, database, leases
+from .utils import email
+
+BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "50"))
+POLL_SECONDS = float(os.getenv("EMAIL_POLL_SECONDS", "5"))
+MAX_PER_SECOND = float(os.getenv("EMAIL_MAX_PER_SECOND", "5"))
+MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+BACKOFF_SECONDS = int(os.getenv("EMAIL_BACKOFF_SECONDS", "60"))
+LEASE_SECONDS = 600
+SENDER_LEASE = "email_sender"
+SENDER_LEASE_SECONDS = int(os.getenv("EMAIL_SENDER_LEASE_SECONDS", "60"))
+
+
+def backoff_delay(attempts: int) -> int:
+    return BACKOFF_SECONDS * 2 ** (attempts - 1)
+
+
+class OutboxSender:
+
+    def __init__(self, session_factory=database.SessionLocal, connect=email.open_smtp_connection,
+                 batch_size: int = BATCH_SIZE, max_per_second: float = MAX_PER_SECOND):
+        self.session_factory = session_factory
+        self.connect = connect
+        self.batch_size = batch_size
+        self.min_interval = 1.0 / max_per_second if max_per_second > 0 else 0
+        # Renewed before every message, so it only has to cover one send
+        self.lease_seconds = max(SENDER_LEASE_SECONDS, 2 * self.min_interval)
+        self.owner = str(uuid.uuid4())
+        self._stop = threading.Event()
+        self._thread = None
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def claim(self, db) -> list:
+        """
+        Claims up to batch_size due messages for this sender.
+        """
+        now = int(time.time())
+        token = str(uuid.uuid4())
+        due_ids = [row.id for row in db.query(models.EmailOutbox.id).filter(
+            models.EmailOutbox.status == models.EmailStatus.PENDING,
+            models.EmailOutbox.next_attempt_at <= now
+        ).order_by(models.EmailOutbox.next_attempt_at).limit(self.batch_size).all()]
+        if not due_ids:
+            return []
+
+        # Conditional update: rows claimed by another worker meanwhile no longer match
+        db.query(models.EmailOutbox).filter(
+            models.EmailOutbox.id.in_(due_ids),
+            models.EmailOutbox.status == models.EmailStatus.PENDING,
+            models.EmailOutbox.next_attempt_at <= now
+        ).update({"claim_token": token, "next_attempt_at": now + LEASE_SECONDS}, synchronize_session=False)
+        db.commit()
+
+        return db.query(models.EmailOutbox).filter(models.EmailOutbox.claim_token == token).all()
+
+    def _deliver(self, server, message) -> None:
+        if server is None:
+            # Mock mode (no SMTP credentials configured)
+            print(f"--- MOCK EMAIL --- To: {message.to_email} | Subject: {message.subject}")
+            return
+        server.sendmail(email.SMTP_FROM, message.to_email,
+                        email.build_message(message.to_email, message.subject, message.body))
+
+    def _record_failure(self, message, error: Exception):
+        message.attempts = (message.attempts or 0) + 1
+        message.last_error = str(error)[:500]
+        message.claim_token = None
+        if message.attempts >= MAX_ATTEMPTS:
+            message.status = models.EmailStatus.FAILED
+            self.failed += 1
+        else:
+            message.next_attempt_at = int(time.time()) + backoff_delay(message.attempts)
+            self.retried += 1
+
+    def _release(self, message):
+        # Give the claim back so the message is picked up again
+        message.claim_token = None
+        message.next_attempt_at = int(time.time())
+
+    def send_batch(self) -> int:
+        """
+        Claims and sends one batch. Returns the number of messages processed.
+        """
+        db = self.session_factory()
+        try:
+            if not leases.acquire(db, SENDER_LEASE, self.owner, self.lease_seconds):
+                # Another worker is the sender
+                return 0
+            messages = self.claim(db)
+            if not messages:
+                return 0
+
+            server = None
+            if not email.is_mock_mode():
+                try:
+                    server = self.connect()
+                except Exception as e:
+                    print(f"❌ SMTP connection failed: {e}")
+                    for message in messages:
+                        self._record_failure(message, e)
+                    db.commit()
+                    return len(messages)
+
+            last_send = 0.0
+            try:
+                lease_lost = False
+                for message in messages:
+                    if self._stop.is_set() or lease_lost:
+                        self._release(message)
+                        continue
+                    if not leases.acquire(db, SENDER_LEASE, self.owner, self.lease_seconds):
+                        # Another worker took over: it may claim these rows as soon as they expire
+                        print("⚠️ Email sender lease lost, stopping the batch")
+                        lease_lost = True
+                        self._release(message)
+                        continue
+
+                    wait = self.min_interval - (time.monotonic() - last_send)
+                    if wait > 0:
+                        time.sleep(wait)
+                    last_send = time.monotonic()
+
+                    try:
+                        try:
+                            self._deliver(server, message)
+                        except smtplib.SMTPServerDisconnected:
+                            # The pooled session dropped: reconnect once and retry
+                            server = self.connect()
+                            self._deliver(server, message)
+                        message.status = models.EmailStatus.SENT
+                        message.sent_at = int(time.time())
+                        message.attempts = (message.attempts or 0) + 1
+                        message.last_error = None
+                        message.claim_token = None
+                        self.sent += 1
+                    except Exception as e:
+                        print(f"Failed to send email {message.id}: {e}")
+                        self._record_failure(message, e)
+                    # Persist each outcome so a crash does not resend delivered mail
+                    db.commit()
+            finally:
+                if server is not None:
+                    try:
+                        server.quit()
+                    except Exception:
+                        pass
+            db.commit()
+            return len(messages)
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                processed = self.send_batch()
+            except Exception as e:
+                print(f"❌ Email outbox cycle failed: {e}")
+                processed = 0
+            if processed < self.batch_size:
+                self._stop.wait(POLL_SECONDS)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+            # Hand the role over now instead of when the lease runs out
+            db = self.session_factory()
+            try:
+                leases.release(db, SENDER_LEASE, self.owner)
+            except Exception as e:
+                print(f"Failed to release the email sender lease: {e}")
+            finally:
+                db.close()
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "failed": self.failed, "retried": self.retried, "owner": self.owner}
+
+
+outbox_sender = OutboxSender()
+
+
+def main():
+    print("Email outbox sender running (Ctrl+C to stop)")
+    outbox_sender.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        outbox_sender.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+Normalisation of uploaded licence photos.
+
+Phone photos arrive as 4-12 MB JPEG/HEIC/PNG files, far more than the model
+or the archive need. Before analysis (and, optionally, before the Drive
+upload) an image is oriented according to its EXIF tag, downscaled so its
+longest side is at most IMAGE_PREP_MAX_SIDE, re-encoded as IMAGE_PREP_FORMAT
+and stripped of its metadata (EXIF, GPS position, ICC profile, text chunks).
+Greyscale scans stay greyscale. Images under IMAGE_PREP_MIN_BYTES and PDFs
+are left alone.
+
+Decoding and encoding are CPU-bound and run in a small process pool
+(IMAGE_PREP_WORKERS processes per API worker, niced), like thumbnails.py.
+Normalisation is an optimisation: when the queue is full, the image cannot
+be decoded or the timeout passes, the original is used.
+
+    IMAGE_PREP_AI       normalise scans sent to the model (default on)
+    IMAGE_PREP_DRIVE    normalise images stored in Drive (default off: the
+                        original photo is archived)
+
+Pillow is required; HEIC/HEIF support needs pillow-heif and is skipped
+without it.
+"""
+import asyncio
+import io
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+MAX_SIDE = int(os.getenv("IMAGE_PREP_MAX_SIDE", "2048"))
+FORMAT = os.getenv("IMAGE_PREP_FORMAT", "webp")
+QUALITY = int(os.getenv("IMAGE_PREP_QUALITY", "82"))
+MIN_BYTES = int(os.getenv("IMAGE_PREP_MIN_BYTES", str(512 * 1024)))
+MAX_WORKERS = int(os.getenv("IMAGE_PREP_WORKERS", "1"))
+MAX_PENDING = int(os.getenv("IMAGE_PREP_QUEUE_SIZE", "20"))
+TIMEOUT_SECONDS = float(os.getenv("IMAGE_PREP_TIMEOUT_SECONDS", "30"))
+FOR_AI = os.getenv("IMAGE_PREP_AI", "1") == "1"
+FOR_DRIVE = os.getenv("IMAGE_PREP_DRIVE", "0") == "1"
+
+FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+EXTENSIONS = {"webp": ".webp", "jpeg": ".jpg"}
+HEIF_TYPES = ("image/heic", "image/heif")
+MAX_PIXELS = 80_000_000 # Refuse decompression bombs
+
+try:
+    import pillow_heif
+except ImportError:
+    pillow_heif = None
+
+
+def _init_worker():
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+    if pillow_heif is not None:
+        pillow_heif.register_heif_opener()
+
+
+def normalize(source, target, max_side: int = MAX_SIDE, fmt: str = FORMAT, quality: int = QUALITY) -> dict:
+    """
+    Writes the normalised image of source (a path or file object) to target
+    (a path or file object). Runs in the pool. Returns its dimensions.
+    """
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    with Image.open(source) as original:
+        original.draft(original.mode if original.mode in ("RGB", "L") else "RGB", (max_side, max_side))
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.thumbnail((max_side, max_side))
+        options = {"optimize": True} if fmt == "jpeg" else {"method": 4}
+        # Only the pixels are written: no exif/icc_profile is passed to save()
+        image.save(target, FORMATS[fmt], quality=quality, **options)
+        return {"width": image.width, "height": image.height}
+
+
+def _normalize_file(source: str, target: str, max_side: int, fmt: str, quality: int) -> dict:
+    temp = f"{target}.{uuid.uuid4().hex}.part"
+    try:
+        info = normalize(source, temp, max_side, fmt, quality)
+        os.replace(temp, target)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+    info["size"] = os.path.getsize(target)
+    return info
+
+
+def _normalize_bytes(data: bytes, max_side: int, fmt: str, quality: int) -> bytes:
+    output = io.BytesIO()
+    normalize(io.BytesIO(data), output, max_side, fmt, quality)
+    return output.getvalue()
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def renamed(file_name: str, fmt: str = FORMAT) -> str:
+    """
+    File name with the extension of the normalised format.
+    """
+    return os.path.splitext(file_name or "archivo")[0] + EXTENSIONS[fmt]
+
+
+class ImagePreprocessor:
+
+    def __init__(self, max_workers: int = MAX_WORKERS, max_pending: int = MAX_PENDING,
+                 max_side: int = MAX_SIDE, fmt: str = FORMAT, quality: int = QUALITY,
+                 min_bytes: int = MIN_BYTES, timeout: float = TIMEOUT_SECONDS):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_side = max_side
+        self.fmt = fmt
+        self.quality = quality
+        self.min_bytes = min_bytes
+        self.timeout = timeout
+        self.media_type = MEDIA_TYPES[fmt]
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.prepared = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    def supports(self, mime_type: str, size: int) -> bool:
+        if not mime_type or not mime_type.startswith("image/") or size < self.min_bytes:
+            return False
+        return mime_type not in HEIF_TYPES or pillow_heif is not None
+
+    def _pool(self):
+        if self._executor is None:
+            # spawn: forking a threaded server process is unsafe
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def _submit(self, fn, *args):
+        """
+        Starts a job, or returns None when MAX_PENDING jobs are already queued.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.skipped += 1
+                return None
+            try:
+                future = self._pool().submit(fn, *args, self.max_side, self.fmt, self.quality)
+            except Exception as e:
+                self._reset_pool(e)
+                self.failed += 1
+                print(f"Image normalisation unavailable, using the original: {e!r}")
+                return None
+            self._pending += 1
+
+        def done(_):
+            with self._lock:
+                self._pending -= 1
+
+        future.add_done_callback(done)
+        return future
+
+    def _record(self, size_in: int, size_out: int, started: float):
+        with self._lock:
+            self.prepared += 1
+            self.bytes_in += size_in
+            self.bytes_out += size_out
+            self.seconds += time.monotonic() - started
+
+    def _reset_pool(self, error: Exception):
+        # A crashed worker breaks the whole pool: start a new one on next use
+        if isinstance(error, BrokenProcessPool) and self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _failed(self, error: Exception):
+        with self._lock:
+            self.failed += 1
+            self._reset_pool(error)
+        print(f"Image normalisation failed, using the original: {error!r}")
+
+    def _start_file(self, path: str, mime_type: str):
+        size = os.path.getsize(path)
+        if not self.supports(mime_type, size):
+            return None
+        target = f"{path}.{uuid.uuid4().hex}{EXTENSIONS[self.fmt]}"
+        future = self._submit(_normalize_file, path, target)
+        if future is None:
+            return None
+        return future, target, size, time.monotonic()
+
+    def _abandon(self, future, target: str, error: Exception):
+        # A job still running writes its file later: remove it then
+        future.add_done_callback(lambda _: _remove(target))
+        self._failed(error)
+
+    def prepare_file(self, path: str, mime_type: str):
+        """
+        Normalises the image at path into a new file next to it. Blocking.
+        Returns (path, mime_type, size) of that file, or None when the
+        original should be used.
+        """
+        started = self._start_file(path, mime_type)
+        if started is None:
+            return None
+        future, target, size, began = started
+        try:
+            info = future.result(timeout=self.timeout)
+        except Exception as e:
+            self._abandon(future, target, e)
+            return None
+        self._record(size, info["size"], began)
+        return target, self.media_type, info["size"]
+
+    async def prepare_file_async(self, path: str, mime_type: str):
+        """
+        prepare_file() for the event loop.
+        """
+        started = self._start_file(path, mime_type)
+        if started is None:
+            return None
+        future, target, size, began = started
+        try:
+            info = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.timeout)
+        except Exception as e:
+            self._abandon(future, target, e)
+            return None
+        self._record(size, info["size"], began)
+        return target, self.media_type, info["size"]
+
+    async def prepare_bytes(self, data: bytes, mime_type: str) -> tuple:
+        """
+        (content, mime_type) to send instead of an in-memory image: the
+        normalised version, or the original.
+        """
+        if not self.supports(mime_type, len(data)):
+            return data, mime_type
+        started = time.monotonic()
+        future = self._submit(_normalize_bytes, data)
+        if future is None:
+            return data, mime_type
+        try:
+            output = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.timeout)
+        except Exception as e:
+            self._failed(e)
+            return data, mime_type
+        self._record(len(data), len(output), started)
+        return output, self.media_type
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "prepared": self.prepared,
+                "skipped": self.skipped,
+                "failed": self.failed,
+                "in_flight": self._pending,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_in - self.bytes_out,
+                "avg_ms": round(self.seconds / self.prepared * 1000) if self.prepared else None,
+                "format": self.fmt,
+                "max_side": self.max_side,
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+image_preprocessor = ImagePreprocessor()
@@ -0,0 +1,68 @@
+"""
+Named leases in the leases table, to run a background role (e.g. the email
+sender) in one worker process at a time.
+
+A holder renews its lease more often than it expires; when the holder dies
+the lease runs out and another worker takes it over.
+"""
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+from . import models
+
+
+def renew(db, name: str, owner: str, seconds: float) -> bool:
+    """
+    Takes or renews an existing lease for `seconds` in the current
+    transaction (no commit), so it can commit together with the work it
+    guards. Until that commits, the updated row keeps other workers out.
+    """
+    now = int(time.time())
+    return db.query(models.Lease).filter(
+        models.Lease.name == name,
+        (models.Lease.owner == owner) | (models.Lease.expires_at < now)
+    ).update({"owner": owner, "expires_at": now + int(seconds)}, synchronize_session=False) > 0
+
+
+def acquire(db, name: str, owner: str, seconds: float) -> bool:
+    """
+    Takes or renews the lease for `seconds`. Returns whether owner holds it.
+    Commits.
+    """
+    now = int(time.time())
+    taken = renew(db, name, owner, seconds)
+    db.commit()
+    if taken:
+        return True
+    if db.query(models.Lease.name).filter(models.Lease.name == name).first() is not None:
+        return False
+    try:
+        db.add(models.Lease(name=name, owner=owner, expires_at=now + int(seconds)))
+        db.commit()
+        return True
+    except IntegrityError:
+        # Created by another worker meanwhile
+        db.rollback()
+        return False
+
+
+def release(db, name: str, owner: str):
+    """
+    Gives the lease up, if owner holds it. Commits.
+    """
+    db.query(models.Lease).filter(
+        models.Lease.name == name,
+        models.Lease.owner == owner
+    ).update({"expires_at": 0}, synchronize_session=False)
+    db.commit()
+
+
+def holder(db, name: str):
+    """
+    Current owner of the lease, or None when it is free.
+    """
+    row = db.query(models.Lease).filter(models.Lease.name == name).first()
+    if row is None or row.expires_at < int(time.time()):
+        return None
+    return row.owner
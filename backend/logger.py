@@ -1,22 +1,186 @@
 from sqlalchemy.orm import Session
-from . import models
+from . import models, database
+import asyncio
+import atexit
+import os
+import queue
+import threading
 import uuid
 import time
 
-def log_action(db: Session, username: str, action: str, details: str = None):
+# Write-behind mode (opt-in): audit records are queued in memory and bulk
+# inserted by a background thread instead of committing on the request session.
+WRITE_BEHIND = os.getenv("AUDIT_WRITE_BEHIND", "0") == "1"
+QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+FLUSH_BATCH_SIZE = int(os.getenv("AUDIT_FLUSH_BATCH_SIZE", "500"))
+FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL_SECONDS", "1.0"))
+# What to do when the queue is full:
+#   block - wait up to AUDIT_BLOCK_TIMEOUT_SECONDS for room, then drop
+#           (callers on the event loop never wait: they drop at once)
+#   drop  - drop the new record immediately
+#   sync  - write the record synchronously on the request session
+OVERFLOW_POLICY = os.getenv("AUDIT_OVERFLOW_POLICY", "block")
+BLOCK_TIMEOUT = float(os.getenv("AUDIT_BLOCK_TIMEOUT_SECONDS", "0.5"))
+
+
+class AuditWriter:
     """
-    Persists an action to the audit_logs table.
-    Does not raise exceptions to avoid breaking the main flow.
+    Bounded queue + background flusher for audit records.
+    Records are flushed when FLUSH_BATCH_SIZE are pending or every
+    FLUSH_INTERVAL seconds, whichever comes first.
+    """
+
+    def __init__(self, session_factory=database.SessionLocal, max_size: int = QUEUE_SIZE,
+                 batch_size: int = FLUSH_BATCH_SIZE, interval: float = FLUSH_INTERVAL,
+                 policy: str = OVERFLOW_POLICY, block_timeout: float = BLOCK_TIMEOUT):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.interval = interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=max_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+
+    def enqueue(self, record: dict) -> bool:
+        """
+        Queues a record. Returns False if it could not be queued
+        (the caller decides what to do for the 'sync' policy).
+        """
+        self.start()
+        try:
+            if self.policy == "block" and not _on_event_loop():
+                self._queue.put(record, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            if self.policy != "sync":
+                self.dropped += 1
+                print(f"⚠️ Audit queue full, dropped record: {record['action']}")
+            return False
+
+    def _drain(self) -> list:
+        return self._drain_into([])
+
+    def _write(self, batch: list):
+        if not batch:
+            return
+        db = self.session_factory()
+        try:
+            db.execute(models.AuditLog.__table__.insert(), batch)
+            db.commit()
+            self.written += len(batch)
+        except Exception as e:
+            db.rollback()
+            self.failed += len(batch)
+            print(f"❌ Failed to flush {len(batch)} audit logs: {e}")
+        finally:
+            db.close()
+
+    def _collect(self, first) -> list:
+        """
+        Batch starting at first: waits for more records until batch_size
+        are pending or interval has passed since first was taken.
+        """
+        batch = [first]
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.batch_size and not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=min(remaining, 0.1)))
+            except queue.Empty:
+                continue
+        return self._drain_into(batch)
+
+    def _drain_into(self, batch: list) -> list:
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            self._write(self._collect(first))
+        self.flush()
+
+    def flush(self):
+        """
+        Writes everything currently queued.
+        """
+        while True:
+            batch = self._drain()
+            if not batch:
+                return
+            self._write(batch)
+
+    def shutdown(self, timeout: float = 10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "policy": self.policy,
+        }
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+audit_writer = AuditWriter() if WRITE_BEHIND else None
+
+if audit_writer:
+    atexit.register(audit_writer.shutdown)
+
+
+def shutdown():
     """
+    Flushes pending audit records (called on application shutdown).
+    """
+    if audit_writer:
+        audit_writer.shutdown()
+
+
+def stats() -> dict:
+    if audit_writer:
+        return {"write_behind": True, **audit_writer.stats()}
+    return {"write_behind": False}
+
+
+def _write_sync(db: Session, record: dict):
     try:
-        new_log = models.AuditLog(
-            id=str(uuid.uuid4()),
-            timestamp=int(time.time()),
-            username=username,
-            action=action,
-            details=details
-        )
-        db.add(new_log)
+        db.add(models.AuditLog(**record))
         db.commit()
     except Exception as e:
         print(f"❌ Failed to write audit log: {e}")
@@ -25,3 +189,25 @@ def log_action(db: Session, username: str, action: str, details: str = None):
             db.rollback()
         except:
             pass
+
+
+def log_action(db: Session, username: str, action: str, details: str = None, entity_id: str = None):
+    """
+    Persists an action to the audit_logs table.
+    entity_id is the id of the affected License/Purchase/User, used by /logs filters.
+    In write-behind mode the record is queued and the request session is not used.
+    Does not raise exceptions to avoid breaking the main flow.
+    """
+    record = {
+        "id": str(uuid.uuid4()),
+        "timestamp": int(time.time()),
+        "username": username,
+        "action": action,
+        "details": details,
+        "entity_id": entity_id,
+    }
+    if audit_writer:
+        # On overflow only the 'sync' policy falls back to a direct write
+        if audit_writer.enqueue(record) or audit_writer.policy != "sync":
+            return
+    _write_sync(db, record)
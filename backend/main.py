@@ -1,10 +1,20 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .database import engine, Base
+from . import logger
+from .email_outbox import outbox_sender
+from .upload_jobs import upload_manager
+from .drive_sync import drive_syncer
+from .thumbnails import thumbnail_pipeline
+from .ai_service import model_service
+from .image_prep import image_preprocessor
+import os
+from .migrations import run_migrations
 from .routers import licenses, auth
 
 # Create database tables (simple approach for now, Alembic is better for prod)
 Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
 app = FastAPI(
     title="Licencia Manager Pro API",
@@ -21,6 +31,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.include_router(auth.router)
@@ -36,6 +47,32 @@ app.include_router(appointments.router)
 from .routers import public
 app.include_router(public.router)
 
+from .routers import notifications
+app.include_router(notifications.router)
+
+# Set EMAIL_OUTBOX_WORKER=0 to run the sender as its own process instead
+# (python -m backend.email_outbox)
+@app.on_event("startup")
+def start_email_outbox():
+    if os.getenv("EMAIL_OUTBOX_WORKER", "1") == "1":
+        outbox_sender.start()
+
+# Drive mirror loop, only when DRIVE_SYNC_INTERVAL_SECONDS > 0 (see drive_sync.py)
+@app.on_event("startup")
+def start_drive_sync():
+    drive_syncer.start()
+
+@app.on_event("shutdown")
+def shutdown_background_services():
+    outbox_sender.stop()
+    drive_syncer.stop()
+    # Let in-flight uploads finish before flushing their audit records
+    upload_manager.shutdown()
+    thumbnail_pipeline.shutdown()
+    model_service.shutdown()
+    image_preprocessor.shutdown()
+    logger.shutdown()
+
 @app.get("/")
 def read_root():
     return {"message": "Licencia Manager Pro API is running"}
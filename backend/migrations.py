@@ -0,0 +1,164 @@
+"""
+Schema migrations without a migration tool.
+
+run_migrations() runs in every worker at startup, so it only does cheap,
+idempotent work that tolerates other workers doing the same. One-off data
+migrations are run by hand, once, after deploying the code that needs them:
+
+    python -m backend.migrations --retire-slot-inventory
+"""
+import argparse
+import datetime
+import json
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from . import models, database
+from .database import Base
+from .scheduler import scheduler, COUNTER, COUNTER_TIMES, InvalidTramite
+from .utils.rut import normalize_rut
+
+# create_all() only creates missing tables, it never alters existing ones.
+# Columns added to existing tables are listed here and added on startup.
+# (table, column, SQL type)
+ADDED_COLUMNS = [
+    ("licenses", "rut_key", "VARCHAR"),
+    ("appointments", "rut_key", "VARCHAR"),
+    ("appointments", "tramite", "VARCHAR"),
+    ("email_outbox", "campaign_id", "VARCHAR"),
+    ("upload_jobs", "batch_id", "VARCHAR"),
+    ("upload_jobs", "license_rut", "VARCHAR"),
+]
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def add_missing_columns(engine):
+    """
+    Every worker runs this at startup: another one may add the column
+    between the check and the ALTER, which is then not an error.
+    """
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    if_not_exists = "IF NOT EXISTS " if engine.dialect.name == "postgresql" else ""
+    for table, column, sql_type in ADDED_COLUMNS:
+        if table not in tables:
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table)}
+        if column in existing:
+            continue
+        print(f"Migrating: adding {table}.{column}")
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {if_not_exists}{column} {sql_type}"))
+        except DBAPIError:
+            if column not in {c["name"] for c in inspect(engine).get_columns(table)}:
+                raise
+
+
+def create_missing_indexes(engine):
+    """
+    Creates indexes declared on the models that an existing table lacks.
+    Tolerates another worker creating the same index meanwhile.
+    """
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            print(f"Migrating: creating index {index.name}")
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except DBAPIError:
+                if index.name not in {i["name"] for i in inspect(engine).get_indexes(table.name)}:
+                    raise
+
+
+def backfill_rut_keys(engine):
+    """
+    Fills rut_key for rows written before the column existed, in batches.
+    """
+    for table in ("licenses", "appointments"):
+        while True:
+            with engine.begin() as conn:
+                rows = conn.execute(
+                    text(f"SELECT id, rut FROM {table} WHERE rut_key IS NULL AND rut IS NOT NULL LIMIT :n"),
+                    {"n": BACKFILL_BATCH_SIZE}
+                ).fetchall()
+                if not rows:
+                    break
+                conn.execute(
+                    text(f"UPDATE {table} SET rut_key = :key WHERE id = :id"),
+                    [{"id": row.id, "key": normalize_rut(row.rut)} for row in rows]
+                )
+
+
+def hold_counter_appointments(engine) -> dict:
+    """
+    Counter appointments booked before /book went through the scheduler hold
+    no counter unit (tramite NULL): gives the confirmed ones from today on
+    their counter and their time, so the scheduler does not hand them out
+    again. Appointments with a malformed time are skipped and reported.
+    """
+    result = {"held": 0, "full": 0, "skipped": 0}
+    db = Session(bind=engine)
+    try:
+        pending = db.query(models.Appointment.id, models.Appointment.date, models.Appointment.time).filter(
+            models.Appointment.tramite.is_(None),
+            models.Appointment.status == "CONFIRMED",
+            models.Appointment.date >= datetime.date.today().isoformat()
+        ).all()
+        for appointment_id, date, hhmm in pending:
+            try:
+                held = scheduler.hold(db, appointment_id, [COUNTER, COUNTER_TIMES], date, hhmm)
+            except InvalidTramite:
+                db.rollback()
+                print(f"Migrating: skipping appointment {appointment_id}, invalid time {hhmm!r}")
+                result["skipped"] += 1
+                continue
+            if not held:
+                print(f"Migrating: no free counter for appointment {appointment_id} ({date} {hhmm})")
+            result["held" if held else "full"] += 1
+    finally:
+        db.close()
+    return result
+
+
+def drop_slot_inventory(engine):
+    """
+    Drops the per-time inventory /book used before the scheduler, once
+    hold_counter_appointments() moved its bookings over.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS appointment_slots"))
+
+
+def run_migrations(engine):
+    add_missing_columns(engine)
+    create_missing_indexes(engine)
+    backfill_rut_keys(engine)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run one-off data migrations")
+    parser.add_argument("--retire-slot-inventory", action="store_true",
+                        help="Move counter appointments booked before the scheduler onto it "
+                             "and drop the appointment_slots table")
+    args = parser.parse_args()
+    if not args.retire_slot_inventory:
+        parser.error("--retire-slot-inventory is required")
+
+    Base.metadata.create_all(bind=database.engine)
+    run_migrations(database.engine)
+    result = hold_counter_appointments(database.engine)
+    drop_slot_inventory(database.engine)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, Enum, ForeignKey, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Enum, ForeignKey, Boolean, Index, UniqueConstraint
+from sqlalchemy.orm import relationship, validates
 from .database import Base
+from .utils.rut import normalize_rut
 import enum
 import time
 
@@ -67,6 +68,7 @@ class License(Base):
     id = Column(String, primary_key=True, index=True)
     full_name = Column(String, index=True)
     rut = Column(String, index=True)
+    rut_key = Column(String, index=True) # Normalized RUT (digits + DV) for lookups
     license_number = Column(String)
     category = Column(String)
     last_control_date = Column(String)
@@ -90,6 +92,19 @@ class License(Base):
     restricciones_medicas = Column(String, nullable=True)  # Lentes, audífonos, etc.
     fecha_control = Column(String, nullable=True)  # Fecha próximo control
 
+    # Keyset pagination key for GET /licenses/ (see utils/pagination.py)
+    __table_args__ = (
+        Index("ix_licenses_upload_date_id", "upload_date", "id"),
+        # Campaign targeting (see campaigns.py)
+        Index("ix_licenses_process_status_id", "process_status", "id"),
+        Index("ix_licenses_fecha_control_id", "fecha_control", "id"),
+    )
+
+    @validates("rut")
+    def _sync_rut_key(self, key, value):
+        self.rut_key = normalize_rut(value)
+        return value
+
 class Purchase(Base):
     __tablename__ = "purchases"
     
@@ -106,6 +121,11 @@ class Purchase(Base):
     
     is_deleted = Column(Boolean, default=False)
 
+    # Keyset pagination key for GET /purchases/ (newest first)
+    __table_args__ = (
+        Index("ix_purchases_request_date_id", "request_date", "id"),
+    )
+
 class AuditLog(Base):
     __tablename__ = "audit_logs"
 
@@ -121,14 +141,296 @@ class AuditLog(Base):
     entity_id = Column(String, nullable=True, index=True) # ID of License/User affected
     changes = Column(String, nullable=True) # JSON string of changes
 
+    # Filters used by GET /logs/, each followed by the keyset sort key
+    __table_args__ = (
+        Index("ix_audit_logs_timestamp_id", "timestamp", "id"),
+        Index("ix_audit_logs_username_timestamp", "username", "timestamp"),
+        Index("ix_audit_logs_action_timestamp", "action", "timestamp"),
+        Index("ix_audit_logs_entity_timestamp", "entity_id", "timestamp"),
+    )
+
 
 class Appointment(Base):
     __tablename__ = "appointments"
 
     id = Column(String, primary_key=True, index=True)
     rut = Column(String, index=True) # Linked to citizen RUT
+    rut_key = Column(String, index=True) # Normalized RUT (digits + DV) for lookups
     date = Column(String) # YYYY-MM-DD
     time = Column(String) # HH:MM
     status = Column(String, default="CONFIRMED") # CONFIRMED, CANCELLED, COMPLETED
     created_at = Column(Integer, default=lambda: int(time.time()))
+    tramite = Column(String, nullable=True) # Resources held (scheduler.py), comma separated; NULL until python -m backend.migrations --retire-slot-inventory ran
+
+    # Confirmed appointments per day (reports)
+    __table_args__ = (
+        Index("ix_appointments_date_status", "date", "status"),
+    )
+
+    @validates("rut")
+    def _sync_rut_key(self, key, value):
+        self.rut_key = normalize_rut(value)
+        return value
+
+
+class ResourceDay(Base):
+    """
+    Occupation of one unit of a scheduling resource (a counter, an exam lane)
+    on one day, as a bitmap of SCHEDULER_TICK_MINUTES ticks stored in hex.
+    `version` is bumped by every change: writers update conditionally on it
+    (see scheduler.py).
+    """
+    __tablename__ = "resource_days"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    resource = Column(String)
+    date = Column(String) # YYYY-MM-DD
+    unit = Column(Integer)
+    busy = Column(String, default="0")
+    version = Column(Integer, default=0)
+
+    # Also serves the range reads: resource IN (...) AND date BETWEEN ...
+    __table_args__ = (
+        UniqueConstraint("resource", "date", "unit", name="uq_resource_days_resource_date_unit"),
+    )
+
+
+class ResourceBooking(Base):
+    """
+    A step of an appointment: the interval a unit is held for it.
+    """
+    __tablename__ = "resource_bookings"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    appointment_id = Column(String, index=True)
+    resource = Column(String)
+    unit = Column(Integer)
+    date = Column(String) # YYYY-MM-DD
+    start_minute = Column(Integer) # Minutes since 00:00
+    end_minute = Column(Integer)
+
 
+class Holiday(Base):
+    """
+    Days without attention, on top of SCHEDULER_HOLIDAYS.
+    """
+    __tablename__ = "holidays"
+
+    date = Column(String, primary_key=True) # YYYY-MM-DD
+    name = Column(String)
+
+
+class CacheInvalidation(Base):
+    """
+    Invalidation events shared between worker processes
+    (see PUBLIC_CACHE_SHARED_INVALIDATION in routers/public.py).
+    """
+    __tablename__ = "cache_invalidations"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    cache = Column(String)
+    key = Column(String)
+    created_at = Column(Integer, default=lambda: int(time.time()), index=True)
+
+class EmailStatus(str, enum.Enum):
+    PENDING = 'PENDIENTE'
+    SENT = 'ENVIADO'
+    FAILED = 'FALLIDO'
+
+class EmailOutbox(Base):
+    """
+    Outgoing emails. Requests only insert rows here; the background sender
+    in email_outbox.py delivers them.
+    """
+    __tablename__ = "email_outbox"
+
+    id = Column(String, primary_key=True, index=True)
+    to_email = Column(String)
+    subject = Column(String)
+    body = Column(String)
+    status = Column(String, default=EmailStatus.PENDING)
+    attempts = Column(Integer, default=0)
+    last_error = Column(String, nullable=True)
+    created_at = Column(Integer, default=lambda: int(time.time()))
+    next_attempt_at = Column(Integer, default=lambda: int(time.time()))
+    sent_at = Column(Integer, nullable=True)
+    # Set when a sender claims the row; the claim expires at next_attempt_at
+    claim_token = Column(String, nullable=True)
+    entity_id = Column(String, nullable=True, index=True) # License the email is about
+    campaign_id = Column(String, nullable=True, index=True)
+
+    __table_args__ = (
+        Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+class CampaignStatus(str, enum.Enum):
+    RUNNING = 'EN CURSO'
+    QUEUED = 'ENCOLADA'
+    FAILED = 'FALLIDA'
+
+class Campaign(Base):
+    """
+    Bulk notification to a set of licenses. Recipients are queued in the
+    email outbox in chunks; `cursor` is the last license id queued, so an
+    interrupted campaign resumes where it stopped.
+    """
+    __tablename__ = "campaigns"
+
+    id = Column(String, primary_key=True, index=True)
+    kind = Column(String) # ready_for_pickup, near_expiry
+    filters = Column(String) # JSON string of the selection filters
+    status = Column(String, default=CampaignStatus.RUNNING)
+    cursor = Column(String, nullable=True)
+    queued = Column(Integer, default=0)
+    skipped = Column(Integer, default=0) # Licenses without email
+    created_by = Column(String)
+    created_at = Column(Integer, default=lambda: int(time.time()))
+    finished_at = Column(Integer, nullable=True)
+    last_error = Column(String, nullable=True)
+
+class UploadJobStatus(str, enum.Enum):
+    QUEUED = 'EN COLA'
+    RUNNING = 'SUBIENDO'
+    DONE = 'COMPLETADO'
+    FAILED = 'FALLIDO'
+
+class UploadJob(Base):
+    """
+    Drive upload running in the background (see upload_jobs.py).
+    Stored in the database so any worker can report its progress.
+    """
+    __tablename__ = "upload_jobs"
+
+    id = Column(String, primary_key=True, index=True)
+    username = Column(String)
+    file_name = Column(String)
+    mime_type = Column(String, nullable=True)
+    size = Column(Integer, default=0)
+    bytes_done = Column(Integer, default=0)
+    status = Column(String, default=UploadJobStatus.QUEUED)
+    mode = Column(String, nullable=True) # real, simulation
+    drive_id = Column(String, nullable=True)
+    web_link = Column(String, nullable=True)
+    error = Column(String, nullable=True)
+    batch_id = Column(String, nullable=True, index=True) # Set for /drive/upload-batch files
+    license_rut = Column(String, nullable=True) # Licence the scan belongs to, if given
+    created_at = Column(Integer, default=lambda: int(time.time()))
+    updated_at = Column(Integer, default=lambda: int(time.time()))
+
+    __table_args__ = (
+        Index("ix_upload_jobs_username_status", "username", "status"),
+    )
+
+class SimFile(Base):
+    """
+    File in the simulation Drive store (see blob_store.py).
+    Maps (username, name) to a content-addressed blob; the id is stable
+    across re-uploads and is what the simulation reports as drive_id.
+    """
+    __tablename__ = "sim_files"
+
+    id = Column(String, primary_key=True, index=True)
+    username = Column(String)
+    name = Column(String)
+    sha256 = Column(String, index=True)
+    size = Column(Integer, default=0)
+    mime_type = Column(String, nullable=True)
+    created_at = Column(Integer, default=lambda: int(time.time()))
+    updated_at = Column(Integer, default=lambda: int(time.time()))
+
+    __table_args__ = (
+        UniqueConstraint("username", "name", name="uq_sim_files_username_name"),
+    )
+
+class Document(Base):
+    """
+    Catalogue of uploaded documents (see documents.py).
+    /drive/list answers from here instead of listing Drive or the disk.
+    """
+    __tablename__ = "documents"
+
+    id = Column(String, primary_key=True, index=True)
+    username = Column(String, nullable=True) # Owner; unknown for files found by reconciliation
+    name = Column(String)
+    license_rut = Column(String, nullable=True)
+    rut_key = Column(String, nullable=True)
+    drive_id = Column(String, index=True)
+    mode = Column(String) # real, simulation
+    size = Column(Integer, default=0)
+    sha256 = Column(String, nullable=True, index=True)
+    mime_type = Column(String, nullable=True)
+    web_link = Column(String, nullable=True)
+    upload_job_id = Column(String, nullable=True)
+    created_at = Column(Integer, default=lambda: int(time.time()))
+    missing = Column(Boolean, default=False) # Not found in storage by the last reconciliation
+
+    __table_args__ = (
+        Index("ix_documents_username_created_id", "username", "created_at", "id"),
+        Index("ix_documents_rut_key_created_id", "rut_key", "created_at", "id"),
+        Index("ix_documents_created_id", "created_at", "id"),
+    )
+
+    @validates("license_rut")
+    def _sync_rut_key(self, key, value):
+        self.rut_key = normalize_rut(value)
+        return value
+
+class DriveMirrorEntry(Base):
+    """
+    Local copy of a file or folder of the LICENCIA_MANAGER_SYSTEM tree in Drive,
+    kept current from the Drive changes feed (see drive_sync.py).
+    """
+    __tablename__ = "drive_mirror"
+
+    id = Column(String, primary_key=True, index=True) # Drive file id
+    name = Column(String)
+    mime_type = Column(String)
+    parent_id = Column(String, nullable=True)
+    size = Column(Integer, nullable=True)
+    md5 = Column(String, nullable=True)
+    modified_time = Column(String, nullable=True) # RFC 3339, as Drive reports it
+    synced_at = Column(Integer, default=lambda: int(time.time()))
+
+    __table_args__ = (
+        Index("ix_drive_mirror_parent_name", "parent_id", "name"),
+    )
+
+class SyncState(Base):
+    """
+    Small key/value store of the Drive sync: changes page token,
+    cached folder ids ("folder:<path>") and the worker lease.
+    """
+    __tablename__ = "sync_state"
+
+    key = Column(String, primary_key=True)
+    value = Column(String, nullable=True)
+    updated_at = Column(Integer, default=lambda: int(time.time()))
+
+class Lease(Base):
+    """
+    Named leases electing one worker process for a background role
+    (see leases.py). A lease is free once expires_at has passed.
+    """
+    __tablename__ = "leases"
+
+    name = Column(String, primary_key=True)
+    owner = Column(String)
+    expires_at = Column(Integer, default=0)
+
+class AnalysisCacheEntry(Base):
+    """
+    Cached Gemini licence analysis (see ai_cache.py), keyed by the SHA-256
+    of the file plus model and prompt version.
+    """
+    __tablename__ = "ai_analysis_cache"
+
+    key = Column(String, primary_key=True)
+    content_sha256 = Column(String, index=True)
+    model = Column(String)
+    prompt_version = Column(String)
+    result = Column(String) # JSON of the LicenseAnalysisResponse
+    latency_ms = Column(Integer, default=0) # Duration of the model call that produced it
+    hits = Column(Integer, default=0)
+    created_at = Column(Integer, default=lambda: int(time.time()))
+    expires_at = Column(Integer, index=True)
+    last_hit_at = Column(Integer, index=True) # LRU eviction order
@@ -1,11 +1,20 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import google.generativeai as genai
+from starlette.concurrency import run_in_threadpool
+import json
 import os
 from dotenv import load_dotenv
-import json
 from typing import Optional
 
+from .. import ai_batch, blob_store, image_prep
+from ..ai_cache import analysis_cache
+from ..ai_client import PROMPT_VERSION
+from ..ai_service import model_service, ModelUnavailable, ModelTimeout
+from ..upload_jobs import STAGING_PATH
+from ..image_prep import image_preprocessor
+from ..utils.multipart_stream import stream_multipart_to_disk, MultipartTooLarge
+
 # Load environment variables
 load_dotenv()
 
@@ -14,12 +23,37 @@ router = APIRouter(
     tags=["ai"]
 )
 
-# Configure Gemini
+# The Gemini client itself is configured when model_service first builds it (see ai_client.py)
 API_KEY = os.getenv("GEMINI_API_KEY")
 if not API_KEY:
     print("WARNING: GEMINI_API_KEY not found in environment variables.")
 
-genai.configure(api_key=API_KEY)
+# The scan endpoints parse their multipart body themselves (streamed to disk),
+# so FastAPI cannot derive it from the signature: it is described here for the docs
+def _multipart_body(properties: dict, required: list) -> dict:
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {"type": "object", "properties": properties, "required": required}
+                }
+            },
+        }
+    }
+
+ANALYZE_BODY = _multipart_body(
+    {"file": {"type": "string", "format": "binary", "description": "Escaneo de la licencia (imagen o PDF)"}},
+    ["file"],
+)
+ANALYZE_BATCH_BODY = _multipart_body(
+    {"files": {
+        "type": "array",
+        "items": {"type": "string", "format": "binary"},
+        "description": "Escaneos (imagen o PDF) y/o archivos .zip/.tar con escaneos; cualquier nombre de campo",
+    }},
+    ["files"],
+)
 
 class LicenseAnalysisResponse(BaseModel):
     fullName: str
@@ -34,73 +68,135 @@ class LicenseAnalysisResponse(BaseModel):
     processStatus: str
     status: str
 
-@router.post("/analyze", response_model=LicenseAnalysisResponse)
-async def analyze_license(file: UploadFile = File(...)):
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _remove(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+@router.post("/analyze", response_model=LicenseAnalysisResponse, openapi_extra=ANALYZE_BODY)
+async def analyze_license(request: Request, refresh: bool = False):
+    """
+    Extracts licence data from a scan (multipart form, field "file").
+    The upload is streamed to disk and refused with 413 past
+    UPLOAD_MAX_FILE_MB; photos are normalised before they are sent to the
+    model (see image_prep.py).
+    Results are cached by file content, model and prompt version (see
+    ai_cache.py); refresh=true forces a new analysis. The model call is
+    guarded by a deadline, a concurrency cap and a circuit breaker (see
+    ai_service.py): 503 while the model is failing, 504 when it does not
+    answer in time.
+    """
     if not API_KEY:
          raise HTTPException(status_code=500, detail="Servicio de IA no configurado (Falta API Key)")
 
     try:
-        # Read file content
-        content = await file.read()
-        mime_type = file.content_type
-
-        # Prepare for Gemini
-        # Gemini 1.5 Flash is efficient for this
-        model = genai.GenerativeModel('gemini-1.5-flash')
-
-        prompt = """
-        Analiza este documento de licencia de conducir chilena.
-        Extrae la siguiente información en formato JSON estricto:
-        - nombre completo (fullName)
-        - RUT o identificador nacional (rut)
-        - número de licencia (licenseNumber)
-        - fecha de último control (lastControlDate) formato YYYY-MM-DD
-        - fecha de emisión (issueDate) formato YYYY-MM-DD
-        - fecha de vencimiento (expirationDate) formato YYYY-MM-DD
-        - autoridad emisora (issuingAuthority)
-        - país (country)
-        - categoría/clase (category). Las clases válidas en Chile son: A1, A2, A3, A4, A5, B, C, D, F.
-
-        Además, intenta inferir el "processStatus" basado en el texto visible:
-        - "ADDRESS_CHANGE" si menciona Cambio de Domicilio
-        - "FIRST_LICENSE" si parece primera licencia
-        - "PENDING" en otro caso.
-
-        Si algún dato no es legible, usa 'N/A'.
-        DEBES RESPONDER ÚNICAMENTE CON EL JSON.
-        """
-
-        extraction_response = model.generate_content([
-            {'mime_type': mime_type, 'data': content},
-            prompt
-        ])
-        
-        text_response = extraction_response.text
-        # Clean response if it contains markdown code blocks
-        if "```json" in text_response:
-            text_response = text_response.split("```json")[1].split("```")[0].strip()
-        elif "```" in text_response:
-            text_response = text_response.split("```")[1].strip()
-
-        data = json.loads(text_response)
-        
-        # Calculate status (Valid/Expired) logic in Python
-        # ... logic similar to frontend
-        
-        return {
-            "fullName": data.get("fullName", "N/A"),
-            "rut": data.get("rut", "N/A"),
-            "licenseNumber": data.get("licenseNumber", "N/A"),
-            "category": data.get("category", "N/A"),
-            "issueDate": data.get("issueDate", "N/A"),
-            "lastControlDate": data.get("lastControlDate", "N/A"),
-            "expirationDate": data.get("expirationDate", "N/A"),
-            "issuingAuthority": data.get("issuingAuthority", "N/A"),
-            "country": data.get("country", "Chile"),
-            "processStatus": data.get("processStatus", "PENDING"),
-            "status": "VIGENTE" # Simplified for now, frontend handles logic too
-        }
+        _, files = await stream_multipart_to_disk(request, STAGING_PATH, max_files=1)
+    except MultipartTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not files:
+        raise HTTPException(status_code=400, detail="Se requiere un archivo")
+    staged = files[0]
+    prepared = None
+
+    async def compute():
+        nonlocal prepared
+        path, mime_type = staged.path, staged.content_type
+        if image_prep.FOR_AI:
+            prepared = await image_preprocessor.prepare_file_async(staged.path, staged.content_type)
+            if prepared:
+                path, mime_type, _ = prepared
+        content = await run_in_threadpool(_read, path)
+        return await model_service.analyze(content, mime_type)
 
+    try:
+        content_sha256, _ = await run_in_threadpool(blob_store.hash_file, staged.path)
+        return await analysis_cache.get_or_compute(
+            content_sha256, model_service.client.model_name, PROMPT_VERSION, compute, refresh=refresh
+        )
+
+    except ModelUnavailable as e:
+        raise HTTPException(
+            status_code=503, detail="IA no disponible. Intente nuevamente en unos minutos.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except ModelTimeout:
+        raise HTTPException(status_code=504, detail="IA no disponible: el modelo no respondió a tiempo")
     except Exception as e:
         print(f"Error in AI analysis: {e}")
         raise HTTPException(status_code=500, detail=f"Error al analizar el documento: {str(e)}")
+    finally:
+        await run_in_threadpool(_remove, [staged.path] + ([prepared[0]] if prepared else []))
+
+
+@router.post("/analyze-batch", openapi_extra=ANALYZE_BATCH_BODY)
+async def analyze_batch(
+    request: Request,
+    concurrency: int = Query(ai_batch.CONCURRENCY, ge=1, le=ai_batch.MAX_CONCURRENCY),
+    write: bool = False,
+    username: str = "SYSTEM"
+):
+    """
+    Analyses many scans in one multipart request: any number of image/PDF
+    parts and/or .zip/.tar archives of them. Streams one NDJSON line per
+    document as it finishes, then a {"summary": ...} line.
+    write=true inserts the valid results into licenses.
+    """
+    if os.getenv("AI_CLIENT", "gemini") == "gemini" and not API_KEY:
+         raise HTTPException(status_code=500, detail="Servicio de IA no configurado (Falta API Key)")
+
+    try:
+        _, files = await stream_multipart_to_disk(
+            request, STAGING_PATH, max_files=ai_batch.MAX_UPLOAD_FILES, max_file_bytes=ai_batch.MAX_UPLOAD_BYTES
+        )
+    except MultipartTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not files:
+        raise HTTPException(status_code=400, detail="Se requiere al menos un archivo")
+
+    extractor = ai_batch.BatchExtractor(
+        model_service, concurrency=concurrency, write=write, username=username
+    )
+
+    async def body():
+        try:
+            async for result in extractor.run(ai_batch.iter_uploads(files)):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+            yield json.dumps({"summary": extractor.report()}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            print(f"Error in AI batch: {e}")
+            yield json.dumps({"error": f"Error al procesar el lote: {str(e)}"}, ensure_ascii=False) + "\n"
+        finally:
+            await run_in_threadpool(_remove, [staged.path for staged in files])
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+@router.get("/metrics")
+def model_metrics():
+    """
+    Model calls of this worker by outcome (ok, invalid, timeout, error,
+    rejected) with latency percentiles, the circuit breaker state and the
+    bytes saved by image normalisation.
+    """
+    return {**model_service.stats(), "image_prep": image_preprocessor.stats()}
+
+
+@router.get("/cache/stats")
+def cache_stats():
+    """
+    Hit rate and model time saved by the analysis cache: for this worker
+    since it started, and across workers for the stored entries.
+    """
+    return analysis_cache.stats()
@@ -1,10 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from typing import List
-import uuid
+from typing import List, Optional
 from ..database import get_db
+from .. import booking, logger, models
 from ..models import Appointment
+from ..scheduler import scheduler, InvalidTramite, NoAvailability, SchedulingConflict, steps_for_license
+from ..utils.rut import normalize_rut
 import datetime
 
 router = APIRouter(
@@ -17,6 +19,19 @@ class AppointmentCreate(BaseModel):
     date: str
     time: str
 
+class AppointmentCancel(BaseModel):
+    rut: str
+
+class ScheduleCreate(BaseModel):
+    rut: str
+    steps: Optional[List[str]] = None # Default: what the citizen's licence still needs
+    from_date: Optional[str] = None
+    ordered: bool = True
+
+class HolidayCreate(BaseModel):
+    date: str
+    name: str
+
 class AppointmentResponse(BaseModel):
     id: str
     rut: str
@@ -26,59 +41,42 @@ class AppointmentResponse(BaseModel):
 
 @router.get("/slots")
 def get_available_slots(date: str, db: Session = Depends(get_db)):
-    # 1. Define Standard Slots (9:00 to 14:00, 20 min interval)
-    # Simple logic: 09:00, 09:20, 09:40, 10:00 ... 13:40.
-    start_hour = 9
-    end_hour = 14
-    interval_minutes = 20
-    
-    potential_slots = []
-    current_time = datetime.datetime.strptime(f"{date} {start_hour}:00", "%Y-%m-%d %H:%M")
-    end_time = datetime.datetime.strptime(f"{date} {end_hour}:00", "%Y-%m-%d %H:%M")
-    
-    while current_time < end_time:
-        potential_slots.append(current_time.strftime("%H:%M"))
-        current_time += datetime.timedelta(minutes=interval_minutes)
-        
-    # 2. Query booked slots from DB
-    booked_appointments = db.query(Appointment).filter(
-        Appointment.date == date,
-        Appointment.status == "CONFIRMED"
-    ).all()
-    
-    booked_times = [appt.time for appt in booked_appointments]
-    
-    # 3. Filter available
-    available_slots = [slot for slot in potential_slots if slot not in booked_times]
-    
+    # Free counter times of the day (see booking.py)
+    try:
+        available_slots = booking.available_times(db, date)
+    except booking.InvalidSlot as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     return {"date": date, "slots": available_slots}
 
+@router.get("/availability")
+def get_availability(
+    date_from: str = Query(..., alias="from"),
+    date_to: str = Query(..., alias="to"),
+    db: Session = Depends(get_db)
+):
+    # Free slots of every day in the range (e.g. a month of the calendar) in one call
+    try:
+        return booking.availability(db, date_from, date_to)
+    except booking.InvalidSlot as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/availability/stats")
+def availability_cache_stats():
+    return booking.availability_cache.stats()
+
 @router.post("/book", response_model=AppointmentResponse)
 def book_appointment(appt: AppointmentCreate, db: Session = Depends(get_db)):
-    # 1. Check if slot is already taken (Race condition possible but low risk for this scale)
-    existing = db.query(Appointment).filter(
-        Appointment.date == appt.date,
-        Appointment.time == appt.time,
-        Appointment.status == "CONFIRMED"
-    ).first()
-    
-    if existing:
+    # Claims a counter unit through the scheduler: concurrent bookings cannot both take it
+    try:
+        new_appt = booking.book(db, appt.rut, appt.date, appt.time)
+    except booking.InvalidSlot as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except booking.SlotUnavailable:
         raise HTTPException(status_code=400, detail="Horario ya reservado")
-        
-    # 2. Check if user already has an appointment that day? (Optional, skipping for simplicity)
-    
-    new_appt = Appointment(
-        id=str(uuid.uuid4()),
-        rut=appt.rut,
-        date=appt.date,
-        time=appt.time,
-        status="CONFIRMED"
-    )
-    
-    db.add(new_appt)
-    db.commit()
-    db.refresh(new_appt)
-    
+    except SchedulingConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
     return {
         "id": new_appt.id,
         "rut": new_appt.rut,
@@ -87,12 +85,28 @@ def book_appointment(appt: AppointmentCreate, db: Session = Depends(get_db)):
         "status": new_appt.status
     }
 
+@router.post("/{appointment_id}/cancel", response_model=AppointmentResponse)
+def cancel_appointment(appointment_id: str, body: AppointmentCancel, db: Session = Depends(get_db)):
+    # The citizen's RUT must match: knowing the id alone is not enough
+    try:
+        appt = booking.cancel(db, appointment_id, normalize_rut(body.rut))
+    except booking.AppointmentNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    return {
+        "id": appt.id,
+        "rut": appt.rut,
+        "date": appt.date,
+        "time": appt.time,
+        "status": appt.status
+    }
+
 @router.get("/my-appointment/{rut}")
 def get_my_appointment(rut: str, db: Session = Depends(get_db)):
     # Get future appointments
     today = datetime.date.today().isoformat()
     appt = db.query(Appointment).filter(
-        Appointment.rut == rut,
+        Appointment.rut_key == normalize_rut(rut),
         Appointment.date >= today,
         Appointment.status == "CONFIRMED"
     ).order_by(Appointment.date, Appointment.time).first()
@@ -107,3 +121,115 @@ def get_my_appointment(rut: str, db: Session = Depends(get_db)):
         "time": appt.time,
         "status": appt.status
     }
+
+# --- MULTI-RESOURCE SCHEDULING (see scheduler.py) ---
+
+def _license(db: Session, rut: str):
+    license = db.query(models.License).filter(
+        models.License.rut_key == normalize_rut(rut),
+        models.License.is_deleted == False
+    ).first()
+    if not license:
+        raise HTTPException(status_code=404, detail="Licencia no encontrada")
+    return license
+
+def _steps(db: Session, rut: Optional[str], steps: Optional[List[str]]):
+    if steps:
+        return steps
+    if not rut:
+        raise HTTPException(status_code=400, detail="Indique los recursos o el RUT")
+    return steps_for_license(_license(db, rut))
+
+def _from_date(value: Optional[str]):
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Fecha inválida, use YYYY-MM-DD")
+
+@router.get("/resources")
+def get_resources():
+    return {
+        "resources": [resource.describe() for resource in scheduler.resources.values()],
+        "stats": scheduler.stats()
+    }
+
+@router.get("/earliest")
+def get_earliest_visit(
+    rut: Optional[str] = None,
+    steps: Optional[str] = None, # Comma separated resource keys
+    date_from: Optional[str] = Query(None, alias="from"),
+    ordered: bool = True,
+    db: Session = Depends(get_db)
+):
+    # Earliest visit through every resource the trámite needs, without reserving it
+    resource_keys = _steps(db, rut, steps.split(",") if steps else None)
+    try:
+        return scheduler.find(db, resource_keys, _from_date(date_from), ordered)
+    except InvalidTramite as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except NoAvailability as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@router.post("/schedule")
+def schedule_visit(request: ScheduleCreate, db: Session = Depends(get_db)):
+    # Only for a citizen with a licence, and one confirmed appointment at a time
+    license = _license(db, request.rut)
+    resource_keys = request.steps or steps_for_license(license)
+    try:
+        appt, plan = booking.schedule(db, request.rut, resource_keys, _from_date(request.from_date), request.ordered)
+    except booking.AlreadyBooked as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except InvalidTramite as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except NoAvailability as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except SchedulingConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    return {
+        "id": appt.id,
+        "rut": appt.rut,
+        "date": appt.date,
+        "time": appt.time,
+        "status": appt.status,
+        **plan
+    }
+
+@router.get("/holidays")
+def get_holidays(
+    date_from: str = Query(..., alias="from"),
+    date_to: str = Query(..., alias="to"),
+    db: Session = Depends(get_db)
+):
+    rows = db.query(models.Holiday).filter(
+        models.Holiday.date >= date_from,
+        models.Holiday.date <= date_to
+    ).order_by(models.Holiday.date).all()
+    return [{"date": row.date, "name": row.name} for row in rows]
+
+@router.post("/holidays")
+def add_holiday(holiday: HolidayCreate, username: str = "SYSTEM", db: Session = Depends(get_db)):
+    user = db.query(models.User).filter(models.User.username == username).first()
+    if not user or user.role != models.UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Solo Administradores pueden modificar los feriados.")
+    _from_date(holiday.date)
+
+    db.merge(models.Holiday(date=holiday.date, name=holiday.name))
+    db.commit()
+    logger.log_action(db, username=username, action="ADD_HOLIDAY", details=f"Holiday: {holiday.date} {holiday.name}", entity_id=holiday.date)
+    return {"date": holiday.date, "name": holiday.name}
+
+@router.delete("/holidays/{date}")
+def delete_holiday(date: str, username: str = "SYSTEM", db: Session = Depends(get_db)):
+    user = db.query(models.User).filter(models.User.username == username).first()
+    if not user or user.role != models.UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Solo Administradores pueden modificar los feriados.")
+
+    deleted = db.query(models.Holiday).filter(models.Holiday.date == date).delete(synchronize_session=False)
+    db.commit()
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Feriado no encontrado")
+    logger.log_action(db, username=username, action="DELETE_HOLIDAY", details=f"Holiday: {date}", entity_id=date)
+    return {"deleted": date}
@@ -82,7 +82,7 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     db.refresh(new_user)
     
     # LOG: Create User
-    logger.log_action(db, username="SYSTEM", action="CREATE_USER", details=f"Created user: {user.username}")
+    logger.log_action(db, username="SYSTEM", action="CREATE_USER", details=f"Created user: {user.username}", entity_id=user.username)
     
     return new_user
 
@@ -103,7 +103,7 @@ def delete_user(username: str, db: Session = Depends(get_db), current_user: str
     db.commit()
     
     # LOG: Delete
-    logger.log_action(db, username="SYSTEM", action="DELETE_USER", details=f"Deleted user: {username}")
+    logger.log_action(db, username="SYSTEM", action="DELETE_USER", details=f"Deleted user: {username}", entity_id=username)
     
     return {"message": "User deleted successfully"}
 
@@ -126,6 +126,6 @@ def update_user(username: str, user_update: schemas.UserUpdate, db: Session = De
     db.refresh(db_user)
     
     # LOG: Update
-    logger.log_action(db, username=username, action="UPDATE_USER", details="Updated user profile")
+    logger.log_action(db, username=username, action="UPDATE_USER", details="Updated user profile", entity_id=username)
 
     return db_user
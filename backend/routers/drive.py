@@ -1,55 +1,33 @@
-from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException
+from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, Query, Request, Response, BackgroundTasks
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from .. import database, models, schemas, logger
-import shutil
+from .. import database, models, schemas, logger, documents, blob_store, thumbnails
+from ..utils import pagination, file_response
 import os
 import uuid
-from typing import List
-import json
+from typing import List, Optional
 
-# Goodle Drive Libs
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
+from ..drive_client import drive_client, DRIVE_SIM_PATH
+from ..drive_sync import drive_syncer, ROOT_FOLDER, get_state
+from ..upload_jobs import upload_manager, stage_file, UploadRejected, STAGING_PATH, BATCH_MAX_FILES
+from ..utils.multipart_stream import stream_multipart_to_disk, MultipartTooLarge, MAX_FILE_BYTES
 
 router = APIRouter(
     prefix="/drive",
     tags=["drive"]
 )
 
-# Configuration
-DRIVE_SIM_PATH = "drive_simulation"
-CREDENTIALS_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "credentials.json")
-# If you want a specific folder in Drive, set ID here. PROD: Load from ENV
-DRIVE_FOLDER_ID = None 
-
-# scopes
-SCOPES = ['https://www.googleapis.com/auth/drive.file']
+# Behind nginx: internal location aliased to drive_simulation/.blobs/ (e.g. "/_blobs/").
+# Downloads are then handed off with X-Accel-Redirect and sent with sendfile.
+DOWNLOAD_ACCEL_PREFIX = os.getenv("DOWNLOAD_ACCEL_PREFIX")
 
 def get_drive_service():
     """
-    Attempts to authenticate with Google Drive API.
-    Returns service object or None if fails.
+    Returns the worker's shared Drive service, or None when running in
+    simulation mode (no/placeholder credentials). See drive_client.py.
     """
-    if not os.path.exists(CREDENTIALS_FILE):
-        print(f"Credentials not found at {CREDENTIALS_FILE}. Using Simulation.")
-        return None
-        
-    try:
-        # Check if file is not empty/placeholder
-        with open(CREDENTIALS_FILE, 'r') as f:
-            content = json.load(f)
-            if "project_id" not in content and "INSTRUCCIONES" in content:
-                 print("Credentials file is placeholder. Using Simulation.")
-                 return None
-
-        creds = service_account.Credentials.from_service_account_file(
-            CREDENTIALS_FILE, scopes=SCOPES)
-        service = build('drive', 'v3', credentials=creds)
-        return service
-    except Exception as e:
-        print(f"Failed to create Drive Service: {e}")
-        return None
+    return drive_client.get_service()
 
 if not os.path.exists(DRIVE_SIM_PATH):
     os.makedirs(DRIVE_SIM_PATH)
@@ -61,115 +39,337 @@ def get_db():
     finally:
         db.close()
 
-@router.post("/upload")
-async def upload_file(
+@router.post("/upload", response_model=schemas.UploadJobResponse, status_code=202)
+def upload_file(
     file: UploadFile = File(...),
     username: str = Form(...),
+    rut: Optional[str] = Form(None), # Licence the scan belongs to
     db: Session = Depends(get_db)
 ):
-    # Prepare Simulation Path (always needed for fallback)
-    user_sim_path = os.path.join(DRIVE_SIM_PATH, username)
-    if not os.path.exists(user_sim_path):
-        os.makedirs(user_sim_path)
-    
-    # 1. Try Real Drive
-    service = get_drive_service()
-    if service:
+    """
+    Stages the file and queues its upload to Drive (or the simulation store).
+    Returns immediately; poll GET /drive/jobs/{job_id} for progress.
+    Plain `def`: FastAPI runs it in the thread pool, so staging never blocks the event loop.
+    Files over UPLOAD_MAX_FILE_MB are refused with 413.
+    """
+    file.file.seek(0, os.SEEK_END)
+    if file.file.tell() > MAX_FILE_BYTES:
+        raise HTTPException(status_code=413, detail=f"{file.filename} supera el máximo de {MAX_FILE_BYTES // (1024 * 1024)} MB")
+
+    try:
+        upload_manager.check_user_limit(db, username)
+        upload_manager.reserve()
+    except UploadRejected as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    job = staging_path = None
+    try:
+        job = upload_manager.create_job(db, username, file.filename, file.content_type, license_rut=rut)
+        upload_manager.enforce_user_limit(db, username, [job])
+        staging_path = os.path.join(STAGING_PATH, job.id) # Removed on failure, even if half written
+        staging_path, size = stage_file(file.file, job.id)
+        job.size = size
+        db.commit()
+        db.refresh(job)
+        upload_manager.submit(job.id, staging_path)
+    except UploadRejected as e:
+        upload_manager.release()
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        upload_manager.release()
+        print(f"Error queueing upload: {e}")
+        if job is not None:
+            # Otherwise the job would stay QUEUED and count against the user's limit
+            db.rollback()
+            upload_manager.abandon(job.id, staging_path, f"No se pudo encolar la subida: {e}")
+        raise HTTPException(status_code=500, detail=f"Fatal Upload Error: {str(e)}")
+
+    return job
+
+def _remove_staged(files):
+    for staged in files:
         try:
-            print(f"Attempting upload of {file.filename} to REAL Google Drive...")
-            
-            file_metadata = {
-                'name': f"{username}_{file.filename}", 
-                'mimeType': file.content_type
-            }
-            if DRIVE_FOLDER_ID:
-                file_metadata['parents'] = [DRIVE_FOLDER_ID]
-            
-            # Note: UploadFiel.file is SpooledTemporaryFile. 
-            # We must ensure it's at start.
-            await file.seek(0)
-            
-            media = MediaIoBaseUpload(file.file, mimetype=file.content_type, resumable=True)
-            
-            drive_file = service.files().create(
-                body=file_metadata,
-                media_body=media,
-                fields='id, webContentLink, webViewLink'
-            ).execute()
-            
-            print(f"Uploaded Real File ID: {drive_file.get('id')}")
-            
-            # LOG: Real Upload
-            logger.log_action(db, username=username, action="UPLOAD_REAL", details=f"File: {file.filename}, ID: {drive_file.get('id')}")
-            
-            return {
-                "status": "success",
-                "message": "Archivo subido a Google Drive (Real)",
-                "drive_id": drive_file.get('id'),
-                "web_link": drive_file.get('webViewLink'),
-                "file_name": file.filename
-            }
-        except Exception as e:
-            print(f"⚠️ Google Drive Real Failed: {e}")
-            print("🔄 Falling back to Simulation Storage...")
-            # Fall through to simulation logic
+            os.remove(staged.path)
+        except OSError:
             pass
 
-    # 2. Simulation (Fallback or Default)
+def _queue_batch(username: str, rut: Optional[str], files) -> dict:
+    db = database.SessionLocal()
     try:
-        print(f"Uploading {file.filename} to SIMULATION Drive...")
-        
-        file_location = os.path.join(user_sim_path, file.filename)
-        
-        # Reset cursor because it might have been read in the failed attempt
-        await file.seek(0)
-        
-        with open(file_location, "wb+") as file_object:
-            shutil.copyfileobj(file.file, file_object)
-            
-        # LOG: Simulated Upload
-        logger.log_action(db, username=username, action="UPLOAD_SIMULATION", details=f"File: {file.filename} (Fallback/Sim)")
+        upload_manager.check_user_limit(db, username)
+        upload_manager.reserve(len(files))
+    except UploadRejected:
+        db.close()
+        raise
 
+    batch_id = str(uuid.uuid4())
+    try:
+        jobs = []
+        for staged in files:
+            # Staged files are named with a fresh uuid: reuse it as the job id
+            job_id = os.path.basename(staged.path)
+            jobs.append(upload_manager.create_job(
+                db, username, staged.filename, staged.content_type,
+                job_id=job_id, size=staged.size, batch_id=batch_id, license_rut=rut
+            ))
+        upload_manager.enforce_user_limit(db, username, jobs)
+        upload_manager.submit_batch(batch_id, username, [(job.id, staged.path) for job, staged in zip(jobs, files)])
         return {
-            "status": "success",
-            "message": "Archivo guardado en Drive (Simulado Local - Respaldo)",
-            "drive_id": str(uuid.uuid4()),
-            "web_link": f"http://localhost:8000/static/{username}/{file.filename}",
-            "file_name": file.filename
+            "batch_id": batch_id,
+            "total": len(jobs),
+            "done": 0,
+            "failed": 0,
+            "jobs": [schemas.UploadJobResponse.from_orm(job) for job in jobs],
         }
+    except Exception:
+        upload_manager.release(len(files))
+        raise
+    finally:
+        db.close()
+
+@router.post("/upload-batch", response_model=schemas.UploadBatchResponse, status_code=202)
+async def upload_batch(request: Request):
+    """
+    Uploads many files (e.g. a batch of scanned licences) in one multipart request.
+    Form: username, optional licence rut, and any number of file parts. Each part is streamed to the
+    staging area as it arrives, then uploaded with DRIVE_BATCH_PARALLELISM files
+    in flight. Poll GET /drive/batches/{batch_id} for per-file results.
+    """
+    try:
+        fields, files = await stream_multipart_to_disk(request, STAGING_PATH, max_files=BATCH_MAX_FILES)
+    except MultipartTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    username = fields.get("username")
+    if not username or not files:
+        await run_in_threadpool(_remove_staged, files)
+        raise HTTPException(status_code=400, detail="Se requiere username y al menos un archivo")
+
+    try:
+        return await run_in_threadpool(_queue_batch, username, fields.get("rut") or None, files)
+    except UploadRejected as e:
+        await run_in_threadpool(_remove_staged, files)
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
-        print(f"Error in Simulation fallback: {e}")
+        await run_in_threadpool(_remove_staged, files)
+        print(f"Error queueing upload batch: {e}")
         raise HTTPException(status_code=500, detail=f"Fatal Upload Error: {str(e)}")
 
-@router.get("/list")
-def list_files(username: str):
+@router.get("/batches/{batch_id}", response_model=schemas.UploadBatchResponse)
+def read_upload_batch(batch_id: str, db: Session = Depends(get_db)):
+    jobs = db.query(models.UploadJob).filter(models.UploadJob.batch_id == batch_id)\
+        .order_by(models.UploadJob.created_at, models.UploadJob.id).all()
+    if not jobs:
+        raise HTTPException(status_code=404, detail="Lote de subida no encontrado")
+    return {
+        "batch_id": batch_id,
+        "total": len(jobs),
+        "done": sum(1 for job in jobs if job.status == models.UploadJobStatus.DONE),
+        "failed": sum(1 for job in jobs if job.status == models.UploadJobStatus.FAILED),
+        "jobs": jobs,
+    }
+
+@router.api_route("/documents/{document_id}/content", methods=["GET", "HEAD"])
+def download_document(document_id: str, request: Request, db: Session = Depends(get_db)):
+    """
+    Content of a catalogued document. Supports Range (206/416) and
+    If-None-Match (304) against a strong ETag derived from the SHA-256,
+    so viewers can fetch page ranges of large scans and revalidate cheaply.
+    """
+    document = db.query(models.Document).filter(models.Document.id == document_id).first()
+    if not document or document.missing:
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+    etag = documents.etag(document)
+
+    if document.mode == "simulation":
+        path = blob_store.blob_path(document.sha256)
+        if not os.path.exists(path):
+            raise HTTPException(status_code=404, detail="Documento no encontrado")
+        accel_path = None
+        if DOWNLOAD_ACCEL_PREFIX:
+            accel_path = f"{DOWNLOAD_ACCEL_PREFIX.rstrip('/')}/{document.sha256[:2]}/{document.sha256}"
+        return file_response.file_response(request, path, etag, document.mime_type, document.name,
+                                           accel_path=accel_path)
+
+    # Real Drive: proxied with ranged media requests, never the whole file at once
     service = get_drive_service()
-    
-    # --- REAL DRIVE ---
-    if service:
-        try:
-            # List files that start with username (simple strategy for finding 'folder')
-            # Or query name contains username
-            query = f"name contains '{username}' and trashed = false"
-            results = service.files().list(
-                q=query, pageSize=10, fields="nextPageToken, files(id, name, mimeType, webViewLink)").execute()
-            items = results.get('files', [])
-            return items
-        except Exception as e:
-            print(f"Drive List Error: {e}")
-            return []
-            
-    # --- SIMULATION ---
-    else:
-        user_path = os.path.join(DRIVE_SIM_PATH, username)
-        if not os.path.exists(user_path):
-            return []
-            
-        files = []
-        for f in os.listdir(user_path):
-            files.append({
-                "id": str(uuid.uuid4()),
-                "name": f,
-                "mimeType": "application/pdf"
-            })
-        return files
+    if service is None:
+        raise HTTPException(status_code=503, detail="Google Drive no disponible")
+    status, byte_range = file_response.evaluate(request, etag, document.size)
+    headers = file_response.entity_headers(etag, document.size, status, byte_range,
+                                           "private, max-age=0, must-revalidate", document.name)
+    if status in (304, 416):
+        return Response(status_code=status, headers=headers)
+    start, end = byte_range or (0, document.size - 1)
+    headers["content-length"] = str(end - start + 1)
+    if request.method == "HEAD" or end < start:
+        return Response(status_code=status, headers=headers, media_type=document.mime_type)
+    return StreamingResponse(documents.iter_drive_range(service, document.drive_id, start, end),
+                             status_code=status, headers=headers, media_type=document.mime_type)
+
+@router.get("/documents/{document_id}/thumbnail")
+def document_thumbnail(
+    document_id: str,
+    request: Request,
+    variant: str = "thumb",
+    format: str = "webp",
+    db: Session = Depends(get_db)
+):
+    """
+    Thumbnail (variant=thumb) or first-page preview (variant=preview) of an
+    image or PDF document, as WebP or JPEG. Renditions are keyed by content
+    hash, so they are cacheable for a year; a missing one is generated on demand.
+    """
+    if variant not in thumbnails.VARIANTS or format not in thumbnails.FORMATS:
+        raise HTTPException(status_code=400, detail="Variante o formato no soportado")
+    document = db.query(models.Document).filter(models.Document.id == document_id).first()
+    if not document or document.missing or not document.sha256:
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+
+    def fetch_source(path):
+        service = get_drive_service()
+        if service is None:
+            raise FileNotFoundError(document.drive_id)
+        with open(path, "wb") as target:
+            for chunk in documents.iter_drive_range(service, document.drive_id, 0, document.size - 1):
+                target.write(chunk)
+
+    try:
+        path = thumbnails.thumbnail_pipeline.ensure(
+            document.sha256, document.mime_type, variant, format,
+            fetch_source=fetch_source if document.mode == "real" else None
+        )
+    except thumbnails.UnsupportedType:
+        raise HTTPException(status_code=415, detail="Tipo de documento sin miniatura")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+    except TimeoutError:
+        raise HTTPException(status_code=503, detail="Generación de miniaturas saturada, intente nuevamente")
+    except Exception as e:
+        print(f"Thumbnail error for {document_id}: {e}")
+        raise HTTPException(status_code=422, detail="No se pudo generar la miniatura")
+
+    return file_response.file_response(
+        request, path, f'"{document.sha256}-{variant}.{format}"', thumbnails.MEDIA_TYPES[format],
+        cache_control="private, max-age=31536000, immutable"
+    )
+
+@router.get("/thumbnails/stats")
+def thumbnail_stats():
+    return thumbnails.thumbnail_pipeline.stats()
+
+@router.get("/jobs/{job_id}", response_model=schemas.UploadJobResponse)
+def read_upload_job(job_id: str, db: Session = Depends(get_db)):
+    job = db.query(models.UploadJob).filter(models.UploadJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo de subida no encontrado")
+    return job
+
+@router.get("/status")
+def drive_status():
+    """
+    Readiness of the Drive integration for this worker (real or simulation).
+    """
+    return drive_client.state()
+
+@router.get("/list", response_model=List[schemas.DocumentResponse])
+def list_files(
+    response: Response,
+    username: Optional[str] = None,
+    rut: Optional[str] = None,
+    license_id: Optional[str] = None,
+    mime_type: Optional[str] = None,
+    mode: Optional[str] = None,
+    include_missing: bool = False,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Uploaded documents, newest first, from the document catalogue.
+    Filter by owner, licence (rut or license_id), mime type or storage mode.
+    The next page cursor is returned in the X-Next-Cursor header.
+    """
+    if license_id:
+        license = db.query(models.License).filter(models.License.id == license_id).first()
+        if not license:
+            raise HTTPException(status_code=404, detail="Licencia no encontrada")
+        rut = license.rut
+
+    query = documents.filter_documents(db.query(models.Document), username, rut, mime_type, mode, include_missing)
+    try:
+        items, next_cursor = pagination.keyset_page(
+            query, models.Document.created_at, models.Document.id, limit, cursor=cursor, descending=True
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items
+
+def _reconcile_documents(username: str):
+    db = database.SessionLocal()
+    try:
+        result = documents.reconcile(db, get_drive_service())
+        logger.log_action(db, username=username, action="RECONCILE_DOCUMENTS",
+                          details=f"{result['mode']}: {result['added']} added, {result['missing']} missing, "
+                                  f"{result['restored']} restored")
+    except Exception as e:
+        print(f"Document reconciliation failed: {e}")
+    finally:
+        db.close()
+
+@router.post("/reconcile", status_code=202)
+def reconcile_documents(background_tasks: BackgroundTasks, username: str = "SYSTEM"):
+    """
+    Reconciles the document catalogue against Drive (or the simulation store)
+    in the background. See documents.py.
+    """
+    background_tasks.add_task(_reconcile_documents, username)
+    return {"status": "scheduled"}
+
+@router.get("/mirror")
+def list_mirror(path: str = "", db: Session = Depends(get_db)):
+    """
+    Contents of a folder of the LICENCIA_MANAGER_SYSTEM tree, from the local
+    mirror kept by drive_sync.py. path is relative to the root folder,
+    e.g. "01_ESCANEADAS_PENDIENTES/JUAN_PEREZ".
+    """
+    key = f"folder:{ROOT_FOLDER}/{path.strip('/')}" if path.strip("/") else f"folder:{ROOT_FOLDER}"
+    folder_id = get_state(db, key)
+    if not folder_id:
+        raise HTTPException(status_code=404, detail="Carpeta no sincronizada")
+    entries = db.query(models.DriveMirrorEntry).filter(models.DriveMirrorEntry.parent_id == folder_id)\
+        .order_by(models.DriveMirrorEntry.name).all()
+    return [
+        {
+            "id": entry.id,
+            "name": entry.name,
+            "mimeType": entry.mime_type,
+            "size": entry.size,
+            "modifiedTime": entry.modified_time,
+        }
+        for entry in entries
+    ]
+
+def _sync_mirror():
+    try:
+        drive_syncer.run_once()
+    except Exception as e:
+        print(f"Drive sync failed: {e}")
+
+@router.post("/sync", status_code=202)
+def sync_mirror(background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    """
+    Runs one Drive mirror cycle in the background (real Drive only).
+    409 while a cycle is already running in any worker.
+    """
+    if get_drive_service() is None:
+        raise HTTPException(status_code=409, detail="Google Drive no configurado (modo simulación)")
+    if drive_syncer.running(db):
+        raise HTTPException(status_code=409, detail="Sincronización de Drive en curso")
+    background_tasks.add_task(_sync_mirror)
+    return {"status": "scheduled"}
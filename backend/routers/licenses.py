@@ -1,8 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response, Query, UploadFile, File
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
-from .. import models, schemas, database, logger
-from ..utils.email import send_notification_email
+from pydantic import ValidationError
+from typing import List, Optional
+import time
+from .. import models, schemas, database, logger, campaigns
+from ..utils import pagination, export, importer
+from ..utils.email import enqueue_email
+from ..utils.rut import normalize_rut
+from ..status_cache import invalidate_status
 
 router = APIRouter(
     prefix="/licenses",
@@ -18,20 +24,208 @@ def get_db():
         db.close()
 
 @router.get("/", response_model=List[schemas.LicenseResponse])
-def read_licenses(skip: int = 0, limit: int = 100, show_deleted: bool = False, db: Session = Depends(get_db)):
+def read_licenses(
+    response: Response,
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    show_deleted: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Lists licenses ordered by (upload_date, id).
+    Pass the X-Next-Cursor header of a page as `cursor` to get the next one.
+    The legacy skip/limit form still works but gets slower on deep pages.
+    """
     query = db.query(models.License)
     if not show_deleted:
         query = query.filter(models.License.is_deleted == False)
-        
-    licenses = query.offset(skip).limit(limit).all()
+
+    if skip and cursor:
+        raise HTTPException(status_code=400, detail="Use either skip or cursor, not both")
+
+    if skip:
+        # Legacy offset paging (kept for backward compatibility)
+        return query.order_by(models.License.upload_date, models.License.id).offset(skip).limit(limit).all()
+
+    try:
+        licenses, next_cursor = pagination.keyset_page(
+            query, models.License.upload_date, models.License.id, limit, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return licenses
 
+EXPORT_COLUMNS = [column.key for column in models.License.__table__.columns]
+
+@router.get("/export")
+def export_licenses(
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    columns: Optional[str] = None,
+    status: Optional[str] = None,
+    process_status: Optional[str] = None,
+    show_deleted: bool = False,
+    gzip: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Streams the whole registry as NDJSON or CSV, optionally gzip-compressed.
+    Rows are read through a server-side cursor in fixed-size batches, so
+    memory use does not grow with the table size.
+    `columns` is a comma separated subset of the license fields.
+    """
+    selected = EXPORT_COLUMNS
+    if columns:
+        selected = [c.strip() for c in columns.split(",") if c.strip()]
+        unknown = [c for c in selected if c not in EXPORT_COLUMNS]
+        if unknown or not selected:
+            raise HTTPException(status_code=400, detail=f"Columnas inválidas: {', '.join(unknown)}")
+
+    query = db.query(*[getattr(models.License, c) for c in selected])
+    if not show_deleted:
+        query = query.filter(models.License.is_deleted == False)
+    if status:
+        query = query.filter(models.License.status == status)
+    if process_status:
+        query = query.filter(models.License.process_status == process_status)
+
+    rows = (
+        query.order_by(models.License.upload_date, models.License.id)
+        .execution_options(stream_results=True)
+        .yield_per(1000)
+    )
+
+    if format == "csv":
+        body = export.iter_csv(rows, selected)
+        media_type = "text/csv"
+    else:
+        body = export.iter_ndjson(rows, selected)
+        media_type = "application/x-ndjson"
+
+    filename = f"licencias.{format}"
+    if gzip:
+        body = export.gzip_stream(body)
+        media_type = "application/gzip"
+        filename += ".gz"
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+IMPORT_CHUNK_SIZE = 1000
+
+def _import_chunk(db: Session, chunk, username: str, upload_date: int, seen: set, report: dict):
+    """
+    Validates a chunk of spreadsheet records and bulk inserts the valid ones
+    in a single transaction. Existing RUTs are found with one IN query.
+    """
+    valid = []
+    for number, record in chunk:
+        record.setdefault("license_number", "")
+        record.setdefault("last_control_date", "")
+        record["status"] = record.get("status", models.LicenseStatus.VALID.value).upper()
+        record.setdefault("process_status", models.ProcessStatus.PENDING.value)
+        try:
+            license = schemas.LicenseCreate(**record)
+        except ValidationError as e:
+            report["errors"].append({"row": number, "rut": record.get("rut"), "error": e.errors()[0]["msg"]})
+            continue
+        if normalize_rut(license.rut) in seen:
+            report["errors"].append({"row": number, "rut": license.rut, "error": "RUT duplicado en el archivo"})
+            continue
+        seen.add(normalize_rut(license.rut))
+        valid.append((number, license))
+
+    if not valid:
+        return
+
+    existing = dict(
+        db.query(models.License.rut_key, models.License.is_deleted)
+        .filter(models.License.rut_key.in_([normalize_rut(license.rut) for _, license in valid]))
+        .all()
+    )
+
+    rows = []
+    for number, license in valid:
+        rut_key = normalize_rut(license.rut)
+        if rut_key in existing:
+            error = "Licencia en papelera" if existing[rut_key] else "Licencia ya existe"
+            report["errors"].append({"row": number, "rut": license.rut, "error": error})
+            continue
+        rows.append((number, {
+            **license.dict(),
+            "id": license.rut,
+            "rut_key": rut_key,
+            "upload_date": upload_date,
+            "uploaded_by": username,
+            "is_deleted": False,
+        }))
+
+    if not rows:
+        return
+
+    try:
+        db.execute(models.License.__table__.insert(), [row for _, row in rows])
+        db.commit()
+        report["inserted"] += len(rows)
+        # Clears negative "not found" entries of the public portal
+        invalidate_status(db, *[row["rut"] for _, row in rows])
+    except Exception as e:
+        db.rollback()
+        for number, row in rows:
+            report["errors"].append({"row": number, "rut": row["rut"], "error": f"Error al guardar: {e}"})
+
+@router.post("/import")
+def import_licenses(file: UploadFile = File(...), username: str = "SYSTEM", db: Session = Depends(get_db)):
+    """
+    Bulk loads licenses from an Excel (.xlsx) or CSV file.
+    Rows are streamed and inserted in chunks of IMPORT_CHUNK_SIZE; invalid or
+    duplicated rows are skipped and reported with their spreadsheet row number.
+    """
+    filename = (file.filename or "").lower()
+    if filename.endswith((".xlsx", ".xlsm")):
+        rows = importer.iter_xlsx_rows(file.file)
+    elif filename.endswith(".csv"):
+        rows = importer.iter_csv_rows(file.file)
+    else:
+        raise HTTPException(status_code=400, detail="Formato no soportado. Use .xlsx o .csv")
+
+    report = {"inserted": 0, "errors": []}
+    upload_date = int(time.time())
+    seen = set()
+    chunk = []
+    try:
+        for number, record in importer.iter_records(rows):
+            chunk.append((number, record))
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                _import_chunk(db, chunk, username, upload_date, seen, report)
+                chunk = []
+    except importer.InvalidFile as e:
+        # Earlier chunks are already stored: say how many
+        detail = str(e)
+        if report["inserted"]:
+            detail += f" (se importaron {report['inserted']} licencias antes del error)"
+        raise HTTPException(status_code=400, detail=detail)
+    if chunk:
+        _import_chunk(db, chunk, username, upload_date, seen, report)
+
+    logger.log_action(
+        db, username=username, action="IMPORT_LICENSES",
+        details=f"File: {file.filename}, inserted: {report['inserted']}, errors: {len(report['errors'])}"
+    )
+
+    return report
+
 @router.post("/", response_model=schemas.LicenseResponse)
 def create_license(license: schemas.LicenseCreate, username: str = "SYSTEM", db: Session = Depends(get_db)):
     # Note: Added 'username' param. Frontend should send it or extract from token. 
     # For now ensuring backward compatibility if needed, or assuming updated call.
     
-    import time
     db_license = models.License(
         **license.dict(), 
         id=license.rut,
@@ -39,7 +233,7 @@ def create_license(license: schemas.LicenseCreate, username: str = "SYSTEM", db:
         uploaded_by=username
     ) 
     # Check if exists (and not deleted? OR if deleted, restore it?)
-    existing = db.query(models.License).filter(models.License.rut == license.rut).first()
+    existing = db.query(models.License).filter(models.License.rut_key == normalize_rut(license.rut)).first()
     if existing:
         if existing.is_deleted:
              # Logic to revive? Or error. Let's error and tell user it's in trash.
@@ -49,8 +243,9 @@ def create_license(license: schemas.LicenseCreate, username: str = "SYSTEM", db:
     db.add(db_license)
     db.commit()
     db.refresh(db_license)
+    invalidate_status(db, db_license.rut)
     
-    logger.log_action(db, username=username, action="CREATE_LICENSE", details=f"RUT: {license.rut}")
+    logger.log_action(db, username=username, action="CREATE_LICENSE", details=f"RUT: {license.rut}", entity_id=db_license.id)
     
     return db_license
 
@@ -60,27 +255,27 @@ def update_license(license_id: str, license: schemas.LicenseCreate, username: st
     if not db_license:
         raise HTTPException(status_code=404, detail="License not found")
     
+    old_rut = db_license.rut
+    old_status = db_license.process_status
     for key, value in license.dict().items():
         setattr(db_license, key, value)
         
     # Check for Status Change to TRIGGER NOTIFICATION
-    old_status = db_license.process_status
     new_status = license.process_status
     
     if new_status == models.ProcessStatus.READY_FOR_PICKUP and old_status != models.ProcessStatus.READY_FOR_PICKUP:
         if db_license.email:
-            send_notification_email(
-                db_license.email, 
-                "Su Licencia está Lista - LicenciaManager", 
-                f"Estimado/a {db_license.full_name},\n\nSu licencia de conducir (RUT: {db_license.rut}) ya se encuentra LISTA PARA ENTREGA en nuestras oficinas.\n\nPor favor acérquese a retirar.\n\nAtte,\nDepartamento de Tránsito"
-            )
+            # Queued in the outbox and committed with the update; sent in the background
+            subject, body = campaigns.render("ready_for_pickup", db_license)
+            enqueue_email(db, db_license.email, subject, body, entity_id=license_id)
         else:
-            logger.log_action(db, username=username, action="NOTIFICATION_FAILED", details=f"No email for RUT: {license_id}")
+            logger.log_action(db, username=username, action="NOTIFICATION_FAILED", details=f"No email for RUT: {license_id}", entity_id=license_id)
 
     db.commit()
     db.refresh(db_license)
+    invalidate_status(db, old_rut, db_license.rut)
     
-    logger.log_action(db, username=username, action="UPDATE_LICENSE", details=f"Updated RUT: {license_id}")
+    logger.log_action(db, username=username, action="UPDATE_LICENSE", details=f"Updated RUT: {license_id}", entity_id=license_id)
 
     return db_license
 
@@ -93,8 +288,9 @@ def delete_license(license_id: str, username: str = "SYSTEM", db: Session = Depe
     # Soft Delete
     db_license.is_deleted = True
     db.commit()
+    invalidate_status(db, db_license.rut)
     
-    logger.log_action(db, username=username, action="DELETE_LICENSE", details=f"Soft deleted RUT: {license_id}")
+    logger.log_action(db, username=username, action="DELETE_LICENSE", details=f"Soft deleted RUT: {license_id}", entity_id=license_id)
     
     return {"message": "License moved to trash (Soft Delete)"}
 
@@ -106,7 +302,8 @@ def restore_license(license_id: str, username: str = "SYSTEM", db: Session = Dep
         
     db_license.is_deleted = False
     db.commit()
+    invalidate_status(db, db_license.rut)
     
-    logger.log_action(db, username=username, action="RESTORE_LICENSE", details=f"Restored RUT: {license_id}")
+    logger.log_action(db, username=username, action="RESTORE_LICENSE", details=f"Restored RUT: {license_id}", entity_id=license_id)
 
     return {"message": "License restored successfully"}
@@ -1,13 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response, Query
+from sqlalchemy import func, Integer
 from sqlalchemy.orm import Session
-from typing import List
-from .. import database, models, schemas
+from typing import List, Optional
+import datetime
+from .. import database, models, schemas, audit_archive, logger
+from ..utils import pagination
 
 router = APIRouter(
     prefix="/logs",
     tags=["logs"]
 )
 
+SECONDS_PER_DAY = 86400
+
 def get_db():
     db = database.SessionLocal()
     try:
@@ -15,22 +20,147 @@ def get_db():
     finally:
         db.close()
 
-# We need a schema for Log Response if not exists
-# It's cleaner to define it here or in schemas.py. 
-# For speed, I'll use a dynamic pydantic model or check schemas.py. 
-# Let's assume we don't have one and return generic dict/list for now, or use ORM mode.
+def filter_logs(query, username: str = None, action: str = None, entity_id: str = None,
+                since: int = None, until: int = None):
+    """
+    Applies the /logs filters. since/until are unix timestamps (until is exclusive).
+    Every filter has a matching (column, timestamp) index on AuditLog.
+    """
+    if username:
+        query = query.filter(models.AuditLog.username == username)
+    if action:
+        query = query.filter(models.AuditLog.action == action)
+    if entity_id:
+        query = query.filter(models.AuditLog.entity_id == entity_id)
+    if since is not None:
+        query = query.filter(models.AuditLog.timestamp >= since)
+    if until is not None:
+        query = query.filter(models.AuditLog.timestamp < until)
+    return query
+
+def _reaches_archive(since: Optional[int]) -> bool:
+    horizon = audit_archive.archive_horizon()
+    return horizon is not None and (since is None or since <= horizon)
+
+def _sort_key(log) -> tuple:
+    # Hot rows are ORM objects, archived rows are dicts
+    if isinstance(log, dict):
+        return log["timestamp"], log["id"]
+    return log.timestamp, log.id
 
-@router.get("/", response_model=List[dict])
+@router.get("/", response_model=List[schemas.AuditLogResponse])
 def read_logs(
-    skip: int = 0, 
-    limit: int = 100, 
-    entity_id: str = None, # Optional filter
+    response: Response,
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    username: Optional[str] = None,
+    action: Optional[str] = None,
+    entity_id: Optional[str] = None, # Optional filter
+    since: Optional[int] = None,
+    until: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
-    query = db.query(models.AuditLog)
-    
-    if entity_id:
-        query = query.filter(models.AuditLog.entity_id == entity_id)
-        
-    logs = query.order_by(models.AuditLog.timestamp.desc()).offset(skip).limit(limit).all()
+    """
+    Audit log, newest first. Use the X-Next-Cursor header as `cursor`
+    for the next page; skip/limit is kept for backward compatibility but
+    only pages through the database table, never the archive.
+    """
+    query = filter_logs(db.query(models.AuditLog), username, action, entity_id, since, until)
+
+    if skip and cursor:
+        raise HTTPException(status_code=400, detail="Use either skip or cursor, not both")
+
+    if skip:
+        # Legacy offset paging: archived rows cannot be offset into
+        return query.order_by(models.AuditLog.timestamp.desc(), models.AuditLog.id.desc()).offset(skip).limit(limit).all()
+
+    try:
+        logs, next_cursor = pagination.keyset_page(
+            query, models.AuditLog.timestamp, models.AuditLog.id, limit, cursor=cursor, descending=True
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Hot table exhausted: continue into the archived segments, which only
+    # hold rows older than anything left in the table. A page the last hot
+    # rows fill exactly still needs a cursor if an archived row follows.
+    if next_cursor is None:
+        if _reaches_archive(since):
+            if logs:
+                before = _sort_key(logs[-1])
+            else:
+                before = tuple(pagination.decode_cursor(cursor)) if cursor else None
+            archived = audit_archive.iter_archived(username, action, entity_id, since, until, before=before)
+            for row in archived:
+                if len(logs) == limit:
+                    next_cursor = pagination.encode_cursor(*_sort_key(logs[-1]))
+                    break
+                logs.append(row)
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return logs
+
+@router.get("/count")
+def count_logs(
+    username: Optional[str] = None,
+    action: Optional[str] = None,
+    entity_id: Optional[str] = None,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    query = filter_logs(db.query(func.count(models.AuditLog.id)), username, action, entity_id, since, until)
+    count = query.scalar()
+    if _reaches_archive(since):
+        count += audit_archive.count_archived(username, action, entity_id, since, until)
+    return {"count": count}
+
+@router.get("/histogram", response_model=List[schemas.AuditLogDayCount])
+def logs_histogram(
+    username: Optional[str] = None,
+    action: Optional[str] = None,
+    entity_id: Optional[str] = None,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    utc_offset_minutes: int = 0,
+    db: Session = Depends(get_db)
+):
+    """
+    Number of audit events per day, computed with one GROUP BY so the
+    timeline does not need the raw rows. Days are shifted by
+    utc_offset_minutes (e.g. -180 for Chile in summer).
+    """
+    offset = utc_offset_minutes * 60
+    day = func.cast((models.AuditLog.timestamp + offset) / SECONDS_PER_DAY, Integer).label("day")
+    query = filter_logs(db.query(day, func.count(models.AuditLog.id)), username, action, entity_id, since, until)
+    counts = dict(query.group_by(day).all())
+
+    if _reaches_archive(since):
+        archived = audit_archive.histogram_archived(username, action, entity_id, since, until, offset)
+        for day_number, count in archived.items():
+            counts[day_number] = counts.get(day_number, 0) + count
+
+    epoch = datetime.date(1970, 1, 1)
+    return [
+        {"day": (epoch + datetime.timedelta(days=day_number)).isoformat(), "count": counts[day_number]}
+        for day_number in sorted(counts)
+    ]
+
+@router.get("/writer/stats")
+def audit_writer_stats():
+    return logger.stats()
+
+@router.post("/archive")
+def archive_logs(older_than_days: int = audit_archive.RETENTION_DAYS, username: str = "SYSTEM", db: Session = Depends(get_db)):
+    """
+    Retention job: moves audit rows older than older_than_days into
+    compressed segment files (see audit_archive.py).
+    """
+    if older_than_days < 1:
+        raise HTTPException(status_code=400, detail="older_than_days debe ser mayor a 0")
+    result = audit_archive.archive_audit_logs(db, older_than_days)
+    logger.log_action(db, username=username, action="ARCHIVE_LOGS",
+                      details=f"Archived {result['archived']} logs into {len(result['segments'])} segments")
+    return result
@@ -0,0 +1,127 @@
+from fastapi import APIRouter, Depends, HTTPException, Response, BackgroundTasks, Query
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from .. import database, models, schemas, campaigns
+from .. import leases
+from ..email_outbox import outbox_sender, SENDER_LEASE
+from ..utils import pagination
+
+router = APIRouter(
+    prefix="/notifications",
+    tags=["notifications"]
+)
+
+def get_db():
+    db = database.SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+@router.get("/outbox", response_model=List[schemas.EmailOutboxResponse])
+def read_outbox(
+    response: Response,
+    status: Optional[str] = None,
+    entity_id: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Delivery status of queued emails, newest first (cursor in X-Next-Cursor).
+    """
+    query = db.query(models.EmailOutbox)
+    if status:
+        query = query.filter(models.EmailOutbox.status == status)
+    if entity_id:
+        query = query.filter(models.EmailOutbox.entity_id == entity_id)
+
+    try:
+        messages, next_cursor = pagination.keyset_page(
+            query, models.EmailOutbox.created_at, models.EmailOutbox.id, limit, cursor=cursor, descending=True
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return messages
+
+@router.get("/outbox/stats")
+def outbox_stats(db: Session = Depends(get_db)):
+    """
+    Outbox size per status, this worker's sender counters and the
+    sender currently delivering (holder of the sender lease).
+    """
+    counts = dict(
+        db.query(models.EmailOutbox.status, func.count(models.EmailOutbox.id))
+        .group_by(models.EmailOutbox.status).all()
+    )
+    return {
+        "by_status": counts,
+        "sender": outbox_sender.stats(),
+        "active_sender": leases.holder(db, SENDER_LEASE)
+    }
+
+@router.get("/outbox/{message_id}", response_model=schemas.EmailOutboxResponse)
+def read_outbox_message(message_id: str, db: Session = Depends(get_db)):
+    message = db.query(models.EmailOutbox).filter(models.EmailOutbox.id == message_id).first()
+    if not message:
+        raise HTTPException(status_code=404, detail="Mensaje no encontrado")
+    return message
+
+def _run_campaign_task(campaign_id: str, owner: str):
+    db = database.SessionLocal()
+    try:
+        campaigns.run_campaign(db, campaign_id, owner)
+    except campaigns.CampaignBusy:
+        pass # Lease ran out and another runner took over
+    finally:
+        db.close()
+
+@router.post("/campaigns")
+def create_campaign(
+    campaign: schemas.CampaignCreate,
+    background_tasks: BackgroundTasks,
+    username: str = "SYSTEM",
+    db: Session = Depends(get_db)
+):
+    """
+    Starts a bulk notification campaign. Recipients are queued in the
+    background; poll GET /notifications/campaigns/{id} for progress.
+    """
+    if campaign.kind not in campaigns.TEMPLATES:
+        raise HTTPException(status_code=400, detail=f"Tipo de campaña desconocido: {campaign.kind}")
+
+    filters = campaigns.default_filters(campaign.kind, campaign.days)
+    for key in ("process_status", "status", "control_date_from", "control_date_to"):
+        value = getattr(campaign, key)
+        if value:
+            filters[key] = value
+
+    db_campaign = campaigns.create_campaign(db, campaign.kind, filters, username)
+    owner = campaigns.claim(db, db_campaign.id)
+    background_tasks.add_task(_run_campaign_task, db_campaign.id, owner)
+    return campaigns.campaign_progress(db, db_campaign)
+
+@router.get("/campaigns/{campaign_id}")
+def read_campaign(campaign_id: str, db: Session = Depends(get_db)):
+    db_campaign = db.query(models.Campaign).filter(models.Campaign.id == campaign_id).first()
+    if not db_campaign:
+        raise HTTPException(status_code=404, detail="Campaña no encontrada")
+    return campaigns.campaign_progress(db, db_campaign)
+
+@router.post("/campaigns/{campaign_id}/resume")
+def resume_campaign(campaign_id: str, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    db_campaign = db.query(models.Campaign).filter(models.Campaign.id == campaign_id).first()
+    if not db_campaign:
+        raise HTTPException(status_code=404, detail="Campaña no encontrada")
+    if db_campaign.status == models.CampaignStatus.QUEUED:
+        raise HTTPException(status_code=400, detail="La campaña ya fue encolada completa")
+    # Claimed here, not in the task, so a resume while a runner is alive is refused
+    owner = campaigns.claim(db, db_campaign.id)
+    if owner is None:
+        raise HTTPException(status_code=409, detail="La campaña se está procesando")
+    background_tasks.add_task(_run_campaign_task, db_campaign.id, owner)
+    return campaigns.campaign_progress(db, db_campaign)
@@ -1,6 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from .. import models, database
+from .. import models, database, status_cache
+from ..utils.cache import NOT_FOUND
+from ..utils.rut import normalize_rut
 from pydantic import BaseModel
 from typing import Optional
 
@@ -37,29 +39,43 @@ def mask_name(full_name: str) -> str:
     # Let's do: "JUAN PEREZ"
     return full_name 
 
+def _load_status(rut_key: str):
+    db = database.SessionLocal()
+    try:
+        # Any input format ("12.345.678-9", "12345678-9", "123456789") maps to the
+        # same indexed rut_key, so this is a single index probe.
+        license = db.query(models.License).filter(
+            models.License.rut_key == rut_key,
+            models.License.is_deleted == False
+        ).first()
+        if not license:
+            return NOT_FOUND
+        return PublicLicenseStatus(
+            rut=license.rut,
+            fullName=license.full_name, # Return full name as confirmation
+            processStatus=license.process_status,
+            lastUpdate=str(license.upload_date) # Convert int timestamp to string or format it
+        )
+    finally:
+        db.close()
+
 @router.get("/status/{rut}", response_model=PublicLicenseStatus)
-def check_license_status(rut: str, db: Session = Depends(get_db)):
-    # Normalize RUT (remove dots and dash? Frontend sends raw?)
-    # Assuming exact match for now, or minimal cleaning
-    clean_rut = rut.replace(".", "").replace("-", "").upper()
-    
-    # Try multiple formats if needed, or rely on strict input
-    # DB stores as string, likely with dash or without. Let's check typical storage.
-    # Looking at prior files, it seems raw string.
-    
-    # Search mostly exact match or partial
-    license = db.query(models.License).filter(models.License.rut == rut, models.License.is_deleted == False).first()
-    
-    if not license:
-        # Try cleaning input and searching
-        # If DB has "12.345.678-9" and input is "123456789"
-        # Since I don't know exact DB format, I will assume input matches DB for now, 
-        # but in a real app I'd use a normalized column.
+def check_license_status(rut: str):
+    rut_key = normalize_rut(rut)
+    status_cache.poll_shared_invalidations()
+
+    cache = status_cache.status_cache
+    status = cache.get(rut_key)
+    if status is None:
+        # Not stored if a write invalidated the key while it was being loaded
+        generation = cache.generation()
+        status = _load_status(rut_key)
+        cache.set(rut_key, status, generation)
+
+    if status is NOT_FOUND:
         raise HTTPException(status_code=404, detail="Licencia no encontrada")
-        
-    return PublicLicenseStatus(
-        rut=license.rut,
-        fullName=license.full_name, # Return full name as confirmation
-        processStatus=license.process_status,
-        lastUpdate=str(license.upload_date) # Convert int timestamp to string or format it
-    )
+    return status
+
+@router.get("/status-cache/stats")
+def status_cache_stats():
+    return status_cache.stats()
@@ -1,7 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response, Query
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from .. import database, models, schemas, logger
+from ..utils import pagination
 import uuid
 import time
 
@@ -18,17 +19,40 @@ def get_db():
         db.close()
 
 @router.get("/", response_model=List[schemas.PurchaseResponse])
-def read_purchases(skip: int = 0, limit: int = 100, show_deleted: bool = False, db: Session = Depends(get_db)):
+def read_purchases(
+    response: Response,
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    show_deleted: bool = False,
+    db: Session = Depends(get_db)
+):
     """
-    Get all purchases. By default hides deleted items.
+    Get all purchases, newest first. By default hides deleted items.
     Admin can request show_deleted=True (logic to be refined with roles later).
+    The next page cursor is returned in the X-Next-Cursor header.
     """
     query = db.query(models.Purchase)
     
     if not show_deleted:
         query = query.filter(models.Purchase.is_deleted == False)
-        
-    purchases = query.order_by(models.Purchase.request_date.desc()).offset(skip).limit(limit).all()
+
+    if skip and cursor:
+        raise HTTPException(status_code=400, detail="Use either skip or cursor, not both")
+
+    if skip:
+        # Legacy offset paging (kept for backward compatibility)
+        return query.order_by(models.Purchase.request_date.desc(), models.Purchase.id.desc()).offset(skip).limit(limit).all()
+
+    try:
+        purchases, next_cursor = pagination.keyset_page(
+            query, models.Purchase.request_date, models.Purchase.id, limit, cursor=cursor, descending=True
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return purchases
 
 @router.post("/", response_model=schemas.PurchaseResponse)
@@ -46,7 +70,7 @@ def create_purchase(purchase: schemas.PurchaseCreate, username: str, db: Session
     db.commit()
     db.refresh(new_purchase)
     
-    logger.log_action(db, username=username, action="CREATE_PURCHASE", details=f"Item: {purchase.item}")
+    logger.log_action(db, username=username, action="CREATE_PURCHASE", details=f"Item: {purchase.item}", entity_id=new_id)
     
     return new_purchase
 
@@ -69,7 +93,7 @@ def update_purchase(purchase_id: str, purchase: schemas.PurchaseUpdate, username
     db.commit()
     db.refresh(db_purchase)
     
-    logger.log_action(db, username=username, action="UPDATE_PURCHASE", details=f"Updated Purchase: {purchase_id} -> {purchase}")
+    logger.log_action(db, username=username, action="UPDATE_PURCHASE", details=f"Updated Purchase: {purchase_id} -> {purchase}", entity_id=purchase_id)
 
     return db_purchase
 
@@ -86,7 +110,7 @@ def delete_purchase(purchase_id: str, username: str, db: Session = Depends(get_d
     db_purchase.is_deleted = True
     db.commit()
     
-    logger.log_action(db, username=username, action="DELETE_PURCHASE", details=f"Soft deleted purchase {purchase_id}")
+    logger.log_action(db, username=username, action="DELETE_PURCHASE", details=f"Soft deleted purchase {purchase_id}", entity_id=purchase_id)
     
     return {"message": "Purchase moved to trash (Soft Delete)"}
 
@@ -102,6 +126,6 @@ def restore_purchase(purchase_id: str, username: str, db: Session = Depends(get_
     db_purchase.is_deleted = False
     db.commit()
     
-    logger.log_action(db, username=username, action="RESTORE_PURCHASE", details=f"Restored purchase {purchase_id}")
+    logger.log_action(db, username=username, action="RESTORE_PURCHASE", details=f"Restored purchase {purchase_id}", entity_id=purchase_id)
     
     return {"message": "Purchase restored successfully"}
@@ -0,0 +1,587 @@
+"""
+Multi-resource appointment scheduler.
+
+A visit (trámite) goes through several resources on the same day, one after
+the other: the counter (the Placilla office for AGENDA PLACILLA licences),
+then the pending exams. Every resource has a number of interchangeable
+units (counters, doctors, seats of the theory room, driving examiners), a
+duration per citizen, the times a citizen may start (every N minutes from
+the opening), opening hours per weekday, and is closed on holidays (the
+holidays table plus SCHEDULER_HOLIDAYS).
+
+The occupation of a unit on a day is a bitmap of TICK_MINUTES ticks (a
+Python int). Where a step fits is a few shifts and ANDs over the unit's
+free bitmap, so trying a day costs microseconds, and the occupation of a
+whole month is read in one query: searching months ahead stays fast. For a
+fixed order of steps, starting every step as early as possible gives the
+earliest visit, so the search is greedy; with ordered=False the exams may
+also be taken in any order and the order that ends first wins.
+
+A reservation updates the occupation rows conditionally on their version
+(inserting the ones that do not exist yet), so two workers that picked the
+same interval cannot both take it; a row changed only elsewhere is read
+again and taken all the same. The loser of a real overlap waits a random
+moment (up to SCHEDULER_BACKOFF_SECONDS, doubling per attempt, so colliding
+workers do not collide again in lockstep) and searches again, up to
+SCHEDULER_MAX_ATTEMPTS times. Counter appointments booked at a chosen time
+(POST /appointments/book, see booking.py) take a "meson" unit the same way,
+so both draw from the same counters, plus a unit of "meson_horas": one per
+start time (APPOINTMENT_SLOT_CAPACITY), so /book hands out a time once
+however many counters are open.
+
+Resources come from DEFAULT_RESOURCES, or from the JSON file at
+SCHEDULER_RESOURCES_FILE with the same shape. "meson_horas" follows the
+counter's hours unless configured; it is not a step of /schedule visits.
+"""
+import datetime
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+from sqlalchemy.exc import IntegrityError
+
+from . import models
+
+TICK_MINUTES = int(os.getenv("SCHEDULER_TICK_MINUTES", "5"))
+HORIZON_DAYS = int(os.getenv("SCHEDULER_HORIZON_DAYS", "180"))
+LEAD_MINUTES = int(os.getenv("SCHEDULER_LEAD_MINUTES", "60")) # Earliest start today, from now
+GAP_MINUTES = int(os.getenv("SCHEDULER_GAP_MINUTES", "0")) # Between consecutive steps
+MAX_ATTEMPTS = int(os.getenv("SCHEDULER_MAX_ATTEMPTS", "8"))
+BACKOFF_SECONDS = float(os.getenv("SCHEDULER_BACKOFF_SECONDS", "0.01")) # Before the first retry, then doubled
+RESOURCES_FILE = os.getenv("SCHEDULER_RESOURCES_FILE")
+SLOT_CAPACITY = int(os.getenv("APPOINTMENT_SLOT_CAPACITY", "1")) # /book appointments per counter time
+EXTRA_HOLIDAYS = {day.strip() for day in os.getenv("SCHEDULER_HOLIDAYS", "").split(",") if day.strip()}
+CHUNK_DAYS = 31 # Days of occupation read per query
+
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+COUNTER = "meson"
+COUNTER_TIMES = "meson_horas" # Internal: /book's appointments per counter time
+PLACILLA = "placilla"
+EXAMS = ["exam_medico", "exam_teorico", "exam_practico"] # License fields, in their usual order
+PENDING_EXAM = {models.ExamStatus.PENDIENTE.value, models.ExamStatus.REPROBADO_1.value}
+
+# units: citizens served at once; minutes: per citizen; every: minutes between
+# possible starts (default: minutes); hours: weekday or range -> open windows
+DEFAULT_RESOURCES = {
+    COUNTER: {"name": "Mesón de atención", "units": 3, "minutes": 20, "hours": {"mon-fri": ["09:00-14:00"]}},
+    PLACILLA: {"name": "Oficina Placilla", "units": 1, "minutes": 20, "hours": {"tue": ["09:00-13:00"], "thu": ["09:00-13:00"]}},
+    "exam_medico": {"name": "Examen médico", "units": 2, "minutes": 20, "hours": {"mon-fri": ["09:00-13:30"]}},
+    "exam_teorico": {"name": "Examen teórico", "units": 12, "minutes": 45, "hours": {"mon-fri": ["09:00-13:30"]}},
+    "exam_practico": {"name": "Examen práctico", "units": 2, "minutes": 40, "hours": {"mon-fri": ["09:00-14:00"], "sat": ["09:00-12:00"]}},
+}
+
+
+class InvalidTramite(ValueError):
+    pass
+
+
+class NoAvailability(LookupError):
+    pass
+
+
+class SchedulingConflict(Exception):
+    pass
+
+
+def _ticks(minutes: int) -> int:
+    return -(-minutes // TICK_MINUTES)
+
+
+def _minutes(hhmm: str) -> int:
+    hours, minutes = map(int, hhmm.split(":"))
+    return hours * 60 + minutes
+
+
+def _hhmm(tick: int) -> str:
+    minutes = tick * TICK_MINUTES
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _parse_time(hhmm: str) -> int:
+    """
+    Tick of an HH:MM time, which must fall on a tick. Raises InvalidTramite.
+    """
+    try:
+        tick = _minutes(hhmm) // TICK_MINUTES
+    except (AttributeError, ValueError):
+        raise InvalidTramite("Horario no disponible")
+    if _hhmm(tick) != hhmm:
+        raise InvalidTramite("Horario no disponible")
+    return tick
+
+
+def _interval(start: int, end: int) -> int:
+    """
+    Bitmap with ticks start..end-1 set.
+    """
+    return ((1 << (end - start)) - 1) << start
+
+
+def _weekdays(spec: str) -> list:
+    if "-" in spec:
+        first, last = spec.split("-")
+        return list(range(WEEKDAYS.index(first), WEEKDAYS.index(last) + 1))
+    return [WEEKDAYS.index(spec)]
+
+
+def fits(free: int, length: int) -> int:
+    """
+    Bitmap of the ticks p such that p..p+length-1 are all free.
+    """
+    result, span = free, 1
+    while span < length:
+        # result covers runs of `span` ticks: combining it with itself shifted doubles them
+        step = min(span, length - span)
+        result &= result >> step
+        span += step
+    return result
+
+
+def _first(bitmap: int) -> int:
+    return (bitmap & -bitmap).bit_length() - 1
+
+
+class Resource:
+
+    def __init__(self, key: str, name: str, units: int, minutes: int, hours: dict, every: int = None):
+        self.key = key
+        self.name = name
+        self.units = units
+        self.minutes = minutes
+        self.ticks = _ticks(minutes)
+        self.hours = hours
+        self.every = every
+        every_ticks = _ticks(every or minutes)
+        # Per weekday: open ticks, and the ticks a step may start at
+        self.open = [0] * 7
+        self.starts = [0] * 7
+        for spec, windows in hours.items():
+            for window in windows:
+                start, end = (_ticks(_minutes(part)) for part in window.split("-"))
+                for weekday in _weekdays(spec):
+                    self.open[weekday] |= _interval(start, end)
+                    for tick in range(start, end - self.ticks + 1, every_ticks):
+                        self.starts[weekday] |= 1 << tick
+
+    def describe(self) -> dict:
+        return {"key": self.key, "name": self.name, "units": self.units, "minutes": self.minutes, "hours": self.hours}
+
+
+def load_resources(path: str = RESOURCES_FILE) -> dict:
+    config = DEFAULT_RESOURCES
+    if path:
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+    resources = {key: Resource(key, **spec) for key, spec in config.items()}
+    counter = resources.get(COUNTER)
+    if counter is not None and COUNTER_TIMES not in resources:
+        resources[COUNTER_TIMES] = Resource(
+            COUNTER_TIMES, "Horas del mesón", SLOT_CAPACITY, counter.minutes, counter.hours, counter.every
+        )
+    return resources
+
+
+def steps_for_license(license) -> list:
+    """
+    Resources a licence's visit needs: its office, then its pending exams.
+    """
+    office = PLACILLA if license.process_status == models.ProcessStatus.AGENDA_PLACILLA.value else COUNTER
+    return [office] + [exam for exam in EXAMS if getattr(license, exam) in PENDING_EXAM]
+
+
+class Scheduler:
+
+    def __init__(self, resources: dict = None, horizon_days: int = HORIZON_DAYS, lead_minutes: int = LEAD_MINUTES,
+                 gap_minutes: int = GAP_MINUTES, max_attempts: int = MAX_ATTEMPTS, holidays=EXTRA_HOLIDAYS):
+        self.resources = resources if resources is not None else load_resources()
+        self.horizon_days = horizon_days
+        self.lead_minutes = lead_minutes
+        self.gap_ticks = _ticks(gap_minutes)
+        self.max_attempts = max_attempts
+        self.extra_holidays = set(holidays)
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.search_seconds = 0.0
+        self.days_scanned = 0
+        self.reservations = 0
+        self.conflicts = 0
+
+    def validate_steps(self, steps) -> list:
+        steps = [step.strip() for step in steps or [] if step and step.strip()]
+        if not steps:
+            raise InvalidTramite("Indique al menos un recurso")
+        unknown = [step for step in steps if step not in self.resources or step == COUNTER_TIMES]
+        if unknown:
+            raise InvalidTramite(f"Recurso desconocido: {', '.join(unknown)}")
+        if len(set(steps)) != len(steps):
+            raise InvalidTramite("Un recurso no puede repetirse en la misma visita")
+        return steps
+
+    def holidays(self, db, first: datetime.date, last: datetime.date) -> set:
+        rows = db.query(models.Holiday.date).filter(
+            models.Holiday.date >= first.isoformat(),
+            models.Holiday.date <= last.isoformat()
+        )
+        return self.extra_holidays | {row.date for row in rows}
+
+    def _occupation(self, db, keys, first: str, last: str) -> dict:
+        """
+        (resource, date, unit) -> (busy bitmap, version) of the rows in the range.
+        """
+        rows = db.query(
+            models.ResourceDay.resource, models.ResourceDay.date, models.ResourceDay.unit,
+            models.ResourceDay.busy, models.ResourceDay.version
+        ).filter(
+            models.ResourceDay.resource.in_(keys),
+            models.ResourceDay.date >= first,
+            models.ResourceDay.date <= last
+        )
+        return {(row.resource, row.date, row.unit): (int(row.busy, 16), row.version) for row in rows}
+
+    def _plan_day(self, steps, date: str, weekday: int, busy: dict, not_before: int):
+        """
+        Earliest (resource, unit, start tick, end tick) per step on the day,
+        the steps one after the other, or None.
+        """
+        plan = []
+        earliest = not_before
+        for key in steps:
+            resource = self.resources[key]
+            starts = resource.starts[weekday] & ~((1 << earliest) - 1)
+            best = None
+            for unit in range(resource.units):
+                free = resource.open[weekday] & ~busy.get((key, date, unit), (0, None))[0]
+                candidates = fits(free, resource.ticks) & starts
+                if candidates:
+                    start = _first(candidates)
+                    if best is None or start < best[1]:
+                        best = (unit, start)
+                        if start == _first(starts):
+                            break # No unit can start earlier
+            if best is None:
+                return None
+            unit, start = best
+            plan.append((key, unit, start, start + resource.ticks))
+            earliest = start + resource.ticks + self.gap_ticks
+        return plan
+
+    def _search(self, db, steps, start: datetime.date = None, ordered: bool = True, now: datetime.datetime = None):
+        """
+        (date, plan, occupation) of the earliest visit, or None within the horizon.
+        """
+        started = time.perf_counter()
+        now = now or datetime.datetime.now()
+        first = max(start or now.date(), now.date())
+        last = first + datetime.timedelta(days=self.horizon_days - 1)
+        orders = [steps] if ordered else [[steps[0]] + list(rest) for rest in itertools.permutations(steps[1:])]
+        resources = [self.resources[key] for key in steps]
+        closed = self.holidays(db, first, last)
+        scanned = 0
+        found = None
+
+        chunk = first
+        while found is None and chunk <= last:
+            chunk_end = min(chunk + datetime.timedelta(days=CHUNK_DAYS - 1), last)
+            days = [chunk + datetime.timedelta(days=i) for i in range((chunk_end - chunk).days + 1)]
+            days = [
+                day for day in days
+                if day.isoformat() not in closed and all(resource.starts[day.weekday()] for resource in resources)
+            ]
+            if days:
+                busy = self._occupation(db, steps, days[0].isoformat(), days[-1].isoformat())
+                for day in days:
+                    scanned += 1
+                    not_before = 0
+                    if day == now.date():
+                        not_before = _ticks(now.hour * 60 + now.minute + self.lead_minutes)
+                    plans = [self._plan_day(order, day.isoformat(), day.weekday(), busy, not_before) for order in orders]
+                    plans = [plan for plan in plans if plan is not None]
+                    if plans:
+                        found = (day.isoformat(), min(plans, key=lambda plan: (plan[-1][3], plan[0][2])), busy)
+                        break
+            chunk = chunk_end + datetime.timedelta(days=1)
+
+        with self._lock:
+            self.searches += 1
+            self.search_seconds += time.perf_counter() - started
+            self.days_scanned += scanned
+        return found
+
+    def describe_plan(self, date: str, plan) -> dict:
+        return {
+            "date": date,
+            "start": _hhmm(plan[0][2]),
+            "end": _hhmm(plan[-1][3]),
+            "steps": [
+                {"resource": key, "name": self.resources[key].name, "unit": unit + 1,
+                 "start": _hhmm(start), "end": _hhmm(end)}
+                for key, unit, start, end in plan
+            ],
+        }
+
+    def find(self, db, steps, start: datetime.date = None, ordered: bool = True) -> dict:
+        """
+        The earliest visit through the given resources, without reserving it.
+        Raises InvalidTramite or NoAvailability.
+        """
+        steps = self.validate_steps(steps)
+        found = self._search(db, steps, start, ordered)
+        if found is None:
+            raise NoAvailability(f"Sin disponibilidad en los próximos {self.horizon_days} días")
+        date, plan, _ = found
+        return self.describe_plan(date, plan)
+
+    def _claim(self, db, date: str, plan, busy: dict) -> bool:
+        """
+        Marks the plan's intervals as taken, each conditionally on the version
+        of its occupation row: a row changed since the plan was computed is
+        read again, and still taken if the interval stayed free. Does not
+        commit. The versions are the check, so end the transaction that read
+        `busy` first: under SQLite a read lock carried into the write makes
+        concurrent writers wait on it, and the connection goes back to the
+        pool when there is nothing to claim.
+        """
+        for key, unit, start, end in plan:
+            interval = _interval(start, end)
+            current, version = busy.get((key, date, unit), (0, None))
+            if version is None:
+                # Raises IntegrityError when another reservation created the row meanwhile
+                db.execute(models.ResourceDay.__table__.insert().values(
+                    resource=key, date=date, unit=unit, busy=format(interval, "x"), version=1
+                ))
+                continue
+            for _ in range(self.max_attempts):
+                updated = db.query(models.ResourceDay).filter(
+                    models.ResourceDay.resource == key,
+                    models.ResourceDay.date == date,
+                    models.ResourceDay.unit == unit,
+                    models.ResourceDay.version == version
+                ).update({"busy": format(current | interval, "x"), "version": version + 1},
+                         synchronize_session=False)
+                if updated == 1:
+                    break
+                row = db.query(models.ResourceDay.busy, models.ResourceDay.version).filter(
+                    models.ResourceDay.resource == key,
+                    models.ResourceDay.date == date,
+                    models.ResourceDay.unit == unit
+                ).one()
+                current, version = int(row.busy, 16), row.version
+                if current & interval:
+                    return False
+            else:
+                return False
+        return True
+
+    def _add_bookings(self, db, appointment_id: str, date: str, plan):
+        db.add_all([
+            models.ResourceBooking(
+                appointment_id=appointment_id, resource=key, unit=unit, date=date,
+                start_minute=start_tick * TICK_MINUTES, end_minute=end_tick * TICK_MINUTES
+            )
+            for key, unit, start_tick, end_tick in plan
+        ])
+
+    def _reserve(self, db, rut: str, date: str, plan, busy: dict):
+        """
+        Claims the plan and creates its appointment, or returns None (rolled
+        back) when a concurrent reservation took part of it. Commits.
+        Call it with the read of `busy` ended (see _claim).
+        """
+        try:
+            if self._claim(db, date, plan, busy):
+                appointment = models.Appointment(
+                    id=str(uuid.uuid4()), rut=rut, date=date, time=_hhmm(plan[0][2]), status="CONFIRMED",
+                    tramite=",".join(key for key, _, _, _ in plan)
+                )
+                db.add(appointment)
+                self._add_bookings(db, appointment.id, date, plan)
+                db.commit()
+                with self._lock:
+                    self.reservations += 1
+                return appointment
+        except IntegrityError:
+            pass
+        db.rollback()
+        with self._lock:
+            self.conflicts += 1
+        return None
+
+    def _backoff(self, attempt: int):
+        time.sleep(random.uniform(0, BACKOFF_SECONDS * 2 ** attempt))
+
+    def schedule(self, db, rut: str, steps, start: datetime.date = None, ordered: bool = True):
+        """
+        Reserves the earliest visit and creates its appointment.
+        Returns (appointment, plan description). Raises InvalidTramite,
+        NoAvailability or SchedulingConflict. Commits.
+        """
+        steps = self.validate_steps(steps)
+        for attempt in range(self.max_attempts):
+            found = self._search(db, steps, start, ordered)
+            db.rollback() # End the read (see _claim)
+            if found is None:
+                raise NoAvailability(f"Sin disponibilidad en los próximos {self.horizon_days} días")
+            date, plan, busy = found
+            appointment = self._reserve(db, rut, date, plan, busy)
+            if appointment is not None:
+                return appointment, self.describe_plan(date, plan)
+            # Taken by a concurrent reservation: search again
+            self._backoff(attempt)
+        raise SchedulingConflict("La agenda cambió, intente nuevamente")
+
+    def _free_unit(self, key: str, date: str, free: int, start: int, busy: dict):
+        """
+        First unit of the resource free for a step at the start tick, within
+        `free` (a bitmap of the ticks it may use), or None.
+        """
+        resource = self.resources[key]
+        for unit in range(resource.units):
+            if fits(free & ~busy.get((key, date, unit), (0, None))[0], resource.ticks) >> start & 1:
+                return unit
+        return None
+
+    def _plan_at(self, keys, date: str, free: dict, start: int, busy: dict):
+        """
+        A unit of every resource for a step starting at the start tick, all
+        at once, within free[key] (a bitmap of the ticks it may use), or None.
+        """
+        plan = []
+        for key in keys:
+            unit = self._free_unit(key, date, free[key], start, busy)
+            if unit is None:
+                return None
+            plan.append((key, unit, start, start + self.resources[key].ticks))
+        return plan
+
+    def free_times(self, db, keys, first: datetime.date, last: datetime.date) -> dict:
+        """
+        date -> HH:MM times at which some unit of every resource can take a
+        step, for every day from first to last, from one range query.
+        """
+        closed = self.holidays(db, first, last)
+        busy = self._occupation(db, keys, first.isoformat(), last.isoformat())
+        result = {}
+        for offset in range((last - first).days + 1):
+            day = first + datetime.timedelta(days=offset)
+            date = day.isoformat()
+            starts = 0
+            if date not in closed:
+                weekday = day.weekday()
+                starts = -1
+                for key in keys:
+                    resource = self.resources[key]
+                    fitting = 0
+                    for unit in range(resource.units):
+                        free = resource.open[weekday] & ~busy.get((key, date, unit), (0, None))[0]
+                        fitting |= fits(free, resource.ticks)
+                    starts &= fitting & resource.starts[weekday]
+            result[date] = [_hhmm(tick) for tick in range(starts.bit_length()) if starts >> tick & 1]
+        return result
+
+    def reserve_at(self, db, rut: str, keys, day: datetime.date, hhmm: str):
+        """
+        Reserves a unit of every resource for a step starting at the given
+        time and creates its appointment. Raises InvalidTramite (a resource
+        takes no step then), NoAvailability (every unit of one is taken) or
+        SchedulingConflict. Commits.
+        """
+        date, weekday = day.isoformat(), day.weekday()
+        start = _parse_time(hhmm)
+        closed = date in self.holidays(db, day, day)
+        db.rollback()
+        if closed or not all(self.resources[key].starts[weekday] >> start & 1 for key in keys):
+            raise InvalidTramite("Horario no disponible")
+        open_hours = {key: self.resources[key].open[weekday] for key in keys}
+        for attempt in range(self.max_attempts):
+            busy = self._occupation(db, keys, date, date)
+            db.rollback() # End the read (see _claim)
+            plan = self._plan_at(keys, date, open_hours, start, busy)
+            if plan is None:
+                raise NoAvailability("Horario ya reservado")
+            appointment = self._reserve(db, rut, date, plan, busy)
+            if appointment is not None:
+                return appointment
+            self._backoff(attempt)
+        raise SchedulingConflict("La agenda cambió, intente nuevamente")
+
+    def hold(self, db, appointment_id: str, keys, date: str, hhmm: str) -> bool:
+        """
+        Gives an existing appointment without resources (tramite NULL) a unit
+        of every resource at its time, opening hours aside. False when every
+        unit of one is taken then; the appointment is marked all the same, so
+        it is only tried once. Raises InvalidTramite for a malformed time,
+        leaving the appointment as it was. Commits.
+        """
+        start = _parse_time(hhmm)
+        whole_day = {key: _interval(0, _ticks(24 * 60)) for key in keys}
+        for attempt in range(self.max_attempts):
+            busy = self._occupation(db, keys, date, date)
+            db.rollback() # End the read (see _claim)
+            marked = db.query(models.Appointment).filter(
+                models.Appointment.id == appointment_id,
+                models.Appointment.tramite.is_(None)
+            ).update({"tramite": ",".join(keys)}, synchronize_session=False)
+            if marked != 1:
+                db.rollback()
+                return True # Done by another worker
+            plan = self._plan_at(keys, date, whole_day, start, busy)
+            if plan is None:
+                db.commit()
+                return False
+            try:
+                if self._claim(db, date, plan, busy):
+                    self._add_bookings(db, appointment_id, date, plan)
+                    db.commit()
+                    return True
+            except IntegrityError:
+                pass
+            db.rollback()
+            self._backoff(attempt)
+        raise SchedulingConflict("La agenda cambió, intente nuevamente")
+
+    def release(self, db, appointment_id: str):
+        """
+        Frees the intervals held by a scheduled appointment. Does not commit.
+        """
+        bookings = db.query(models.ResourceBooking).filter(
+            models.ResourceBooking.appointment_id == appointment_id
+        ).all()
+        for booking in bookings:
+            interval = _interval(booking.start_minute // TICK_MINUTES, _ticks(booking.end_minute))
+            for _ in range(self.max_attempts):
+                row = db.query(models.ResourceDay.busy, models.ResourceDay.version).filter(
+                    models.ResourceDay.resource == booking.resource,
+                    models.ResourceDay.date == booking.date,
+                    models.ResourceDay.unit == booking.unit
+                ).first()
+                if row is None:
+                    break
+                updated = db.query(models.ResourceDay).filter(
+                    models.ResourceDay.resource == booking.resource,
+                    models.ResourceDay.date == booking.date,
+                    models.ResourceDay.unit == booking.unit,
+                    models.ResourceDay.version == row.version
+                ).update({"busy": format(int(row.busy, 16) & ~interval, "x"), "version": row.version + 1},
+                         synchronize_session=False)
+                if updated == 1:
+                    break
+            else:
+                raise SchedulingConflict("La agenda cambió, intente nuevamente")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "searches": self.searches,
+                "avg_search_ms": round(self.search_seconds / self.searches * 1000, 2) if self.searches else None,
+                "avg_days_scanned": round(self.days_scanned / self.searches, 1) if self.searches else None,
+                "reservations": self.reservations,
+                "conflicts": self.conflicts,
+                "horizon_days": self.horizon_days,
+            }
+
+
+scheduler = Scheduler()
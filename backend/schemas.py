@@ -85,6 +85,97 @@ class PurchaseResponse(PurchaseBase):
     class Config:
         orm_mode = True
 
+# --- AUDIT LOG SCHEMAS ---
+
+class AuditLogResponse(BaseModel):
+    id: str
+    timestamp: int
+    user_id: Optional[str] = None
+    username: Optional[str] = None
+    action: Optional[str] = None
+    details: Optional[str] = None
+    ip: Optional[str] = None
+    entity_id: Optional[str] = None
+    changes: Optional[str] = None
+
+    class Config:
+        orm_mode = True
+
+class AuditLogDayCount(BaseModel):
+    day: str # YYYY-MM-DD
+    count: int
+
+# --- EMAIL OUTBOX SCHEMAS ---
+
+class EmailOutboxResponse(BaseModel):
+    id: str
+    to_email: str
+    subject: str
+    status: str
+    attempts: int
+    last_error: Optional[str] = None
+    created_at: int
+    next_attempt_at: int
+    sent_at: Optional[int] = None
+    entity_id: Optional[str] = None
+
+    class Config:
+        orm_mode = True
+
+class CampaignCreate(BaseModel):
+    kind: str # ready_for_pickup, near_expiry
+    process_status: Optional[str] = None
+    status: Optional[str] = None
+    control_date_from: Optional[str] = None # YYYY-MM-DD
+    control_date_to: Optional[str] = None
+    days: int = 30 # near_expiry default window
+
+# --- DRIVE SCHEMAS ---
+
+class UploadJobResponse(BaseModel):
+    id: str
+    username: str
+    file_name: str
+    mime_type: Optional[str] = None
+    size: int
+    bytes_done: int
+    status: str
+    mode: Optional[str] = None
+    drive_id: Optional[str] = None
+    web_link: Optional[str] = None
+    error: Optional[str] = None
+    batch_id: Optional[str] = None
+    license_rut: Optional[str] = None
+    created_at: int
+    updated_at: int
+
+    class Config:
+        orm_mode = True
+
+class UploadBatchResponse(BaseModel):
+    batch_id: str
+    total: int
+    done: int
+    failed: int
+    jobs: List[UploadJobResponse]
+
+class DocumentResponse(BaseModel):
+    id: str
+    username: Optional[str] = None
+    name: str
+    license_rut: Optional[str] = None
+    drive_id: str
+    mode: str
+    size: int
+    sha256: Optional[str] = None
+    mime_type: Optional[str] = None
+    web_link: Optional[str] = None
+    created_at: Optional[int] = None
+    missing: bool
+
+    class Config:
+        orm_mode = True
+
 # Token Schemas
 class Token(BaseModel):
     access_token: str
@@ -0,0 +1,105 @@
+"""
+Cache of the public license status portal (GET /public/status/{rut}).
+
+Citizens refresh /status constantly, so answers are cached per rut_key.
+Writes to a license call invalidate_status(). With several gunicorn workers,
+set PUBLIC_CACHE_SHARED_INVALIDATION=1 so invalidations are published through
+the cache_invalidations table and picked up by the other workers within
+PUBLIC_CACHE_POLL_SECONDS; otherwise other workers converge within the TTL.
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import func
+
+from . import models, database
+from .utils.cache import TTLCache
+from .utils.rut import normalize_rut
+
+STATUS_CACHE_NAME = "public_status"
+SHARED_INVALIDATION = os.getenv("PUBLIC_CACHE_SHARED_INVALIDATION", "0") == "1"
+POLL_SECONDS = float(os.getenv("PUBLIC_CACHE_POLL_SECONDS", "1"))
+INVALIDATION_RETENTION_SECONDS = 3600
+PRUNE_SECONDS = 300
+
+status_cache = TTLCache(
+    max_size=int(os.getenv("PUBLIC_CACHE_MAX_SIZE", "50000")),
+    ttl=float(os.getenv("PUBLIC_CACHE_TTL_SECONDS", "60")),
+    negative_ttl=float(os.getenv("PUBLIC_CACHE_NEGATIVE_TTL_SECONDS", "10")),
+)
+
+_poll_lock = threading.Lock()
+_last_poll = 0.0
+_last_invalidation_id = None
+_last_prune = 0.0
+
+
+def _prune_invalidations(db):
+    """
+    Drops old invalidation events, at most every PRUNE_SECONDS per worker.
+    """
+    global _last_prune
+    if time.monotonic() - _last_prune < PRUNE_SECONDS:
+        return
+    _last_prune = time.monotonic()
+    db.query(models.CacheInvalidation).filter(
+        models.CacheInvalidation.created_at < int(time.time()) - INVALIDATION_RETENTION_SECONDS
+    ).delete(synchronize_session=False)
+    db.commit()
+
+
+def poll_shared_invalidations():
+    """
+    Applies invalidations published by other workers since the last poll.
+    """
+    global _last_poll, _last_invalidation_id
+    if not SHARED_INVALIDATION or time.monotonic() - _last_poll < POLL_SECONDS:
+        return
+    if not _poll_lock.acquire(blocking=False):
+        return
+    db = database.SessionLocal()
+    try:
+        _last_poll = time.monotonic()
+        if _last_invalidation_id is None:
+            # First poll: nothing cached yet, just remember where we are
+            _last_invalidation_id = db.query(func.max(models.CacheInvalidation.id)).scalar() or 0
+            return
+        events = db.query(models.CacheInvalidation.id, models.CacheInvalidation.key).filter(
+            models.CacheInvalidation.cache == STATUS_CACHE_NAME,
+            models.CacheInvalidation.id > _last_invalidation_id
+        ).order_by(models.CacheInvalidation.id).all()
+        for event_id, key in events:
+            status_cache.invalidate(key)
+            _last_invalidation_id = event_id
+        _prune_invalidations(db)
+    except Exception as e:
+        # Fall back to TTL expiry rather than failing the request
+        print(f"Cache invalidation poll failed: {e}")
+    finally:
+        db.close()
+        _poll_lock.release()
+
+
+def invalidate_status(db, *ruts):
+    """
+    Drops the cached public status of the given RUTs (any format).
+    Call after the license change has been committed.
+    """
+    keys = {normalize_rut(rut) for rut in ruts if rut}
+    for key in keys:
+        status_cache.invalidate(key)
+
+    if SHARED_INVALIDATION and keys:
+        try:
+            now = int(time.time())
+            for key in keys:
+                db.add(models.CacheInvalidation(cache=STATUS_CACHE_NAME, key=key, created_at=now))
+            db.commit()
+        except Exception as e:
+            print(f"Failed to publish cache invalidation: {e}")
+            db.rollback()
+
+
+def stats() -> dict:
+    return {**status_cache.stats(), "shared_invalidation": SHARED_INVALIDATION}
@@ -0,0 +1,228 @@
+"""
+Thumbnails and first-page previews of uploaded scans.
+
+Images (JPEG/PNG/WebP/TIFF...) and PDFs get a small thumbnail and a larger
+preview of their first page, stored next to the blob as
+"<sha256>.<variant>.<format>". Being keyed by content hash, they are shared
+by duplicate uploads and never go stale, so they are served with long-lived
+cache headers.
+
+Rendering is CPU-bound: it runs in a small process pool
+(THUMBNAIL_WORKERS processes per API worker, niced) so it never competes
+with request handling for the GIL or the CPU. Uploads schedule generation
+in the background; a request for a missing rendition generates it on demand,
+and concurrent requests for the same one share a single job.
+
+Pillow (images) and pypdfium2 (PDFs) are optional: without them the
+corresponding types have no thumbnails.
+"""
+import multiprocessing
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from . import blob_store
+
+VARIANTS = {
+    "thumb": 256,    # Longest side, in pixels
+    "preview": 1280,
+}
+FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+QUALITY = 80
+MAX_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "1"))
+MAX_PENDING = int(os.getenv("THUMBNAIL_QUEUE_SIZE", "50"))
+TIMEOUT_SECONDS = float(os.getenv("THUMBNAIL_TIMEOUT_SECONDS", "60"))
+MAX_PIXELS = 80_000_000 # Refuse decompression bombs
+WORK_PATH = os.path.join(blob_store.BLOB_PATH, ".work")
+
+
+class UnsupportedType(Exception):
+    pass
+
+
+def supports(mime_type: str) -> bool:
+    return bool(mime_type) and (mime_type.startswith("image/") or mime_type == "application/pdf")
+
+
+def rendition_path(sha256: str, variant: str, fmt: str) -> str:
+    return f"{blob_store.blob_path(sha256)}.{variant}.{fmt}"
+
+
+def _lower_priority():
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+
+
+def _first_page(source: str, mime_type: str, longest: int):
+    """
+    First page (or the image itself) as an RGB Pillow image. Runs in the pool.
+    """
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    if mime_type == "application/pdf":
+        import pypdfium2
+
+        pdf = pypdfium2.PdfDocument(source)
+        try:
+            page = pdf[0]
+            width, height = page.get_size()
+            # Render straight at the target size instead of full resolution
+            image = page.render(scale=longest / max(width, height)).to_pil()
+            page.close()
+        finally:
+            pdf.close()
+    else:
+        image = Image.open(source)
+        image.draft("RGB", (longest, longest)) # JPEG: decode at reduced scale
+        image = ImageOps.exif_transpose(image)
+    return image.convert("RGB")
+
+
+def render(source: str, sha256: str, mime_type: str, fmt: str = "webp") -> list:
+    """
+    Writes every variant of one content hash in one format. Runs in the pool.
+    Returns the written paths.
+    """
+    image = _first_page(source, mime_type, max(VARIANTS.values()))
+    written = []
+    # Largest first, each variant downscaled from the previous one
+    for variant, longest in sorted(VARIANTS.items(), key=lambda item: -item[1]):
+        image.thumbnail((longest, longest))
+        target = rendition_path(sha256, variant, fmt)
+        temp = f"{target}.{uuid.uuid4().hex}.part"
+        image.save(temp, FORMATS[fmt], quality=QUALITY)
+        os.replace(temp, target)
+        written.append(target)
+    return written
+
+
+def _render_and_cleanup(source: str, sha256: str, mime_type: str, fmt: str, remove_source: bool) -> list:
+    try:
+        return render(source, sha256, mime_type, fmt)
+    finally:
+        if remove_source:
+            try:
+                os.remove(source)
+            except OSError:
+                pass
+
+
+class ThumbnailPipeline:
+
+    def __init__(self, max_workers: int = MAX_WORKERS, max_pending: int = MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = {} # (sha256, fmt) -> future
+        self.generated = 0
+        self.failed = 0
+        self.skipped = 0
+
+    def _pool(self):
+        if self._executor is None:
+            # spawn: forking a threaded server process is unsafe
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_lower_priority,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def _submit(self, source: str, sha256: str, mime_type: str, fmt: str, remove_source: bool = False):
+        """
+        Starts rendering unless the same (sha256, format) is already in flight.
+        Returns the shared future, or None when the queue is full; a source
+        owned by the caller is removed when it is not used.
+        """
+        key = (sha256, fmt)
+        with self._lock:
+            future = self._in_flight.get(key)
+            started = future is None and len(self._in_flight) < self.max_pending
+            if started:
+                future = self._pool().submit(_render_and_cleanup, source, sha256, mime_type, fmt, remove_source)
+                self._in_flight[key] = future
+            elif future is None:
+                self.skipped += 1
+        if not started:
+            if remove_source:
+                os.remove(source)
+            return future
+
+        def done(finished):
+            with self._lock:
+                self._in_flight.pop(key, None)
+                if finished.exception() is None:
+                    self.generated += 1
+                else:
+                    self.failed += 1
+                    print(f"Thumbnail of {sha256} failed: {finished.exception()}")
+
+        future.add_done_callback(done)
+        return future
+
+    def schedule(self, source: str, sha256: str, mime_type: str):
+        """
+        Queues thumbnail generation after an upload. The source may be removed
+        by the caller right after: unless it is the stored blob it is first
+        linked into a work directory owned by the pipeline.
+        """
+        if not supports(mime_type) or os.path.exists(rendition_path(sha256, "thumb", "webp")):
+            return None
+        remove_source = False
+        if source != blob_store.blob_path(sha256):
+            os.makedirs(WORK_PATH, exist_ok=True)
+            work = os.path.join(WORK_PATH, uuid.uuid4().hex)
+            try:
+                os.link(source, work)
+            except OSError:
+                shutil.copyfile(source, work)
+            source, remove_source = work, True
+        return self._submit(source, sha256, mime_type, "webp", remove_source)
+
+    def ensure(self, sha256: str, mime_type: str, variant: str, fmt: str, fetch_source=None) -> str:
+        """
+        Path of a rendition, generating it on a cache miss (blocking until done).
+        fetch_source(path) must write the original to path when there is no
+        local blob (real Drive documents).
+        """
+        if not supports(mime_type):
+            raise UnsupportedType(mime_type)
+        path = rendition_path(sha256, variant, fmt)
+        if os.path.exists(path):
+            return path
+
+        source, remove_source = blob_store.blob_path(sha256), False
+        if not os.path.exists(source):
+            if fetch_source is None:
+                raise FileNotFoundError(source)
+            os.makedirs(WORK_PATH, exist_ok=True)
+            source, remove_source = os.path.join(WORK_PATH, uuid.uuid4().hex), True
+            fetch_source(source)
+
+        future = self._submit(source, sha256, mime_type, fmt, remove_source)
+        if future is None:
+            raise TimeoutError("Cola de miniaturas llena")
+        future.result(timeout=TIMEOUT_SECONDS)
+        return path
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "generated": self.generated,
+                "failed": self.failed,
+                "skipped": self.skipped,
+                "in_flight": len(self._in_flight),
+                "workers": self.max_workers,
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+thumbnail_pipeline = ThumbnailPipeline()
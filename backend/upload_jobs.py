@@ -0,0 +1,363 @@
+"""
+Background Drive uploads.
+
+The request handler only stages the incoming file on local disk (in a thread,
+off the event loop) and creates an UploadJob row. The upload to Google Drive,
+or to the simulation store as fallback, runs on a bounded thread pool and
+records its progress in the job row, so GET /drive/jobs/{id} works from any
+worker.
+
+Limits:
+    DRIVE_UPLOAD_WORKERS       uploads running at once per worker process
+    DRIVE_UPLOAD_QUEUE_SIZE    uploads waiting per worker process
+    DRIVE_UPLOAD_PER_USER      unfinished uploads per user (all workers); a batch counts once
+    DRIVE_BATCH_PARALLELISM    files of one /upload-batch uploading at once
+
+The per-user limit is counted again after the new jobs are committed (see
+enforce_user_limit), so concurrent requests cannot all take the last slot.
+A job whose upload can no longer be started (the pool was shut down while
+the worker stops) is marked FAILED rather than left queued.
+"""
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from googleapiclient.http import MediaFileUpload
+from sqlalchemy import func
+
+from . import models, database, logger, blob_store, documents, image_prep
+from .drive_client import drive_client, DRIVE_SIM_PATH, DRIVE_FOLDER_ID
+from .image_prep import image_preprocessor
+from .thumbnails import thumbnail_pipeline
+
+MAX_WORKERS = int(os.getenv("DRIVE_UPLOAD_WORKERS", "4"))
+MAX_QUEUE = int(os.getenv("DRIVE_UPLOAD_QUEUE_SIZE", "100"))
+MAX_PER_USER = int(os.getenv("DRIVE_UPLOAD_PER_USER", "10"))
+BATCH_PARALLELISM = int(os.getenv("DRIVE_BATCH_PARALLELISM", "3"))
+BATCH_MAX_FILES = int(os.getenv("DRIVE_BATCH_MAX_FILES", "100"))
+CHUNK_SIZE = 5 * 1024 * 1024 # Drive resumable chunks must be multiples of 256 KB
+COPY_BUFFER = 1024 * 1024
+PROGRESS_INTERVAL = 1.0 # Seconds between progress writes
+# Unfinished jobs not updated for this long are considered dead (worker restart)
+JOB_LEASE_SECONDS = 600
+
+STAGING_PATH = os.path.join(DRIVE_SIM_PATH, ".staging")
+
+
+class UploadRejected(Exception):
+    """
+    Raised when a concurrency limit is reached; maps to HTTP 429.
+    """
+
+
+def stage_file(source, job_id: str) -> tuple:
+    """
+    Copies an uploaded (spooled) file into the staging area.
+    Blocking: call it from a thread pool. Returns (path, size).
+    """
+    os.makedirs(STAGING_PATH, exist_ok=True)
+    path = os.path.join(STAGING_PATH, job_id)
+    source.seek(0)
+    with open(path, "wb") as target:
+        shutil.copyfileobj(source, target, COPY_BUFFER)
+        size = target.tell()
+    return path, size
+
+
+class UploadManager:
+
+    def __init__(self, max_workers: int = MAX_WORKERS, max_queue: int = MAX_QUEUE,
+                 max_per_user: int = MAX_PER_USER, session_factory=database.SessionLocal):
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.session_factory = session_factory
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="drive-upload")
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def _active_uploads(self, db, username: str) -> int:
+        # The jobs of one /upload-batch request count as a single upload
+        return db.query(
+            func.count(func.distinct(func.coalesce(models.UploadJob.batch_id, models.UploadJob.id)))
+        ).filter(
+            models.UploadJob.username == username,
+            models.UploadJob.status.in_([models.UploadJobStatus.QUEUED, models.UploadJobStatus.RUNNING]),
+            models.UploadJob.updated_at >= int(time.time()) - JOB_LEASE_SECONDS
+        ).scalar()
+
+    def check_user_limit(self, db, username: str):
+        """
+        Early refusal before any work is done. Not atomic: the limit is
+        enforced by enforce_user_limit once the jobs exist.
+        """
+        if self._active_uploads(db, username) >= self.max_per_user:
+            raise UploadRejected(f"Máximo {self.max_per_user} subidas en curso por usuario")
+
+    def enforce_user_limit(self, db, username: str, jobs: list):
+        """
+        Counts the user's unfinished uploads after `jobs` were committed and
+        withdraws them (deleted, UploadRejected) if that exceeds the limit.
+        Each of two requests racing for the last slot counts after its own
+        commit, so the later one always sees both; at worst both are refused.
+        """
+        if self._active_uploads(db, username) <= self.max_per_user:
+            return
+        db.query(models.UploadJob).filter(
+            models.UploadJob.id.in_([job.id for job in jobs])
+        ).delete(synchronize_session=False)
+        db.commit()
+        raise UploadRejected(f"Máximo {self.max_per_user} subidas en curso por usuario")
+
+    def reserve(self, count: int = 1):
+        """
+        Takes count slots in this worker's queue. Raises UploadRejected when full.
+        """
+        with self._lock:
+            if self._pending + count > self.max_queue:
+                raise UploadRejected("Demasiadas subidas en cola, intente nuevamente")
+            self._pending += count
+
+    def release(self, count: int = 1):
+        with self._lock:
+            self._pending -= count
+
+    def create_job(self, db, username: str, file_name: str, mime_type: str,
+                   job_id: str = None, size: int = 0, batch_id: str = None, license_rut: str = None):
+        job = models.UploadJob(
+            id=job_id or str(uuid.uuid4()),
+            username=username,
+            file_name=os.path.basename(file_name or "archivo"),
+            mime_type=mime_type,
+            status=models.UploadJobStatus.QUEUED,
+            size=size,
+            bytes_done=0,
+            batch_id=batch_id,
+            license_rut=license_rut,
+        )
+        db.add(job)
+        db.commit()
+        return job
+
+    def submit(self, job_id: str, staging_path: str):
+        """
+        Queues a staged file for upload. reserve() must have been called.
+        """
+        try:
+            future = self._executor.submit(self._run, job_id, staging_path)
+        except RuntimeError:
+            self.abandon(job_id, staging_path)
+            raise
+        future.add_done_callback(lambda _: self.release())
+        return future
+
+    def submit_batch(self, batch_id: str, username: str, items: list, parallelism: int = BATCH_PARALLELISM):
+        """
+        Uploads the (job_id, staging_path) items of a batch, at most
+        `parallelism` at a time, and writes one summary audit entry when the
+        last one finishes. reserve(len(items)) must have been called.
+        """
+        queue = list(items)
+        lock = threading.Lock()
+        outcome = {"done": 0, "failed": 0, "remaining": len(queue)}
+
+        def start_next():
+            with lock:
+                if not queue:
+                    return
+                job_id, staging_path = queue.pop(0)
+            try:
+                future = self._executor.submit(self._run, job_id, staging_path, False)
+            except RuntimeError:
+                # Called from a done-callback while the pool shuts down
+                self.abandon(job_id, staging_path)
+                record(False)
+                return
+            future.add_done_callback(finished)
+
+        def finished(future):
+            record(not future.exception() and future.result() == models.UploadJobStatus.DONE)
+
+        def record(ok):
+            self.release()
+            with lock:
+                outcome["done" if ok else "failed"] += 1
+                outcome["remaining"] -= 1
+                last = outcome["remaining"] == 0
+            if last:
+                self._log_batch(batch_id, username, outcome)
+            else:
+                start_next()
+
+        for _ in range(min(parallelism, len(queue))):
+            start_next()
+
+    def abandon(self, job_id: str, staging_path: str = None,
+                error: str = "Servidor detenido antes de iniciar la subida"):
+        """
+        Marks a job that could not be started as failed (if it is still
+        queued) and removes its staged file.
+        """
+        db = self.session_factory()
+        try:
+            db.query(models.UploadJob).filter(
+                models.UploadJob.id == job_id,
+                models.UploadJob.status == models.UploadJobStatus.QUEUED
+            ).update({
+                "status": models.UploadJobStatus.FAILED,
+                "error": error[:500],
+                "updated_at": int(time.time()),
+            }, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            print(f"Could not mark upload job {job_id} as failed: {e}")
+        finally:
+            db.close()
+            if staging_path:
+                try:
+                    os.remove(staging_path)
+                except OSError:
+                    pass
+
+    def _log_batch(self, batch_id: str, username: str, outcome: dict):
+        db = self.session_factory()
+        try:
+            logger.log_action(
+                db, username=username, action="UPLOAD_BATCH",
+                details=f"Batch {batch_id}: {outcome['done']} uploaded, {outcome['failed']} failed",
+                entity_id=batch_id
+            )
+        finally:
+            db.close()
+
+    def _update(self, db, job, **values):
+        for key, value in values.items():
+            setattr(job, key, value)
+        job.updated_at = int(time.time())
+        db.commit()
+
+    def _upload_real(self, db, job, service, staging_path: str) -> dict:
+        file_metadata = {
+            'name': f"{job.username}_{job.file_name}",
+            'mimeType': job.mime_type
+        }
+        if DRIVE_FOLDER_ID:
+            file_metadata['parents'] = [DRIVE_FOLDER_ID]
+
+        sha256, _ = blob_store.hash_file(staging_path)
+        media = MediaFileUpload(staging_path, mimetype=job.mime_type, resumable=True, chunksize=CHUNK_SIZE)
+        request = service.files().create(
+            body=file_metadata,
+            media_body=media,
+            fields='id, webContentLink, webViewLink'
+        )
+        response = None
+        last_write = 0.0
+        while response is None:
+            status, response = request.next_chunk()
+            if status and time.monotonic() - last_write >= PROGRESS_INTERVAL:
+                self._update(db, job, bytes_done=status.resumable_progress)
+                last_write = time.monotonic()
+        return {"mode": "real", "drive_id": response.get('id'), "web_link": response.get('webViewLink'),
+                "sha256": sha256}
+
+    def _upload_simulation(self, db, job, staging_path: str) -> dict:
+        last_write = [0.0]
+
+        def progress(done):
+            if time.monotonic() - last_write[0] >= PROGRESS_INTERVAL:
+                self._update(db, job, bytes_done=done)
+                last_write[0] = time.monotonic()
+
+        # The staging file is renamed into the store; a duplicate is not written at all
+        sha256, size, created = blob_store.put_file(staging_path, move=True, progress=progress)
+        entry = blob_store.save_file(db, job.username, job.file_name, sha256, size, job.mime_type)
+        return {
+            "mode": "simulation",
+            "drive_id": entry.id,
+            "web_link": None, # Set to the download URL when the document is recorded
+            "sha256": sha256,
+        }
+
+    def _normalize(self, db, job, staging_path: str):
+        """
+        Replaces a staged photo with its normalised version (IMAGE_PREP_DRIVE,
+        see image_prep.py); the stored name gets the new extension.
+        """
+        prepared = image_preprocessor.prepare_file(staging_path, job.mime_type)
+        if prepared is None:
+            return
+        path, mime_type, size = prepared
+        os.replace(path, staging_path)
+        self._update(db, job, file_name=image_prep.renamed(job.file_name), mime_type=mime_type, size=size)
+
+    def _schedule_thumbnails(self, job, staging_path: str, sha256: str):
+        # Simulation uploads were moved into the blob store; real ones are still staged
+        source = blob_store.blob_path(sha256) if job.mode == "simulation" else staging_path
+        try:
+            thumbnail_pipeline.schedule(source, sha256, job.mime_type)
+        except Exception as e:
+            print(f"Could not schedule thumbnails for {job.id}: {e}")
+
+    def _run(self, job_id: str, staging_path: str, log: bool = True):
+        """
+        Uploads one staged file and returns the final job status.
+        Batch files pass log=False; the batch writes one summary entry instead.
+        """
+        db = self.session_factory()
+        try:
+            job = db.query(models.UploadJob).filter(models.UploadJob.id == job_id).first()
+            if not job:
+                return models.UploadJobStatus.FAILED
+            self._update(db, job, status=models.UploadJobStatus.RUNNING)
+            if image_prep.FOR_DRIVE:
+                self._normalize(db, job, staging_path)
+
+            result = None
+            service = drive_client.get_service()
+            if service:
+                try:
+                    print(f"Attempting upload of {job.file_name} to REAL Google Drive...")
+                    result = self._upload_real(db, job, service, staging_path)
+                    print(f"Uploaded Real File ID: {result['drive_id']}")
+                except Exception as e:
+                    print(f"⚠️ Google Drive Real Failed: {e}")
+                    print("🔄 Falling back to Simulation Storage...")
+
+            if result is None:
+                print(f"Uploading {job.file_name} to SIMULATION Drive...")
+                result = self._upload_simulation(db, job, staging_path)
+
+            sha256 = result.pop("sha256")
+            self._update(db, job, status=models.UploadJobStatus.DONE, bytes_done=job.size, **result)
+            documents.record_upload(db, job, sha256)
+            self._schedule_thumbnails(job, staging_path, sha256)
+
+            if log and result["mode"] == "real":
+                logger.log_action(db, username=job.username, action="UPLOAD_REAL",
+                                  details=f"File: {job.file_name}, ID: {result['drive_id']}", entity_id=job.id)
+            elif log:
+                logger.log_action(db, username=job.username, action="UPLOAD_SIMULATION",
+                                  details=f"File: {job.file_name} (Fallback/Sim)", entity_id=job.id)
+            return models.UploadJobStatus.DONE
+        except Exception as e:
+            print(f"Error in upload job {job_id}: {e}")
+            db.rollback()
+            job = db.query(models.UploadJob).filter(models.UploadJob.id == job_id).first()
+            if job:
+                self._update(db, job, status=models.UploadJobStatus.FAILED, error=str(e)[:500])
+            return models.UploadJobStatus.FAILED
+        finally:
+            db.close()
+            try:
+                os.remove(staging_path)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+upload_manager = UploadManager()
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Sentinel stored for negative entries ("known not to exist")
+NOT_FOUND = object()
+
+
+class TTLCache:
+    """
+    Thread-safe in-process LRU cache with per-entry expiry.
+    get() returns None on a miss; negative results are stored as NOT_FOUND
+    with their own (usually shorter) TTL.
+
+    Read-through callers take a generation() before loading and pass it to
+    set(): if the key was invalidated while the value was being loaded, the
+    (possibly stale) value is not stored.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60, negative_ttl: float = 10):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # Invalidation epoch per recently invalidated key; older ones are
+        # folded into _floor, which is then assumed for every key
+        self._epoch = 0
+        self._invalidated = OrderedDict()
+        self._floor = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_sets = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self) -> int:
+        """
+        Token to pass to set() for a value loaded from now on.
+        """
+        with self._lock:
+            return self._epoch
+
+    def set(self, key, value, generation: int = None) -> bool:
+        """
+        Stores value, unless generation is given and the key was invalidated
+        since it was taken. Returns whether the value was stored.
+        """
+        ttl = self.negative_ttl if value is NOT_FOUND else self.ttl
+        with self._lock:
+            if generation is not None and self._invalidated.get(key, self._floor) > generation:
+                self.stale_sets += 1
+                return False
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def _bump(self, key):
+        self._epoch += 1
+        self._invalidated[key] = self._epoch
+        self._invalidated.move_to_end(key)
+        while len(self._invalidated) > self.max_size:
+            _, epoch = self._invalidated.popitem(last=False)
+            self._floor = max(self._floor, epoch)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._bump(key)
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._epoch += 1
+            self._floor = self._epoch
+            self._invalidated.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "stale_sets": self.stale_sets,
+            }
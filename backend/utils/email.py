@@ -1,25 +1,73 @@
-
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
+import uuid
 
 # Configuration (Env vars or config file)
 SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 SMTP_USER = os.getenv("SMTP_USER", "tu_correo@gmail.com")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "tu_app_password")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"
+SMTP_FROM = os.getenv("SMTP_FROM", SMTP_USER)
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT_SECONDS", "30"))
+
+def is_mock_mode() -> bool:
+    return SMTP_USER == "tu_correo@gmail.com"
+
+def build_message(to_email: str, subject: str, body: str) -> str:
+    msg = MIMEMultipart()
+    msg['From'] = SMTP_FROM
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain'))
+    return msg.as_string()
+
+def open_smtp_connection() -> smtplib.SMTP:
+    """
+    Opens and authenticates one SMTP session, to be reused for many messages.
+    STARTTLS and login are skipped when disabled / no user is set
+    (e.g. a local aiosmtpd server in tests).
+    """
+    server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+    if SMTP_STARTTLS:
+        server.starttls()
+    if SMTP_USER:
+        server.login(SMTP_USER, SMTP_PASSWORD)
+    return server
+
+def enqueue_email(db, to_email: str, subject: str, body: str, entity_id: str = None):
+    """
+    Adds an email to the outbox. Nothing is sent on the request path;
+    the row is committed together with the caller's transaction and
+    delivered by the background sender (see email_outbox.py).
+    """
+    from .. import models
+
+    outbox = models.EmailOutbox(
+        id=str(uuid.uuid4()),
+        to_email=to_email,
+        subject=subject,
+        body=body,
+        status=models.EmailStatus.PENDING,
+        attempts=0,
+        entity_id=entity_id,
+    )
+    db.add(outbox)
+    return outbox
 
 def send_notification_email(to_email: str, subject: str, body: str):
     """
-    Sends an email notification.
+    Sends an email notification immediately, over its own connection.
+    Prefer enqueue_email() on request paths.
     If credentials are not set, it mocks the sending by printing to console.
     """
     if not to_email:
         print("Warning: No email provided for notification.")
         return False
 
-    if SMTP_USER == "tu_correo@gmail.com":
+    if is_mock_mode():
         # Mock Mode
         print(f"--- MOCK EMAIL ---")
         print(f"To: {to_email}")
@@ -29,18 +77,8 @@ def send_notification_email(to_email: str, subject: str, body: str):
         return True
 
     try:
-        msg = MIMEMultipart()
-        msg['From'] = SMTP_USER
-        msg['To'] = to_email
-        msg['Subject'] = subject
-
-        msg.attach(MIMEText(body, 'plain'))
-
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(SMTP_USER, SMTP_PASSWORD)
-        text = msg.as_string()
-        server.sendmail(SMTP_USER, to_email, text)
+        server = open_smtp_connection()
+        server.sendmail(SMTP_FROM, to_email, build_message(to_email, subject, body))
         server.quit()
         print(f"Email sent to {to_email}")
         return True
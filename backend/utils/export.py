@@ -0,0 +1,44 @@
+import csv
+import io
+import json
+import zlib
+
+
+def iter_ndjson(rows, columns):
+    """
+    Yields one JSON document per row, newline separated.
+    """
+    for row in rows:
+        yield (json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def iter_csv(rows, columns, batch_size: int = 500):
+    """
+    Yields the CSV export in chunks of batch_size rows, header first.
+    Only the current chunk is ever held in memory.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= batch_size:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending = 0
+    yield buffer.getvalue().encode("utf-8")
+
+
+def gzip_stream(chunks, level: int = 6):
+    """
+    Gzip-compresses a stream of byte chunks incrementally.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
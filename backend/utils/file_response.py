@@ -0,0 +1,171 @@
+import os
+import re
+from email.utils import formatdate
+from urllib.parse import quote
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+
+READ_CHUNK = 256 * 1024
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: str, size: int):
+    """
+    Parses a single-range Range header into inclusive (start, end).
+    Returns None when the whole entity should be sent (no header, or a
+    multi-range/unknown unit, which may be ignored per RFC 9110).
+    Raises RangeNotSatisfiable when the range lies outside the entity.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    candidates = [value.strip() for value in header.split(",")]
+    return any((value[2:] if value.startswith("W/") else value) == etag for value in candidates)
+
+
+def content_disposition(filename: str, inline: bool = True) -> str:
+    kind = "inline" if inline else "attachment"
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"{kind}; filename*=utf-8''{quoted}"
+    return f'{kind}; filename="{filename}"'
+
+
+class RangeFileResponse(Response):
+    """
+    Sends [start, end] of a file. Uses the ASGI zero-copy extension when the
+    server offers it; otherwise the file is read in READ_CHUNK pieces off the
+    event loop, so memory stays bounded whatever the file size.
+    """
+
+    def __init__(self, path: str, start: int, end: int, status_code: int, headers: dict,
+                 media_type: str = None, send_body: bool = True):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.status_code = status_code
+        self.media_type = media_type
+        self.send_body = send_body
+        self.background = None
+        self.init_headers(headers)
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope, receive, send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.end < self.start:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        handle = await run_in_threadpool(open, self.path, "rb")
+        try:
+            if "http.response.zerocopy" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopy",
+                    "file": handle,
+                    "offset": self.start,
+                    "count": self.end - self.start + 1,
+                })
+                return
+
+            position = self.start
+            while position <= self.end:
+                size = min(READ_CHUNK, self.end - position + 1)
+                chunk = await run_in_threadpool(os.pread, handle.fileno(), size, position)
+                if not chunk:
+                    break
+                position += len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": position <= self.end})
+            if position <= self.end:
+                # File shrank under us: terminate the body
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            await run_in_threadpool(handle.close)
+
+
+def evaluate(request, etag: str, size: int) -> tuple:
+    """
+    Evaluates the conditional and range headers of a request for an entity.
+    Returns (status, byte_range): 304 when If-None-Match matches the (strong)
+    ETag, 416 for an unsatisfiable range, 206 with the inclusive range, or
+    200 with None. A Range is ignored when If-Range names another version.
+    """
+    if etag and etag_matches(request.headers.get("if-none-match"), etag):
+        return 304, None
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range.strip() != etag:
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, size)
+    except RangeNotSatisfiable:
+        return 416, None
+    return (200, None) if byte_range is None else (206, byte_range)
+
+
+def entity_headers(etag: str, size: int, status: int, byte_range, cache_control: str,
+                   filename: str = None) -> dict:
+    headers = {"accept-ranges": "bytes", "cache-control": cache_control}
+    if etag:
+        headers["etag"] = etag
+    if filename:
+        headers["content-disposition"] = content_disposition(filename)
+    if status == 206:
+        headers["content-range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{size}"
+    elif status == 416:
+        headers["content-range"] = f"bytes */{size}"
+    return headers
+
+
+def file_response(request, path: str, etag: str, media_type: str = None, filename: str = None,
+                  cache_control: str = "private, max-age=0, must-revalidate", accel_path: str = None):
+    """
+    Conditional, range-aware response for a stored file (see evaluate()).
+    With accel_path the body is left out and X-Accel-Redirect is set, so a
+    fronting nginx serves the file with sendfile (it handles Range itself).
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    status, byte_range = evaluate(request, etag, size)
+    if accel_path and status in (200, 206):
+        status, byte_range = 200, None
+    headers = entity_headers(etag, size, status, byte_range, cache_control, filename)
+    headers["last-modified"] = formatdate(stat.st_mtime, usegmt=True)
+
+    if status in (304, 416):
+        return Response(status_code=status, headers=headers)
+    if accel_path:
+        headers["x-accel-redirect"] = accel_path
+        return Response(status_code=200, headers=headers, media_type=media_type)
+
+    start, end = byte_range or (0, size - 1)
+    return RangeFileResponse(path, start, end, status, headers, media_type, request.method != "HEAD")
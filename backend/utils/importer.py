@@ -0,0 +1,96 @@
+import codecs
+import csv
+import zipfile
+
+# Spreadsheet header -> License field.
+# Covers the layout produced by generate_excel.py and the CSV from /licenses/export.
+HEADER_MAP = {
+    "rut": "rut",
+    "nombre": "full_name",
+    "full_name": "full_name",
+    "clase": "category",
+    "categoria": "category",
+    "category": "category",
+    "vencimiento": "fecha_control",
+    "fecha_control": "fecha_control",
+    "estado": "status",
+    "status": "status",
+    "process_status": "process_status",
+    "license_number": "license_number",
+    "last_control_date": "last_control_date",
+    "email": "email",
+    "phone": "phone",
+    "tipo_tramite": "tipo_tramite",
+    "exam_teorico": "exam_teorico",
+    "exam_practico": "exam_practico",
+    "exam_medico": "exam_medico",
+    "restricciones_medicas": "restricciones_medicas",
+}
+
+
+class InvalidFile(ValueError):
+    """
+    The uploaded file cannot be read (corrupt workbook, not UTF-8, ...).
+    """
+
+
+def iter_xlsx_rows(fileobj):
+    """
+    Yields the rows of the first sheet as tuples, header included.
+    Uses openpyxl read-only mode so the workbook is never fully loaded.
+    Raises InvalidFile for a file that is not a readable workbook.
+    """
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    try:
+        workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException, KeyError, OSError) as e:
+        raise InvalidFile(f"Archivo Excel inválido o dañado: {e}")
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield row
+    except (zipfile.BadZipFile, KeyError, ValueError, OSError) as e:
+        raise InvalidFile(f"Archivo Excel inválido o dañado: {e}")
+    finally:
+        workbook.close()
+
+
+def iter_csv_rows(fileobj):
+    """
+    Yields the rows of a UTF-8 CSV file (with or without BOM) as tuples.
+    Raises InvalidFile when it is not UTF-8 text.
+    """
+    reader = csv.reader(codecs.iterdecode(fileobj, "utf-8-sig"))
+    try:
+        for row in reader:
+            yield tuple(row)
+    except UnicodeDecodeError:
+        raise InvalidFile("El archivo CSV debe estar codificado en UTF-8")
+    except csv.Error as e:
+        raise InvalidFile(f"Archivo CSV inválido: {e}")
+
+
+def iter_records(rows):
+    """
+    Maps raw spreadsheet rows to (row_number, dict of License fields).
+    Unknown columns are ignored; empty rows are skipped.
+    """
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+    fields = [HEADER_MAP.get(str(h or "").strip().lower()) for h in header]
+
+    # Row 1 is the header, as shown in Excel
+    for number, row in enumerate(rows, start=2):
+        if not any(v not in (None, "") for v in row):
+            continue
+        record = {}
+        for field, value in zip(fields, row):
+            if field and value not in (None, ""):
+                if hasattr(value, "strftime"):
+                    # Excel date cells come back as datetime
+                    value = value.strftime("%Y-%m-%d")
+                record[field] = str(value).strip()
+        yield number, record
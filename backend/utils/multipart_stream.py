@@ -0,0 +1,146 @@
+import os
+import uuid
+
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+# Hard limit per uploaded file, enforced while the body streams in
+MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_MB", "25")) * 1024 * 1024
+# Non-file form fields are held in memory: their total size is capped
+MAX_FIELD_BYTES = 64 * 1024
+
+
+class StagedFile:
+    def __init__(self, field_name: str, filename: str, content_type: str, path: str):
+        self.field_name = field_name
+        self.filename = filename
+        self.content_type = content_type
+        self.path = path
+        self.size = 0
+        self.handle = None
+
+
+class MultipartTooLarge(Exception):
+    pass
+
+
+async def stream_multipart_to_disk(request, directory: str, max_files: int = None,
+                                   max_file_bytes: int = MAX_FILE_BYTES, max_field_bytes: int = MAX_FIELD_BYTES):
+    """
+    Parses a multipart/form-data body as it arrives and writes every file part
+    straight to its own file in `directory`, named with a fresh uuid.
+    Neither the body nor a whole file is ever held in memory; disk writes run
+    in the thread pool. File parts with an empty filename (a file input left
+    empty) are skipped. Returns (fields, staged_files).
+    Raises ValueError for a non-multipart body and MultipartTooLarge when
+    more than max_files files are sent, one exceeds max_file_bytes or the
+    other fields together exceed max_field_bytes, as soon as that happens
+    (staged files are removed).
+    """
+    content_type, params = parse_options_header(request.headers.get("Content-Type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise ValueError("Se esperaba multipart/form-data")
+
+    fields = {}
+    files = []
+    state = {"headers": {}, "field": b"", "value": b"", "name": "", "file": None, "skip": False, "data": b""}
+    field_bytes = [0]
+    pending = []  # (handle, bytes) written after each network chunk
+
+    def on_part_begin():
+        state.update(headers={}, file=None, skip=False, data=b"")
+
+    def on_header_field(data, start, end):
+        state["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["field"].lower()] = state["value"]
+        state["field"] = b""
+        state["value"] = b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        if options.get(b"filename") == b"":
+            state["skip"] = True
+        elif b"filename" in options:
+            if max_files is not None and len(files) >= max_files:
+                raise MultipartTooLarge(f"Máximo {max_files} archivos por lote")
+            staged = StagedFile(
+                field_name=name,
+                filename=os.path.basename(options[b"filename"].decode("utf-8", "replace")) or "archivo",
+                content_type=state["headers"].get(b"content-type", b"application/octet-stream").decode("latin-1"),
+                path=os.path.join(directory, str(uuid.uuid4())),
+            )
+            staged.handle = open(staged.path, "wb")
+            state["file"] = staged
+            files.append(staged)
+        state["name"] = name
+
+    def on_part_data(data, start, end):
+        staged = state["file"]
+        if state["skip"]:
+            return
+        if staged is None:
+            field_bytes[0] += end - start
+            if max_field_bytes is not None and field_bytes[0] > max_field_bytes:
+                raise MultipartTooLarge(f"Los campos del formulario superan el máximo de {max_field_bytes // 1024} KB")
+            state["data"] += data[start:end]
+        else:
+            chunk = data[start:end]
+            staged.size += len(chunk)
+            if max_file_bytes is not None and staged.size > max_file_bytes:
+                raise MultipartTooLarge(f"{staged.filename} supera el máximo de {max_file_bytes // (1024 * 1024)} MB")
+            pending.append((staged.handle, chunk))
+
+    def on_part_end():
+        staged = state["file"]
+        if state["skip"]:
+            return
+        if staged is None:
+            fields[state["name"]] = state["data"].decode("utf-8", "replace")
+        else:
+            pending.append((staged.handle, None))
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    def flush(items):
+        for handle, chunk in items:
+            if chunk is None:
+                handle.close()
+            else:
+                handle.write(chunk)
+
+    os.makedirs(directory, exist_ok=True)
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if pending:
+                items = pending[:]
+                pending.clear()
+                await run_in_threadpool(flush, items)
+        parser.finalize()
+    except BaseException:
+        for staged in files:
+            staged.handle.close()
+            try:
+                os.remove(staged.path)
+            except OSError:
+                pass
+        raise
+
+    for staged in files:
+        staged.handle.close()
+    return fields, files
@@ -0,0 +1,63 @@
+import base64
+import binascii
+import json
+
+from sqlalchemy import tuple_
+
+
+def encode_cursor(*values) -> str:
+    """
+    Encodes the sort key of the last row of a page into an opaque cursor.
+    """
+    raw = json.dumps(list(values), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    """
+    Decodes a cursor produced by encode_cursor.
+    Raises ValueError if the cursor was tampered with or is malformed.
+    """
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, binascii.Error):
+        raise ValueError("Cursor inválido")
+    if not isinstance(values, list):
+        raise ValueError("Cursor inválido")
+    # Only plain sort key values may reach the seek predicate
+    if any(isinstance(value, bool) or not isinstance(value, (str, int, float)) for value in values):
+        raise ValueError("Cursor inválido")
+    return values
+
+
+def keyset_page(query, sort_column, id_column, limit: int, cursor: str = None, descending: bool = False):
+    """
+    Returns (rows, next_cursor) for a page ordered on (sort_column, id_column).
+
+    The cursor is a seek predicate on the composite key, so the database jumps
+    straight to the page through the matching index instead of scanning and
+    discarding every skipped row like OFFSET does.
+    """
+    if limit < 1:
+        raise ValueError("limit debe ser al menos 1")
+    key = tuple_(sort_column, id_column)
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != 2:
+            raise ValueError("Cursor inválido")
+        query = query.filter(key < tuple_(*values) if descending else key > tuple_(*values))
+
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column, id_column)
+
+    # Fetch one extra row to know whether there is a next page
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
@@ -18,30 +18,31 @@ def validate_rut(rut: str) -> bool:
         return False
         
     try:
-        total = 0
-        multiplo = 2
-        
-        for d in reversed(cuerpo):
-            total += int(d) * multiplo
-            multiplo += 1
-            if multiplo == 8:
-                multiplo = 2
-        
-        resto = total % 11
-        dv_calculado = 11 - resto
-        
-        if dv_calculado == 11:
-            dv_esperado = '0'
-        elif dv_calculado == 10:
-            dv_esperado = 'K'
-        else:
-            dv_esperado = str(dv_calculado)
-            
-        return dv == dv_esperado
-        
+        return dv == check_digit(cuerpo)
     except Exception:
         return False
 
+def check_digit(cuerpo: str) -> str:
+    """
+    Check digit (0-9 or K) of a RUT body, computed with modulo 11.
+    """
+    total = 0
+    multiplo = 2
+
+    for d in reversed(cuerpo):
+        total += int(d) * multiplo
+        multiplo += 1
+        if multiplo == 8:
+            multiplo = 2
+
+    dv_calculado = 11 - total % 11
+
+    if dv_calculado == 11:
+        return '0'
+    if dv_calculado == 10:
+        return 'K'
+    return str(dv_calculado)
+
 def format_rut(rut: str) -> str:
     """
     Formats a RUT to '12.345.678-9' style.
@@ -56,3 +57,13 @@ def format_rut(rut: str) -> str:
     # Add points
     cuerpo_fmt = "{:,}".format(int(cuerpo)).replace(",", ".")
     return f"{cuerpo_fmt}-{dv}"
+
+def normalize_rut(rut: str) -> str:
+    """
+    Canonical lookup key for a RUT: body digits + check digit, no dots,
+    no hyphen, no leading zeros (e.g. '12.345.678-9' -> '123456789').
+    """
+    if not rut:
+        return rut
+    rut = "".join(c for c in str(rut) if c.isalnum()).upper()
+    return rut[:-1].lstrip("0") + rut[-1:]
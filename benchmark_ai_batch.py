@@ -0,0 +1,71 @@
+"""
+Benchmark: batch licence extraction (backend/ai_batch.py) against the
+deterministic fake model, offline.
+
+Builds a throwaway corpus of N "scans" and a throwaway database, then runs the
+whole pipeline (reading, retries, validation, writes into licenses) at
+several concurrency levels. Throughput should grow with concurrency until
+the simulated model latency stops dominating.
+
+Usage:
+    python benchmark_ai_batch.py [files] [latency_seconds] [failure_rate]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import models, logger
+from backend.ai_batch import BatchExtractor, iter_sources
+from backend.ai_client import FakeClient
+from backend.ai_service import ModelService
+
+FILES = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+LATENCY = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+FAILURE_RATE = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+LEVELS = [1, 4, 8, 16]
+
+
+def build_corpus(path):
+    for i in range(FILES):
+        with open(os.path.join(path, f"scan_{i:05d}.jpg"), "wb") as f:
+            f.write(os.urandom(64 * 1024))
+
+
+async def run(corpus, concurrency, session_factory):
+    client = FakeClient(latency=LATENCY, failure_rate=FAILURE_RATE)
+    service = ModelService(client_factory=lambda: client, max_concurrent=concurrency)
+    extractor = BatchExtractor(
+        service, concurrency=concurrency,
+        backoff=0.05, use_cache=False, write=True, username="SYSTEM", session_factory=session_factory
+    )
+    async for _ in extractor.run(iter_sources(corpus)):
+        pass
+    service.shutdown()
+    return extractor.report()
+
+
+def main():
+    workdir = tempfile.mkdtemp()
+    corpus = os.path.join(workdir, "scans")
+    os.makedirs(corpus)
+    build_corpus(corpus)
+
+    print(f"{FILES} files, {LATENCY}s simulated latency, {FAILURE_RATE:.0%} transient failures\n")
+    print(f"{'concurrency':>11} | {'docs/s':>7} | {'p50 ms':>7} | {'p95 ms':>7} | {'retries':>7} | {'written':>7} | {'failed':>6}")
+    for concurrency in LEVELS:
+        # Fresh database per level, so every run writes every licence
+        engine = create_engine(f"sqlite:///{os.path.join(workdir, f'bench_{concurrency}.db')}",
+                               connect_args={"check_same_thread": False})
+        models.Base.metadata.create_all(bind=engine)
+        report = asyncio.run(run(corpus, concurrency, sessionmaker(bind=engine)))
+        print(f"{concurrency:>11} | {report['docs_per_second']:>7} | {report['p50_ms']:>7} | {report['p95_ms']:>7} | "
+              f"{report['retries']:>7} | {report['written']:>7} | {report['failed']:>6}")
+    logger.shutdown()
+
+
+if __name__ == "__main__":
+    main()
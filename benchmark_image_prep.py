@@ -0,0 +1,105 @@
+"""
+Benchmark: photo normalisation before analysis (backend/image_prep.py).
+
+For every image of a corpus (a folder of real licence photos, or a synthetic
+set of phone-sized photos when none is given) reports the bytes before and
+after normalisation and the time it took, then estimates the end-to-end
+latency of an analysis with and without it: normalisation time + transfer
+of the payload at the given uplink + model time (which grows with the
+number of image bytes, modelled as a fixed part plus a per-MB part).
+
+Usage:
+    python benchmark_image_prep.py [folder] [--uplink-mbps 10] [--model-seconds 2.0] [--model-seconds-per-mb 0.3]
+"""
+import argparse
+import mimetypes
+import os
+import random
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+
+from backend.image_prep import ImagePreprocessor
+
+
+def build_corpus(path: str, count: int = 12):
+    """
+    Phone-like photos of a card on a table: 12 MP, noisy, high JPEG quality,
+    some rotated through the EXIF orientation tag.
+    """
+    rng = random.Random(42)
+    for i in range(count):
+        width, height = (4032, 3024) if i % 2 else (3024, 4032)
+        image = Image.effect_noise((width, height), 24).convert("RGB")
+        draw = ImageDraw.Draw(image)
+        draw.rectangle([width // 6, height // 4, width * 5 // 6, height * 3 // 4], fill=(230, 225, 210))
+        for line in range(12):
+            y = height // 4 + 80 + line * 90
+            draw.text((width // 6 + 60, y), f"LICENCIA DE CONDUCIR {rng.randint(10**7, 10**8)}", fill=(20, 20, 60))
+        exif = Image.Exif()
+        exif[0x0112] = rng.choice([1, 3, 6, 8]) # Orientation
+        exif[0x010F] = "PhoneMaker" # Make
+        image.save(os.path.join(path, f"photo_{i:02d}.jpg"), "JPEG", quality=95, exif=exif.tobytes())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("folder", nargs="?")
+    parser.add_argument("--uplink-mbps", type=float, default=10.0)
+    parser.add_argument("--model-seconds", type=float, default=2.0)
+    parser.add_argument("--model-seconds-per-mb", type=float, default=0.3)
+    args = parser.parse_args()
+
+    folder = args.folder
+    if not folder:
+        folder = tempfile.mkdtemp()
+        print("Building synthetic corpus...")
+        build_corpus(folder)
+
+    preprocessor = ImagePreprocessor(min_bytes=0, timeout=120)
+    workdir = tempfile.mkdtemp()
+    # First job pays the pool start-up; keep it out of the numbers
+    warmup = os.path.join(workdir, "warmup.jpg")
+    Image.new("RGB", (64, 64)).save(warmup)
+    preprocessor.prepare_file(warmup, "image/jpeg")
+
+    def end_to_end(size: int, prep_seconds: float) -> float:
+        mb = size / (1024 * 1024)
+        return prep_seconds + mb * 8 / args.uplink_mbps + args.model_seconds + mb * args.model_seconds_per_mb
+
+    print(f"{'file':<28} | {'original':>10} | {'prepared':>10} | {'saved':>6} | {'prep ms':>7} | {'e2e raw s':>9} | {'e2e prep s':>10}")
+    totals = {"in": 0, "out": 0, "prep": 0.0, "raw_e2e": 0.0, "prep_e2e": 0.0}
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        mime_type = mimetypes.guess_type(name)[0] or ""
+        if not mime_type.startswith("image/"):
+            continue
+        size = os.path.getsize(path)
+        started = time.perf_counter()
+        prepared = preprocessor.prepare_file(path, mime_type)
+        seconds = time.perf_counter() - started
+        if prepared is None:
+            print(f"{name[:28]:<28} | not normalised")
+            continue
+        out_path, _, out_size = prepared
+        os.remove(out_path)
+
+        raw_e2e, prep_e2e = end_to_end(size, 0.0), end_to_end(out_size, seconds)
+        totals["in"] += size
+        totals["out"] += out_size
+        totals["prep"] += seconds
+        totals["raw_e2e"] += raw_e2e
+        totals["prep_e2e"] += prep_e2e
+        print(f"{name[:28]:<28} | {size:>10,} | {out_size:>10,} | {1 - out_size / size:>6.0%} | "
+              f"{seconds * 1000:>7.0f} | {raw_e2e:>9.2f} | {prep_e2e:>10.2f}")
+
+    preprocessor.shutdown()
+    if totals["in"]:
+        print(f"\nTotal: {totals['in']:,} -> {totals['out']:,} bytes ({1 - totals['out'] / totals['in']:.0%} saved), "
+              f"normalisation {totals['prep']:.2f}s, estimated end-to-end {totals['raw_e2e']:.1f}s -> {totals['prep_e2e']:.1f}s "
+              f"at {args.uplink_mbps} Mbit/s")
+
+
+if __name__ == "__main__":
+    main()
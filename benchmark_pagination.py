@@ -0,0 +1,92 @@
+"""
+Benchmark: OFFSET vs keyset (cursor) pagination on the licenses table.
+
+Builds a throwaway SQLite database with N licenses and times page 1 and a deep
+page with both strategies. Keyset latency should stay flat with depth.
+
+Usage:
+    python benchmark_pagination.py [rows] [page_size]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import models
+from backend.database import Base
+from backend.utils.pagination import encode_cursor, keyset_page
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 400_000
+PAGE_SIZE = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+REPEAT = 20
+
+
+def build_db(path):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    now = int(time.time())
+    batch = []
+    with engine.begin() as conn:
+        for i in range(ROWS):
+            batch.append({
+                "id": f"{i:09d}",
+                "full_name": f"Conductor {i}",
+                "rut": f"{i:09d}",
+                "license_number": str(i),
+                "category": "B",
+                "last_control_date": "2024-01-01",
+                "status": "VIGENTE",
+                "process_status": "PENDIENTE",
+                # Several rows share an upload_date, like a real batch upload
+                "upload_date": now - ROWS + i // 10,
+                "uploaded_by": "SYSTEM",
+                "is_deleted": False,
+            })
+            if len(batch) == 10_000:
+                conn.execute(models.License.__table__.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(models.License.__table__.insert(), batch)
+    return engine
+
+
+def timed(fn):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        fn()
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Building {ROWS} licenses...")
+        engine = build_db(os.path.join(tmp, "bench.db"))
+        db = sessionmaker(bind=engine)()
+        base = db.query(models.License).filter(models.License.is_deleted == False)
+        order = (models.License.upload_date, models.License.id)
+
+        deep_page = ROWS // PAGE_SIZE
+        pages = [1, deep_page // 2, deep_page]
+
+        print(f"{'page':>8} {'offset ms':>12} {'keyset ms':>12}")
+        for page in pages:
+            skip = (page - 1) * PAGE_SIZE
+            cursor = None
+            if skip:
+                # Cursor of the row right before the page (setup, not timed)
+                last = base.order_by(*order).offset(skip - 1).limit(1).one()
+                cursor = encode_cursor(last.upload_date, last.id)
+
+            offset_ms = timed(lambda: base.order_by(*order).offset(skip).limit(PAGE_SIZE).all())
+            keyset_ms = timed(lambda: keyset_page(base, *order, PAGE_SIZE, cursor=cursor))
+            print(f"{page:>8} {offset_ms:>12.2f} {keyset_ms:>12.2f}")
+
+        db.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
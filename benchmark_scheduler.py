@@ -0,0 +1,125 @@
+"""
+Benchmark: multi-resource scheduler (backend/scheduler.py).
+
+1. Search latency: the calendar is filled solid for the first N days, so
+   the earliest visit is months ahead, and the search for several trámites
+   is timed.
+2. Concurrency: T threads schedule visits at once against the same
+   days; afterwards no unit of any resource may hold two overlapping
+   intervals and every appointment must own its intervals.
+
+Uses a throwaway SQLite database.
+
+Usage:
+    python benchmark_scheduler.py [full_days] [threads] [visits_per_thread]
+"""
+import datetime
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import models
+from backend.scheduler import Scheduler, SchedulingConflict, TICK_MINUTES
+
+FULL_DAYS = int(sys.argv[1]) if len(sys.argv) > 1 else 120
+THREADS = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+VISITS = int(sys.argv[3]) if len(sys.argv) > 3 else 25
+TRAMITES = [
+    ["meson"],
+    ["meson", "exam_medico"],
+    ["meson", "exam_medico", "exam_teorico", "exam_practico"],
+    ["placilla", "exam_medico", "exam_practico"],
+]
+START = datetime.date(2030, 3, 4)
+
+
+def fill(session_factory, scheduler, days):
+    db = session_factory()
+    rows = []
+    for offset in range(days):
+        date = (START + datetime.timedelta(days=offset)).isoformat()
+        for resource in scheduler.resources.values():
+            for unit in range(resource.units):
+                rows.append({"resource": resource.key, "date": date, "unit": unit,
+                             "busy": format((1 << (24 * 60 // TICK_MINUTES)) - 1, "x"), "version": 1})
+    db.execute(models.ResourceDay.__table__.insert(), rows)
+    db.commit()
+    db.close()
+
+
+def search_latency(session_factory, scheduler):
+    db = session_factory()
+    print(f"{'trámite':<58} | {'found':>10} | {'ms':>7}")
+    for steps in TRAMITES:
+        for ordered in (True, False):
+            started = time.perf_counter()
+            plan = scheduler.find(db, steps, START, ordered)
+            ms = (time.perf_counter() - started) * 1000
+            label = ",".join(steps) + ("" if ordered else " (any order)")
+            print(f"{label:<58} | {plan['date']:>10} | {ms:>7.1f}")
+    db.close()
+
+
+def concurrency(session_factory, scheduler):
+    start = START + datetime.timedelta(days=FULL_DAYS)
+    conflicts = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        db = session_factory()
+        for i in range(VISITS):
+            try:
+                scheduler.schedule(db, f"{seed}-{i}", rng.choice(TRAMITES), start)
+            except SchedulingConflict:
+                conflicts.append(seed)
+        db.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    db = session_factory()
+    held = defaultdict(list)
+    for booking in db.query(models.ResourceBooking):
+        held[(booking.resource, booking.unit, booking.date)].append((booking.start_minute, booking.end_minute))
+    overlaps = 0
+    for intervals in held.values():
+        intervals.sort()
+        overlaps += sum(1 for a, b in zip(intervals, intervals[1:]) if b[0] < a[1])
+    appointments = db.query(models.Appointment).count()
+    db.close()
+
+    total = THREADS * VISITS
+    print(f"\n{total} visits scheduled by {THREADS} threads in {elapsed:.2f}s "
+          f"({appointments} appointments, {len(conflicts)} gave up, {scheduler.stats()['conflicts']} retries)")
+    print("OK: no overlapping intervals" if overlaps == 0 else f"FAILED: {overlaps} overlapping intervals")
+    return overlaps == 0
+
+
+def main():
+    workdir = tempfile.mkdtemp()
+    engine = create_engine(f"sqlite:///{os.path.join(workdir, 'scheduler.db')}",
+                           connect_args={"check_same_thread": False, "timeout": 30})
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    scheduler = Scheduler(horizon_days=FULL_DAYS + 60, holidays=set())
+
+    print(f"Calendar full for {FULL_DAYS} days from {START}\n")
+    fill(session_factory, scheduler, FULL_DAYS)
+    search_latency(session_factory, scheduler)
+    sys.exit(0 if concurrency(session_factory, scheduler) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+In-process fake of the Google Drive v3 API, for exercising the Drive sync
+end to end without network access or credentials.
+
+Implements the subset used by backend/drive_sync.py: files.list (with the
+name/mimeType/trashed/parents query syntax), files.get, files.create
+(metadata only), changes.getStartPageToken, changes.list and the
+multipart/mixed batch endpoint. Tests mutate the tree with the helper methods
+(add_file, rename, move, trash, delete), which feed the changes log.
+
+Usage:
+    fake = FakeDrive().start()
+    service = fake.build_service()
+    ...
+    fake.stop()
+"""
+import email.parser
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+
+TOKEN_RE = re.compile(r"'(?:\\.|[^'\\])*'|\(|\)|!=|=|[\w.]+")
+
+
+def _unquote(token: str) -> str:
+    return re.sub(r"\\(.)", r"\1", token[1:-1])
+
+
+class QueryParser:
+    """
+    Evaluator for the Drive query language subset:
+    name = / contains, mimeType = / !=, trashed =, 'id' in parents,
+    combined with and / or / parentheses.
+    """
+
+    def __init__(self, query: str):
+        self.tokens = TOKEN_RE.findall(query or "")
+        self.pos = 0
+        self.predicate = self._or() if self.tokens else (lambda f: True)
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        self.pos += 1
+        return token
+
+    def _or(self):
+        left = self._and()
+        while self._peek() == "or":
+            self._next()
+            right = self._and()
+            left = (lambda a, b: lambda f: a(f) or b(f))(left, right)
+        return left
+
+    def _and(self):
+        left = self._atom()
+        while self._peek() == "and":
+            self._next()
+            right = self._atom()
+            left = (lambda a, b: lambda f: a(f) and b(f))(left, right)
+        return left
+
+    def _atom(self):
+        token = self._next()
+        if token == "(":
+            predicate = self._or()
+            self._next() # ")"
+            return predicate
+        if token.startswith("'"):
+            value = _unquote(token)
+            self._next() # in
+            self._next() # parents
+            return lambda f: value in f.get('parents', [])
+
+        field, op, raw = token, self._next(), self._next()
+        value = _unquote(raw) if raw.startswith("'") else raw == "true"
+        if op == "contains":
+            return lambda f: value in f.get(field, "")
+        if op == "!=":
+            return lambda f: f.get(field) != value
+        return lambda f: f.get(field) == value
+
+
+class FakeDrive:
+
+    def __init__(self):
+        self.files = {}
+        self.changes = [] # file ids, in change order; a page token is an index
+        self.requests = [] # (method, path) of every call, batched calls included
+        self._lock = threading.Lock()
+        self._server = None
+
+    # --- Tree helpers (also used by the HTTP handlers) ---
+
+    def _touch(self, file_id: str):
+        self.files[file_id]['modifiedTime'] = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+        self.changes.append(file_id)
+
+    def add_file(self, name: str, parents: list = None, mime_type: str = 'application/pdf', size: int = 0) -> str:
+        with self._lock:
+            file_id = uuid.uuid4().hex
+            self.files[file_id] = {
+                'id': file_id, 'name': name, 'mimeType': mime_type,
+                'parents': list(parents or []), 'trashed': False,
+            }
+            if mime_type != FOLDER_MIME:
+                self.files[file_id]['size'] = str(size)
+                self.files[file_id]['md5Checksum'] = uuid.uuid4().hex
+            self._touch(file_id)
+            return file_id
+
+    def add_folder(self, name: str, parents: list = None) -> str:
+        return self.add_file(name, parents, FOLDER_MIME)
+
+    def rename(self, file_id: str, name: str):
+        with self._lock:
+            self.files[file_id]['name'] = name
+            self._touch(file_id)
+
+    def move(self, file_id: str, parent_id: str):
+        with self._lock:
+            self.files[file_id]['parents'] = [parent_id]
+            self._touch(file_id)
+
+    def trash(self, file_id: str):
+        with self._lock:
+            self.files[file_id]['trashed'] = True
+            self._touch(file_id)
+
+    def delete(self, file_id: str):
+        with self._lock:
+            del self.files[file_id]
+            self.changes.append(file_id)
+
+    def find(self, name: str) -> list:
+        return [f for f in self.files.values() if f['name'] == name and not f['trashed']]
+
+    # --- API ---
+
+    def handle(self, method: str, target: str, body: bytes) -> tuple:
+        """
+        Dispatches one API call. Returns (status, json_body).
+        """
+        url = urlsplit(target)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        path = url.path
+        self.requests.append((method, path))
+
+        with self._lock:
+            if method == "GET" and path.endswith("/files"):
+                return 200, self._list_files(params)
+            if method == "POST" and path.endswith("/files"):
+                metadata = json.loads(body or b"{}")
+                file_id = uuid.uuid4().hex
+                self.files[file_id] = {
+                    'id': file_id, 'name': metadata.get('name'),
+                    'mimeType': metadata.get('mimeType', 'application/octet-stream'),
+                    'parents': metadata.get('parents', []), 'trashed': False,
+                }
+                self._touch(file_id)
+                return 200, dict(self.files[file_id])
+            if method == "GET" and "/files/" in path:
+                item = self.files.get(path.rsplit("/", 1)[1])
+                if item is None:
+                    return 404, {"error": {"code": 404, "message": "File not found"}}
+                return 200, dict(item)
+            if method == "GET" and path.endswith("/changes/startPageToken"):
+                return 200, {"startPageToken": str(len(self.changes))}
+            if method == "GET" and path.endswith("/changes"):
+                return 200, self._list_changes(params)
+        return 404, {"error": {"code": 404, "message": f"Not implemented: {method} {path}"}}
+
+    def _list_files(self, params: dict) -> dict:
+        predicate = QueryParser(params.get('q')).predicate
+        matches = sorted((f for f in self.files.values() if predicate(f)), key=lambda f: f['id'])
+        start = int(params.get('pageToken', 0))
+        size = int(params.get('pageSize', 100))
+        response = {"files": [dict(f) for f in matches[start:start + size]]}
+        if start + size < len(matches):
+            response["nextPageToken"] = str(start + size)
+        return response
+
+    def _list_changes(self, params: dict) -> dict:
+        start = int(params['pageToken'])
+        size = int(params.get('pageSize', 100))
+        ids = self.changes[start:start + size]
+        # Like Drive, a file changed several times within a page appears once
+        latest = list(dict.fromkeys(reversed(ids)))[::-1]
+        changes = []
+        for file_id in latest:
+            item = self.files.get(file_id)
+            if item is None:
+                changes.append({"fileId": file_id, "removed": True})
+            else:
+                changes.append({"fileId": file_id, "removed": False, "file": dict(item)})
+        response = {"changes": changes}
+        if start + size < len(self.changes):
+            response["nextPageToken"] = str(start + size)
+        else:
+            response["newStartPageToken"] = str(len(self.changes))
+        return response
+
+    def handle_batch(self, content_type: str, body: bytes) -> tuple:
+        """
+        Executes a multipart/mixed batch. Returns (content_type, body).
+        """
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        boundary = uuid.uuid4().hex
+        parts = []
+        for part in message.get_payload():
+            request = part.get_payload()
+            head, _, inner_body = request.partition("\r\n\r\n") if "\r\n\r\n" in request else request.partition("\n\n")
+            method, target = head.splitlines()[0].split(" ")[:2]
+            status, payload = self.handle(method, target, inner_body.encode())
+            content_id = part["Content-ID"][1:-1]
+            parts.append(
+                f"--{boundary}\r\n"
+                f"Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{json.dumps(payload)}\r\n"
+            )
+        parts.append(f"--{boundary}--\r\n")
+        return f"multipart/mixed; boundary={boundary}", "".join(parts).encode()
+
+    # --- Server ---
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self, status: int, content_type: str, body: bytes):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _dispatch(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                if self.path.startswith("/batch/"):
+                    content_type, payload = fake.handle_batch(self.headers["Content-Type"], body)
+                    self._respond(200, content_type, payload)
+                else:
+                    status, payload = fake.handle(self.command, self.path, body)
+                    self._respond(status, "application/json; charset=UTF-8", json.dumps(payload).encode())
+
+            do_GET = do_POST = do_PATCH = do_DELETE = _dispatch
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def api_endpoint(self) -> str:
+        return f"{self.url}/drive/v3/"
+
+    def build_service(self):
+        """
+        Drive v3 client (static discovery document) pointed at this fake.
+        """
+        import httplib2
+        from googleapiclient.discovery import build
+        return build('drive', 'v3', http=httplib2.Http(), static_discovery=True,
+                     client_options={"api_endpoint": self.api_endpoint})
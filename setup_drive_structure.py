@@ -6,32 +6,11 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+from backend.drive_sync import DriveMirror
+
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/drive']
 
-FOLDER_STRUCTURE = {
-    'name': 'LICENCIA_MANAGER_SYSTEM',
-    'subfolders': [
-        {
-            'name': '01_ESCANEADAS_PENDIENTES',
-            'subfolders': [
-                {'name': 'JUAN_PEREZ'},
-                {'name': 'MARIA_GONZALEZ'},
-                {'name': 'PEDRO_SOTO'},
-                {'name': 'ANA_ROJAS'}
-            ]
-        },
-        {
-            'name': '02_BASE_DATOS_EXCEL',
-            'subfolders': []
-        },
-        {
-            'name': '03_SUBIDAS_CONASET',
-            'subfolders': []
-        }
-    ]
-}
-
 def get_credentials():
     creds = None
     # The file token.json stores the user's access and refresh tokens, and is
@@ -59,42 +38,6 @@ def get_credentials():
             token.write(creds.to_json())
     return creds
 
-def create_folder(service, name, parent_id=None):
-    file_metadata = {
-        'name': name,
-        'mimeType': 'application/vnd.google-apps.folder'
-    }
-    if parent_id:
-        file_metadata['parents'] = [parent_id]
-    
-    try:
-        # Check if folder already exists
-        query = f"name = '{name}' and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
-        if parent_id:
-            query += f" and '{parent_id}' in parents"
-            
-        results = service.files().list(q=query, fields="files(id, name)").execute()
-        items = results.get('files', [])
-        
-        if items:
-            print(f"✅ Carpeta existente encontrada: {name}")
-            return items[0]['id']
-        
-        # Create if not exists
-        file = service.files().create(body=file_metadata, fields='id').execute()
-        print(f"✨ Carpeta creada: {name}")
-        return file.get('id')
-        
-    except HttpError as error:
-        print(f"❌ Error al crear carpeta {name}: {error}")
-        return None
-
-def setup_structure(service, structure, parent_id=None):
-    folder_id = create_folder(service, structure['name'], parent_id)
-    if folder_id and 'subfolders' in structure:
-        for subfolder in structure['subfolders']:
-            setup_structure(service, subfolder, folder_id)
-
 def main():
     print("🚀 Iniciando configuración de estructura en Google Drive...")
     creds = get_credentials()
@@ -103,7 +46,11 @@ def main():
 
     try:
         service = build('drive', 'v3', credentials=creds)
-        setup_structure(service, FOLDER_STRUCTURE)
+        # Batched lookups/creations, one batch per level. No db: these are the
+        # user's ids, not the service account's, so they are not cached
+        folders = DriveMirror(service).ensure_structure(None)
+        for path, folder_id in folders.items():
+            print(f"✅ {path} ({folder_id})")
         print("\n✅ ¡Estructura de carpetas creada exitosamente en tu Google Drive!")
         print("Busca la carpeta 'LICENCIA_MANAGER_SYSTEM' en tu unidad.")
         
@@ -0,0 +1,127 @@
+"""
+Stress test: hundreds of simultaneous POST /appointments/book for the same
+time. Exactly as many as a time takes ("meson_horas" units,
+APPOINTMENT_SLOT_CAPACITY, default 1) must succeed, every other one must
+get "Horario ya reservado", and the database must hold that many confirmed
+appointments for the time.
+
+Without --url, starts its own server (uvicorn, --workers processes) on a
+throwaway SQLite database. With --url, targets a running server instead,
+e.g. gunicorn on Postgres; pick a date with no bookings.
+
+Usage:
+    python stress_booking.py [--requests 300] [--workers 4] [--date 2030-01-07] [--time 09:00] [--url http://localhost:8000]
+"""
+import argparse
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+PORT = 8765
+
+
+def start_server(workers: int):
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)),
+               AUDIT_WRITE_BEHIND="0", EMAIL_OUTBOX_WORKER="0")
+    env.pop("DATABASE_URL", None) # ./licencias.db inside workdir
+    # Schema first: workers running create_all on an empty file at once race
+    subprocess.run([sys.executable, "-c", "from backend import database, models; "
+                    "models.Base.metadata.create_all(bind=database.engine)"], cwd=workdir, env=env, check=True)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(PORT),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=workdir, env=env
+    )
+    url = f"http://127.0.0.1:{PORT}"
+    for _ in range(100):
+        try:
+            requests.get(f"{url}/appointments/slots", params={"date": "2000-01-01"}, timeout=1)
+            return server, url, workdir
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("Server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--date", default="2030-01-07")
+    parser.add_argument("--time", default="09:00")
+    parser.add_argument("--url")
+    args = parser.parse_args()
+
+    server = workdir = None
+    url = args.url
+    if not url:
+        server, url, workdir = start_server(args.workers)
+
+    try:
+        before = requests.get(f"{url}/appointments/slots", params={"date": args.date}).json()["slots"]
+        if args.time not in before:
+            raise SystemExit(f"{args.date} {args.time} is not free, pick another slot")
+
+        capacity = next(resource["units"] for resource in requests.get(f"{url}/appointments/resources").json()["resources"]
+                        if resource["key"] == "meson_horas")
+        barrier = threading.Barrier(args.requests)
+        session = requests.Session()
+        session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.requests))
+
+        def book(i):
+            payload = {"rut": f"{10_000_000 + i}-K", "date": args.date, "time": args.time}
+            barrier.wait() # Release every request at once
+            try:
+                response = session.post(f"{url}/appointments/book", json=payload, timeout=60)
+            except requests.RequestException as e:
+                return "error", repr(e)
+            if response.status_code == 200:
+                return 200, None
+            try:
+                return response.status_code, response.json().get("detail")
+            except ValueError:
+                return response.status_code, response.text[:80]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.requests) as pool:
+            results = list(pool.map(book, range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+        after = requests.get(f"{url}/appointments/slots", params={"date": args.date}).json()["slots"]
+        outcomes = Counter((status, detail) for status, detail in results)
+        print(f"{args.requests} concurrent bookings of {args.date} {args.time} in {elapsed:.2f}s")
+        for (status, detail), count in outcomes.most_common():
+            print(f"  {status} {detail or ''}: {count}")
+
+        succeeded = sum(1 for status, _ in results if status == 200)
+        rejected = sum(1 for status, detail in results if status == 400 and detail == "Horario ya reservado")
+        ok = succeeded == capacity and rejected == args.requests - capacity and args.time not in after
+        if workdir is not None:
+            # Count the rows directly as well
+            db = sqlite3.connect(os.path.join(workdir, "licencias.db"))
+            confirmed = db.execute(
+                "SELECT COUNT(*) FROM appointments WHERE date = ? AND time = ? AND status = 'CONFIRMED'",
+                (args.date, args.time)
+            ).fetchone()[0]
+            db.close()
+            print(f"  confirmed appointments in the database: {confirmed}")
+            ok = ok and confirmed == capacity
+        print("OK" if ok else "FAILED: a time was double-booked or bookings were lost")
+        sys.exit(0 if ok else 1)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
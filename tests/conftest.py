@@ -0,0 +1,43 @@
+import os
+import tempfile
+
+# Before the backend is imported: no background workers, and the import-time
+# create_all of backend.main goes to a throwaway file instead of ./licencias.db
+os.environ.setdefault("AUDIT_WRITE_BEHIND", "0")
+os.environ.setdefault("EMAIL_OUTBOX_WORKER", "0")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'import.db')}")
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import database, models
+
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    """
+    A fresh SQLite database per test, also behind database.SessionLocal.
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}",
+                           connect_args={"check_same_thread": False, "timeout": 30})
+    models.Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(database, "SessionLocal", factory)
+    yield factory
+    engine.dispose()
+
+
+@pytest.fixture
+def db(session_factory):
+    session = session_factory()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def client(session_factory):
+    # Without the context manager startup events (outbox sender, Drive sync) do not run
+    from fastapi.testclient import TestClient
+    from backend.main import app
+    return TestClient(app)
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import time
+
+from backend import ai_client
+from backend.ai_batch import BatchExtractor, Source
+from backend.ai_service import CircuitBreaker, ModelService, ModelTimeout, ModelUnavailable
+
+
+class CountingClient(ai_client.FakeClient):
+
+    def __init__(self):
+        super().__init__(latency=0.05)
+        self.running = 0
+        self.peak = 0
+        self._count_lock = threading.Lock()
+
+    def analyze(self, content, mime_type, timeout=None):
+        with self._count_lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            return super().analyze(content, mime_type, timeout)
+        finally:
+            with self._count_lock:
+                self.running -= 1
+
+
+def sources(count):
+    return [Source(f"scan_{i}.jpg", "image/jpeg", 4, lambda i=i: f"scan {i}".encode()) for i in range(count)]
+
+
+def run(extractor, items):
+    async def collect():
+        return [result async for result in extractor.run(items)]
+    return asyncio.run(collect())
+
+
+def test_model_calls_are_capped_by_the_service(session_factory):
+    client = CountingClient()
+    service = ModelService(client_factory=lambda: client, max_concurrent=2)
+    extractor = BatchExtractor(service, concurrency=6, use_cache=False, prepare=False,
+                               session_factory=session_factory)
+
+    results = run(extractor, sources(12))
+
+    assert [result["status"] for result in results] == ["ok"] * 12
+    assert client.peak == 2
+    assert service.stats()["outcomes"]["ok"]["count"] == 12
+    service.shutdown()
+
+
+def test_retry_waits_for_an_open_circuit(session_factory):
+    client = CountingClient()
+    breaker = CircuitBreaker(cooldown=0.3)
+    breaker._open(time.monotonic())
+    service = ModelService(client_factory=lambda: client, breaker=breaker)
+    extractor = BatchExtractor(service, concurrency=1, retries=1, backoff=0.01, use_cache=False, prepare=False,
+                               session_factory=session_factory)
+
+    results = run(extractor, sources(1))
+
+    assert results[0]["status"] == "ok" and results[0]["attempts"] == 2
+    assert service.stats()["outcomes"]["rejected"]["count"] == 1
+    service.shutdown()
+
+
+class SteadyClient(ai_client.FakeClient):
+
+    def analyze(self, content, mime_type, timeout=None):
+        time.sleep(self.latency)
+        return {"rut": "12.345.678-5"}
+
+
+def test_waiting_for_a_slot_is_not_a_model_timeout():
+    # 16 callers, 4 slots, 0.2 s per call: the last group would wait 0.6 s for a slot
+    service = ModelService(client_factory=lambda: SteadyClient(latency=0.2), timeout=0.5, max_concurrent=4)
+
+    async def call():
+        try:
+            await service.analyze(b"scan", "image/jpeg")
+            return "ok"
+        except ModelUnavailable:
+            return "rejected"
+        except ModelTimeout:
+            return "timeout"
+
+    async def main():
+        return await asyncio.gather(*[call() for _ in range(16)])
+
+    outcomes = asyncio.run(main())
+    assert sorted(outcomes) == ["ok"] * 12 + ["rejected"] * 4
+    assert service.breaker.state == CircuitBreaker.CLOSED
+    assert service.stats()["outcomes"]["timeout"]["count"] == 0
+    service.shutdown()
+
+
+def test_batch_concurrency_is_capped_at_the_model_slots():
+    service = ModelService(client_factory=SteadyClient, max_concurrent=4)
+
+    assert BatchExtractor(service, concurrency=16).concurrency == 4
+    assert BatchExtractor(service, concurrency=2).concurrency == 2
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from backend.ai_cache import AnalysisCache
+
+
+@pytest.fixture
+def cache(session_factory):
+    return AnalysisCache(session_factory=session_factory)
+
+
+def test_identical_requests_share_one_call(cache):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"rut": "12.345.678-5"}
+
+    async def main():
+        return await asyncio.gather(*[cache.get_or_compute("abc", "model", "v1", compute) for _ in range(3)])
+
+    assert asyncio.run(main()) == [{"rut": "12.345.678-5"}] * 3
+    assert len(calls) == 1 and cache.coalesced == 2
+    # Stored for the next request
+    assert asyncio.run(cache.get_or_compute("abc", "model", "v1", compute)) == {"rut": "12.345.678-5"}
+    assert len(calls) == 1 and cache.hits == 1
+
+
+def test_a_waiter_takes_over_when_the_caller_is_cancelled(cache):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"call": len(calls)}
+
+    async def main():
+        leader = asyncio.create_task(cache.get_or_compute("abc", "model", "v1", compute))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.create_task(cache.get_or_compute("abc", "model", "v1", compute)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        leader.cancel() # The client went away
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*waiters)
+
+    assert asyncio.run(main()) == [{"call": 2}] * 2
+    assert len(calls) == 2 and cache.errors == 0
+    assert not cache._in_flight
+
+
+def test_a_cancelled_waiter_leaves_the_call_running(cache):
+    async def compute():
+        await asyncio.sleep(0.05)
+        return {"ok": True}
+
+    async def main():
+        leader = asyncio.create_task(cache.get_or_compute("abc", "model", "v1", compute))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(cache.get_or_compute("abc", "model", "v1", compute))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await leader
+
+    assert asyncio.run(main()) == {"ok": True}
+
+
+def test_errors_reach_every_waiter(cache):
+    async def compute():
+        await asyncio.sleep(0.02)
+        raise RuntimeError("modelo caído")
+
+    async def main():
+        return await asyncio.gather(*[cache.get_or_compute("abc", "model", "v1", compute) for _ in range(2)],
+                                    return_exceptions=True)
+
+    assert [str(outcome) for outcome in asyncio.run(main())] == ["modelo caído"] * 2
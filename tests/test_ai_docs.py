@@ -0,0 +1,16 @@
+import subprocess
+import sys
+
+
+def test_scan_endpoints_document_their_multipart_body(client):
+    paths = client.get("/openapi.json").json()["paths"]
+    analyze = paths["/ai/analyze"]["post"]["requestBody"]["content"]["multipart/form-data"]["schema"]
+    assert analyze["required"] == ["file"] and analyze["properties"]["file"]["format"] == "binary"
+    batch = paths["/ai/analyze-batch"]["post"]["requestBody"]["content"]["multipart/form-data"]["schema"]
+    assert batch["properties"]["files"]["items"]["format"] == "binary"
+
+
+def test_router_import_does_not_load_the_gemini_sdk():
+    code = "import sys, backend.routers.ai; print('google.generativeai' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert output.strip().splitlines()[-1] == "False"
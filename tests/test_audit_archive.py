@@ -0,0 +1,120 @@
+import datetime
+import json
+import time
+
+import pytest
+
+from backend import audit_archive, models
+
+DAY = 86400
+
+
+@pytest.fixture(autouse=True)
+def archive_path(tmp_path, monkeypatch):
+    path = tmp_path / "archive"
+    monkeypatch.setattr(audit_archive, "ARCHIVE_PATH", str(path))
+    audit_archive.invalidate_indexes()
+    return path
+
+
+def add_logs(db, prefix, count, timestamp):
+    for i in range(count):
+        db.add(models.AuditLog(id=f"{prefix}-{i:03d}", timestamp=timestamp + i, username="ADMIN", action="TEST"))
+    db.commit()
+
+
+def page_all(client, limit):
+    ids, cursor = [], None
+    while True:
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/logs/", params=params)
+        assert response.status_code == 200
+        ids.extend(row["id"] for row in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return ids
+
+
+@pytest.mark.parametrize("limit", [3, 4, 5, 7])
+def test_paging_continues_into_the_archive(client, db, limit):
+    now = int(time.time())
+    add_logs(db, "old", 6, now - 400 * DAY)
+    audit_archive.archive_audit_logs(db, older_than_days=180)
+    add_logs(db, "hot", 8, now - DAY) # 8 hot rows: limits 4 (and 8) end the hot part on a full page
+
+    ids = page_all(client, limit)
+    expected = [f"hot-{i:03d}" for i in reversed(range(8))] + [f"old-{i:03d}" for i in reversed(range(6))]
+    assert ids == expected
+
+
+def test_rearchiving_after_a_crash_does_not_duplicate(db):
+    now = int(time.time())
+    add_logs(db, "old", 5, now - 400 * DAY)
+    rows = db.query(models.AuditLog).order_by(models.AuditLog.timestamp, models.AuditLog.id).all()
+    # Segment written, but the run died before deleting the rows
+    audit_archive.write_segment([{c: getattr(row, c) for c in audit_archive.COLUMNS} for row in rows])
+    add_logs(db, "late", 2, now - 400 * DAY + 100)
+
+    result = audit_archive.archive_audit_logs(db, older_than_days=180)
+
+    assert result["archived"] == 2
+    assert db.query(models.AuditLog).count() == 0
+    archived = [row["id"] for row in audit_archive.iter_archived()]
+    assert sorted(archived) == sorted([f"old-{i:03d}" for i in range(5)] + ["late-000", "late-001"])
+    assert audit_archive.count_archived() == 7
+
+
+def test_indexes_are_parsed_once_until_the_directory_changes(db, monkeypatch):
+    add_logs(db, "old", 3, int(time.time()) - 400 * DAY)
+    audit_archive.archive_audit_logs(db, older_than_days=180)
+
+    loads = []
+    real_load = json.load
+    monkeypatch.setattr(audit_archive.json, "load", lambda f: loads.append(f) or real_load(f))
+    audit_archive.invalidate_indexes()
+    for _ in range(3):
+        assert len(audit_archive.load_indexes()) == 1
+    assert len(loads) == 1
+
+    add_logs(db, "older", 2, int(time.time()) - 500 * DAY)
+    audit_archive.archive_audit_logs(db, older_than_days=180)
+    assert len(audit_archive.load_indexes()) == 2
+
+
+def test_histogram_counts_archived_days_from_the_index(client, db, monkeypatch):
+    day = (int(time.time()) // DAY - 400) * DAY
+    add_logs(db, "old", 3, day + 3600)       # 01:00 UTC
+    add_logs(db, "late", 2, day + 23 * 3600)  # 23:00 UTC, the next day at UTC+3
+    audit_archive.archive_audit_logs(db, older_than_days=180)
+    add_logs(db, "hot", 1, int(time.time()))
+    read_block = audit_archive._read_block
+
+    def histogram(**params):
+        return {entry["day"]: entry["count"] for entry in client.get("/logs/histogram", params=params).json()}
+
+    first = datetime.date(1970, 1, 1) + datetime.timedelta(days=day // DAY)
+    monkeypatch.setattr(audit_archive, "_read_block", lambda *args: pytest.fail("block decompressed"))
+    utc = histogram()
+    assert utc[first.isoformat()] == 5 and sum(utc.values()) == 6
+    shifted = histogram(utc_offset_minutes=180)
+    assert shifted[first.isoformat()] == 3
+    assert shifted[(first + datetime.timedelta(days=1)).isoformat()] == 2
+
+    # Filters and half-hour offsets still read the rows
+    monkeypatch.setattr(audit_archive, "_read_block", read_block)
+    assert histogram(utc_offset_minutes=-30)[first.isoformat()] == 5
+    assert histogram(since=day + 2 * 3600, until=day + DAY) == {first.isoformat(): 2}
+    assert histogram(username="NADIE") == {}
+
+
+def test_segments_of_the_same_day_get_distinct_names(db, archive_path):
+    archive_path.mkdir()
+    add_logs(db, "old", 2, int(time.time()) - 400 * DAY)
+    rows = [{c: getattr(row, c) for c in audit_archive.COLUMNS} for row in db.query(models.AuditLog)]
+    # Another run created .0 and has not written its index yet
+    first = audit_archive._create_segment(audit_archive._day_start(rows[0]["timestamp"]))
+    first[1].close()
+
+    names = {audit_archive.write_segment(rows[:1]), audit_archive.write_segment(rows[1:])}
+
+    assert first[0] not in names and len(names) == 2
@@ -0,0 +1,131 @@
+import asyncio
+import time
+
+import pytest
+
+from backend import logger, models
+from backend.logger import AuditWriter
+
+
+def record(i):
+    return {"id": f"log-{i:03d}", "timestamp": 1, "username": "ADMIN", "action": "TEST",
+            "details": None, "entity_id": None}
+
+
+@pytest.fixture
+def inserts(monkeypatch):
+    sizes = []
+    write = AuditWriter._write
+
+    def counted(self, batch):
+        if batch:
+            sizes.append(len(batch))
+        write(self, batch)
+
+    monkeypatch.setattr(AuditWriter, "_write", counted)
+    return sizes
+
+
+def stored(db):
+    return db.query(models.AuditLog).count()
+
+
+def test_burst_is_written_in_batches(session_factory, db, inserts):
+    writer = AuditWriter(session_factory, batch_size=10, interval=5)
+    for i in range(25):
+        writer.enqueue(record(i))
+
+    deadline = time.monotonic() + 2
+    while writer.written < 20 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # Full batches go out at once; the remainder waits for the interval
+    assert inserts[:2] == [10, 10]
+    assert writer.written == 20
+
+    writer.shutdown()
+    assert inserts == [10, 10, 5]
+    assert stored(db) == 25
+
+
+def test_partial_batch_is_written_after_the_interval(session_factory, db, inserts):
+    writer = AuditWriter(session_factory, batch_size=100, interval=0.3)
+    started = time.monotonic()
+    writer.enqueue(record(0))
+    writer.enqueue(record(1))
+
+    while writer.written < 2 and time.monotonic() - started < 2:
+        time.sleep(0.01)
+
+    assert time.monotonic() - started >= 0.3
+    assert inserts == [2]
+    writer.shutdown()
+
+
+def test_shutdown_flushes_what_is_queued(session_factory, db):
+    writer = AuditWriter(session_factory, batch_size=100, interval=60)
+    for i in range(3):
+        writer.enqueue(record(i))
+
+    writer.shutdown()
+
+    assert stored(db) == 3
+    assert writer.stats()["queued"] == 0
+
+
+@pytest.mark.parametrize("policy", ["drop", "sync"])
+def test_full_queue_does_not_wait(session_factory, monkeypatch, policy):
+    writer = AuditWriter(session_factory, max_size=1, policy=policy, block_timeout=5)
+    monkeypatch.setattr(writer, "start", lambda: None)
+
+    assert writer.enqueue(record(0))
+    started = time.monotonic()
+    assert not writer.enqueue(record(1))
+
+    assert time.monotonic() - started < 1
+    assert writer.dropped == (1 if policy == "drop" else 0)
+
+
+def test_block_policy_waits_then_drops(session_factory, monkeypatch):
+    writer = AuditWriter(session_factory, max_size=1, policy="block", block_timeout=0.2)
+    monkeypatch.setattr(writer, "start", lambda: None)
+    writer.enqueue(record(0))
+
+    started = time.monotonic()
+    assert not writer.enqueue(record(1))
+    assert time.monotonic() - started >= 0.2
+    assert writer.dropped == 1
+
+
+def test_block_policy_never_waits_on_the_event_loop(session_factory, monkeypatch):
+    writer = AuditWriter(session_factory, max_size=1, policy="block", block_timeout=5)
+    monkeypatch.setattr(writer, "start", lambda: None)
+    writer.enqueue(record(0))
+
+    async def from_a_handler():
+        started = time.monotonic()
+        queued = writer.enqueue(record(1))
+        return queued, time.monotonic() - started
+
+    queued, waited = asyncio.run(from_a_handler())
+    assert not queued and waited < 1
+    assert writer.dropped == 1
+
+
+def test_sync_policy_writes_on_the_request_session(session_factory, db, monkeypatch):
+    writer = AuditWriter(session_factory, max_size=1, policy="sync")
+    monkeypatch.setattr(writer, "start", lambda: None)
+    monkeypatch.setattr(logger, "audit_writer", writer)
+    writer.enqueue(record(0))
+
+    logger.log_action(db, username="ADMIN", action="OVERFLOW")
+
+    assert db.query(models.AuditLog).filter_by(action="OVERFLOW").count() == 1
+
+
+def test_stats_endpoint(client, session_factory, monkeypatch):
+    assert client.get("/logs/writer/stats").json() == {"write_behind": False}
+
+    writer = AuditWriter(session_factory, policy="drop")
+    monkeypatch.setattr(logger, "audit_writer", writer)
+    stats = client.get("/logs/writer/stats").json()
+    assert stats["write_behind"] and stats["policy"] == "drop" and stats["dropped"] == 0
@@ -0,0 +1,74 @@
+import os
+import time
+
+import pytest
+
+from backend import blob_store, models
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    path = tmp_path / ".blobs"
+    monkeypatch.setattr(blob_store, "BLOB_PATH", str(path))
+    return path
+
+
+def scan(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def age(sha256, seconds):
+    old = time.time() - seconds
+    os.utime(blob_store.blob_path(sha256), (old, old))
+
+
+def test_the_same_content_is_stored_once(tmp_path, db):
+    sha256, size, created = blob_store.put_file(scan(tmp_path, "a.pdf", b"%PDF-1"), move=True)
+    again = blob_store.put_file(scan(tmp_path, "b.pdf", b"%PDF-1"), move=True)
+
+    assert created and again == (sha256, size, False)
+    assert not os.path.exists(tmp_path / "a.pdf") and os.path.exists(tmp_path / "b.pdf")
+    first = blob_store.save_file(db, "ana", "scan.pdf", sha256, size)
+    other = blob_store.save_file(db, "luis", "scan.pdf", sha256, size)
+    assert first.id != other.id
+    assert [name for name, _ in blob_store.iter_blobs()] == [sha256]
+    with blob_store.open_blob(sha256) as f:
+        assert f.read() == b"%PDF-1"
+
+
+def test_reupload_under_the_same_name_keeps_the_id(tmp_path, db):
+    first = blob_store.save_file(db, "ana", "scan.pdf", *blob_store.put_file(scan(tmp_path, "a", b"v1"))[:2])
+    second = blob_store.save_file(db, "ana", "scan.pdf", *blob_store.put_file(scan(tmp_path, "b", b"v2"))[:2])
+
+    assert second.id == first.id
+    assert db.query(models.SimFile).count() == 1
+
+
+def test_gc_keeps_referenced_and_recent_blobs(tmp_path, db):
+    kept, size, _ = blob_store.put_file(scan(tmp_path, "a", b"referenced"))
+    blob_store.save_file(db, "ana", "a.pdf", kept, size)
+    orphan, _, _ = blob_store.put_file(scan(tmp_path, "b", b"orphan"))
+    recent, _, _ = blob_store.put_file(scan(tmp_path, "c", b"not committed yet"))
+    thumbnail = blob_store.blob_path(orphan) + ".256.webp"
+    with open(thumbnail, "wb") as f:
+        f.write(b"webp")
+    for sha256 in (kept, orphan):
+        age(sha256, 7200)
+    os.utime(thumbnail, (time.time() - 7200,) * 2)
+
+    result = blob_store.gc(db, grace_seconds=3600)
+
+    assert result["removed"] == 2
+    assert sorted(name for name, _ in blob_store.iter_blobs()) == sorted([kept, recent])
+
+
+def test_putting_a_duplicate_renews_its_grace_period(tmp_path, db):
+    sha256, _, _ = blob_store.put_file(scan(tmp_path, "a", b"scan"))
+    age(sha256, 7200)
+
+    # A second upload of the same content, whose row is not committed yet
+    blob_store.put_file(scan(tmp_path, "b", b"scan"))
+
+    assert blob_store.gc(db, grace_seconds=3600)["removed"] == 0
@@ -0,0 +1,189 @@
+import datetime
+import threading
+
+import pytest
+from sqlalchemy import inspect, text
+
+from backend import booking, migrations, models
+from backend.scheduler import scheduler, COUNTER, COUNTER_TIMES, InvalidTramite
+
+DATE = "2030-03-05"
+COUNTERS = scheduler.resources[COUNTER].units
+PER_TIME = scheduler.resources[COUNTER_TIMES].units
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    booking.availability_cache.clear()
+
+
+def book_concurrently(session_factory, count, time="09:00"):
+    barrier = threading.Barrier(count)
+    outcomes = []
+
+    def attempt(i):
+        db = session_factory()
+        try:
+            barrier.wait()
+            booking.book(db, f"{10_000_000 + i}-0", DATE, time)
+            outcomes.append("ok")
+        except booking.SlotUnavailable:
+            outcomes.append("taken")
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=attempt, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def fill(db, time, count=PER_TIME):
+    return [booking.book(db, f"{20_000_000 + i}-0", DATE, time) for i in range(count)]
+
+
+def test_concurrent_bookings_take_a_time_once(session_factory, db):
+    outcomes = book_concurrently(session_factory, 8)
+
+    assert sorted(outcomes) == ["ok"] * PER_TIME + ["taken"] * (8 - PER_TIME)
+    assert db.query(models.Appointment).filter(models.Appointment.status == "CONFIRMED").count() == PER_TIME
+    units = {row.unit for row in db.query(models.ResourceBooking).filter_by(resource=COUNTER, date=DATE)}
+    assert units == set(range(PER_TIME))
+
+
+def test_cancelled_place_can_be_booked_again(db):
+    appointment = fill(db, "09:20")[0]
+    with pytest.raises(booking.SlotUnavailable):
+        booking.book(db, "11.111.111-1", DATE, "09:20")
+
+    booking.cancel(db, appointment.id, appointment.rut_key)
+    with pytest.raises(booking.AppointmentNotFound):
+        booking.cancel(db, appointment.id, appointment.rut_key)
+    assert booking.book(db, "11.111.111-1", DATE, "09:20").status == "CONFIRMED"
+
+
+def test_invalid_slots_are_rejected(db):
+    db.add(models.Holiday(date="2030-03-06", name="Feriado"))
+    db.commit()
+    for date, time in [(DATE, "09:05"), (DATE, "9:00"), (DATE, "14:00"), ("05/03/2030", "09:00"),
+                       ("2030-03-09", "09:00"), ("2030-03-06", "09:00")]:
+        with pytest.raises(booking.InvalidSlot):
+            booking.book(db, "12.345.678-5", date, time)
+    assert booking.available_times(db, "2030-03-06") == []
+
+
+def test_book_and_schedule_share_the_counters(db):
+    for i in range(COUNTERS):
+        appointment, _ = scheduler.schedule(db, f"{30_000_000 + i}-0", [COUNTER], datetime.date(2030, 3, 5))
+        assert (appointment.date, appointment.time) == (DATE, "09:00")
+
+    assert "09:00" not in booking.available_times(db, DATE)
+    with pytest.raises(booking.SlotUnavailable):
+        booking.book(db, "12.345.678-5", DATE, "09:00")
+
+
+def test_a_booked_time_takes_one_counter(db):
+    fill(db, "09:00")
+
+    times = [
+        scheduler.schedule(db, f"{30_000_000 + i}-0", [COUNTER], datetime.date(2030, 3, 5))[0].time
+        for i in range(COUNTERS)
+    ]
+
+    assert times == ["09:00"] * (COUNTERS - PER_TIME) + ["09:20"] * PER_TIME
+    with pytest.raises(InvalidTramite):
+        scheduler.find(db, [COUNTER_TIMES])
+
+
+def test_counter_appointments_from_before_the_scheduler_are_held(session_factory, db):
+    for appointment_id, time in [("legacy", "09:00"), ("seconds", "09:00:00"), ("hours", "9h"), ("empty", "")]:
+        db.add(models.Appointment(id=appointment_id, rut="12.345.678-5", date=DATE, time=time, status="CONFIRMED"))
+    db.commit()
+
+    first = migrations.hold_counter_appointments(db.get_bind())
+    again = migrations.hold_counter_appointments(db.get_bind())
+
+    assert first == {"held": 1, "full": 0, "skipped": 3}
+    assert again == {"held": 0, "full": 0, "skipped": 3}
+    db.expire_all()
+    assert db.get(models.Appointment, "legacy").tramite == f"{COUNTER},{COUNTER_TIMES}"
+    assert db.get(models.Appointment, "hours").tramite is None
+    assert db.query(models.ResourceBooking).filter_by(appointment_id="legacy").count() == 2
+    assert book_concurrently(session_factory, 2) == ["taken"] * 2
+
+
+def test_slot_inventory_is_retired_by_hand(db):
+    engine = db.get_bind()
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE appointment_slots (date VARCHAR, time VARCHAR, booked INTEGER)"))
+    db.add(models.Appointment(id="legacy", rut="12.345.678-5", date=DATE, time="09:00", status="CONFIRMED"))
+    db.commit()
+
+    migrations.run_migrations(engine) # At startup: leaves both alone
+    assert db.get(models.Appointment, "legacy").tramite is None
+    assert "appointment_slots" in inspect(engine).get_table_names()
+
+    migrations.hold_counter_appointments(engine)
+    migrations.drop_slot_inventory(engine)
+    migrations.drop_slot_inventory(engine)
+    assert "appointment_slots" not in inspect(engine).get_table_names()
+
+
+def test_availability_read_across_a_booking_is_not_cached(db, monkeypatch):
+    cache_set = booking.availability_cache.set
+    fill(db, "09:00", PER_TIME - 1)
+
+    def booked_meanwhile(key, value, generation=None):
+        # Another request books the last place (and clears the cache) after the range was read
+        monkeypatch.setattr(booking.availability_cache, "set", cache_set)
+        booking.book(db, "12.345.678-5", DATE, "09:00")
+        return cache_set(key, value, generation)
+
+    monkeypatch.setattr(booking.availability_cache, "set", booked_meanwhile)
+    assert "09:00" in booking.availability(db, DATE, DATE)["days"][0]["slots"]
+
+    assert "09:00" not in booking.availability(db, DATE, DATE)["days"][0]["slots"]
+
+
+def test_a_citizen_schedules_one_visit_at_a_time(db):
+    booking.book(db, "12.345.678-5", DATE, "09:00")
+
+    with pytest.raises(booking.AlreadyBooked):
+        booking.schedule(db, "12345678-5", [COUNTER], datetime.date(2030, 3, 5))
+
+
+def test_the_later_of_two_concurrent_visits_is_withdrawn(db, monkeypatch):
+    schedule = scheduler.schedule
+
+    def booked_meanwhile(*args, **kwargs):
+        # The citizen's other request books once the check has passed
+        other = booking.book(db, "12.345.678-5", DATE, "13:00")
+        other.created_at -= 1
+        db.commit()
+        return schedule(*args, **kwargs)
+
+    monkeypatch.setattr(scheduler, "schedule", booked_meanwhile)
+    with pytest.raises(booking.AlreadyBooked):
+        booking.schedule(db, "12345678-5", [COUNTER], datetime.date(2030, 3, 5))
+
+    confirmed = db.query(models.Appointment).filter(models.Appointment.status == "CONFIRMED").all()
+    assert [appointment.time for appointment in confirmed] == ["13:00"]
+    # The withdrawn visit's counter was freed
+    times = [
+        schedule(db, f"{30_000_000 + i}-0", [COUNTER], datetime.date(2030, 3, 5))[0].time
+        for i in range(COUNTERS)
+    ]
+    assert times == ["09:00"] * COUNTERS
+
+
+def test_schedule_endpoint_checks_the_citizen(client, db):
+    body = {"rut": "12.345.678-5", "steps": [COUNTER], "from_date": DATE}
+    assert client.post("/appointments/schedule", json=body).status_code == 404
+
+    db.add(models.License(id="L1", rut="12.345.678-5", full_name="PERSONA", is_deleted=False))
+    db.commit()
+    first = client.post("/appointments/schedule", json=body)
+    assert first.status_code == 200 and first.json()["date"] == DATE
+    assert client.post("/appointments/schedule", json=body).status_code == 409
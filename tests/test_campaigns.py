@@ -0,0 +1,97 @@
+import threading
+from collections import Counter
+
+import pytest
+
+from backend import campaigns, leases, models
+
+READY = models.ProcessStatus.READY_FOR_PICKUP.value
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(campaigns, "CHUNK_SIZE", 3)
+
+
+def add_licenses(db, count):
+    for i in range(count):
+        db.add(models.License(id=f"L{i:03d}", rut=f"{1_000_000 + i}-0", full_name=f"PERSONA {i}",
+                              email=f"persona{i}@example.org" if i % 5 else None,
+                              process_status=READY, upload_date=1, is_deleted=False))
+    db.commit()
+
+
+def queued_per_license(db):
+    return Counter(entity_id for (entity_id,) in db.query(models.EmailOutbox.entity_id))
+
+
+def test_resume_is_refused_while_a_runner_holds_the_campaign(client, db):
+    add_licenses(db, 10)
+    campaign = campaigns.create_campaign(db, "ready_for_pickup", {"process_status": READY}, "ADMIN")
+    owner = campaigns.claim(db, campaign.id) # The first background task, still running
+
+    assert client.post(f"/notifications/campaigns/{campaign.id}/resume").status_code == 409
+    assert db.query(models.EmailOutbox).count() == 0
+
+    leases.release(db, campaigns.lease_name(campaign.id), owner)
+    response = client.post(f"/notifications/campaigns/{campaign.id}/resume")
+    assert response.status_code == 200
+    db.expire_all()
+    assert db.get(models.Campaign, campaign.id).status == models.CampaignStatus.QUEUED
+    assert set(queued_per_license(db).values()) == {1}
+
+
+def test_concurrent_runners_queue_each_recipient_once(session_factory, db):
+    add_licenses(db, 40)
+    campaign = campaigns.create_campaign(db, "ready_for_pickup", {"process_status": READY}, "ADMIN")
+    busy = []
+
+    def runner():
+        session = session_factory()
+        try:
+            campaigns.run_campaign(session, campaign.id)
+        except campaigns.CampaignBusy:
+            busy.append(True)
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=runner) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    counts = queued_per_license(db)
+    assert len(counts) == 32 and set(counts.values()) == {1}
+    db.expire_all()
+    stored = db.get(models.Campaign, campaign.id)
+    assert (stored.queued, stored.skipped, stored.status) == (32, 8, models.CampaignStatus.QUEUED)
+
+
+def test_runner_stops_when_its_chunk_was_queued_by_another(session_factory, db, monkeypatch):
+    add_licenses(db, 9)
+    campaign = campaigns.create_campaign(db, "ready_for_pickup", {"process_status": READY}, "ADMIN")
+    owner = campaigns.claim(db, campaign.id)
+
+    target_query = campaigns.target_query
+    taken_over = []
+
+    def stalled_query(session, filters):
+        # The lease runs out while this runner stalls; another one queues everything
+        if not taken_over:
+            taken_over.append(True)
+            db.query(models.Lease).update({"expires_at": 0})
+            db.commit()
+            other = session_factory()
+            campaigns.run_campaign(other, campaign.id)
+            other.close()
+        return target_query(session, filters)
+
+    monkeypatch.setattr(campaigns, "target_query", stalled_query)
+    runner = session_factory()
+    campaigns.run_campaign(runner, campaign.id, owner)
+    runner.close()
+
+    assert set(queued_per_license(db).values()) == {1}
+    db.expire_all()
+    assert db.get(models.Campaign, campaign.id).queued == 7
@@ -0,0 +1,99 @@
+import pytest
+
+from backend import blob_store, documents, models
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, "BLOB_PATH", str(tmp_path / ".blobs"))
+
+
+def add_document(db, id, created_at, **values):
+    values = {"username": "ana", "mode": "simulation", "mime_type": "application/pdf", "drive_id": id, **values}
+    db.add(models.Document(id=id, name=f"{id}.pdf", created_at=created_at, **values))
+    db.commit()
+
+
+def listed(client, **params):
+    response = client.get("/drive/list", params=params)
+    assert response.status_code == 200
+    return [document["id"] for document in response.json()]
+
+
+def test_catalogue_filters(client, db):
+    add_document(db, "a", 1, license_rut="12.345.678-5")
+    add_document(db, "b", 2, username="luis", mime_type="image/jpeg")
+    add_document(db, "c", 3, license_rut="12345678-5", mode="real")
+    add_document(db, "d", 4, missing=True)
+    db.add(models.License(id="L1", rut="12.345.678-5", full_name="PERSONA", is_deleted=False))
+    db.commit()
+
+    assert listed(client) == ["c", "b", "a"]
+    assert listed(client, username="ana") == ["c", "a"]
+    # Any spelling of the RUT, or the licence it belongs to
+    assert listed(client, rut="0012345678-5") == ["c", "a"]
+    assert listed(client, license_id="L1") == ["c", "a"]
+    assert listed(client, mime_type="image/jpeg") == ["b"]
+    assert listed(client, mode="real") == ["c"]
+    assert listed(client, include_missing=True) == ["d", "c", "b", "a"]
+    assert client.get("/drive/list", params={"license_id": "nope"}).status_code == 404
+
+
+def test_reconcile_the_simulation_store(tmp_path, db):
+    def stored(name, content):
+        path = tmp_path / name
+        path.write_bytes(content)
+        sha256, size, _ = blob_store.put_file(str(path))
+        return blob_store.save_file(db, "ana", name, sha256, size)
+
+    known = stored("known.pdf", b"known")
+    found = stored("found.pdf", b"found")
+    add_document(db, "catalogued", 1, drive_id=known.id, sha256=known.sha256)
+    add_document(db, "gone", 2, drive_id="deleted-file", sha256="0" * 64)
+    add_document(db, "back", 3, drive_id=known.id, sha256=known.sha256, missing=True)
+
+    result = documents.reconcile(db)
+
+    assert result == {"mode": "simulation", "checked": 3, "added": 1, "missing": 1, "restored": 1}
+    missing = {document.id: document.missing for document in db.query(models.Document)}
+    assert missing.pop("gone") and not any(missing.values())
+    added = db.query(models.Document).filter_by(drive_id=found.id).one()
+    assert (added.username, added.sha256) == ("ana", found.sha256)
+    assert added.web_link == documents.content_url(added.id)
+    # Nothing left to do
+    assert documents.reconcile(db)["added"] == 0
+
+
+class FakeDrive:
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.tokens = []
+
+    def files(self):
+        return self
+
+    def list(self, pageToken=None, **kwargs):
+        self.tokens.append(pageToken)
+        self.page = self.pages[int(pageToken or 0)]
+        return self
+
+    def execute(self):
+        return self.page
+
+
+def test_reconcile_drive_reads_every_page(db):
+    drive = FakeDrive([
+        {"files": [{"id": "d1", "name": "a.pdf", "size": "10", "createdTime": "2030-03-05T12:00:00Z"}],
+         "nextPageToken": "1"},
+        {"files": [{"id": "d2", "name": "b.pdf"}]},
+    ])
+    add_document(db, "kept", 1, mode="real", drive_id="d1")
+    add_document(db, "gone", 2, mode="real", drive_id="d3")
+
+    result = documents.reconcile(db, drive)
+
+    assert drive.tokens == [None, "1"]
+    assert result == {"mode": "real", "checked": 2, "added": 1, "missing": 1, "restored": 0}
+    added = db.query(models.Document).filter_by(drive_id="d2").one()
+    assert added.username is None and added.name == "b.pdf"
@@ -0,0 +1,101 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from backend import drive_client as drive_client_module
+from backend.drive_client import DriveClient, MODE_REAL, MODE_SIMULATION
+
+
+@pytest.fixture(scope="module")
+def private_key():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                             serialization.NoEncryption()).decode()
+
+
+@pytest.fixture
+def credentials_file(tmp_path, private_key, monkeypatch):
+    monkeypatch.setattr(drive_client_module, "CHECK_INTERVAL", 0)
+    path = tmp_path / "credentials.json"
+    path.write_text(json.dumps({
+        "type": "service_account",
+        "project_id": "licencias",
+        "private_key_id": "1",
+        "private_key": private_key,
+        "client_email": "sync@licencias.iam.gserviceaccount.com",
+        "client_id": "1",
+        "token_uri": "https://oauth2.googleapis.com/token",
+    }))
+    return path
+
+
+def test_service_is_built_from_the_static_discovery_document(credentials_file, monkeypatch):
+    builds = []
+    build = drive_client_module.build
+    monkeypatch.setattr(drive_client_module, "build", lambda *args, **kwargs: builds.append(kwargs) or build(*args, **kwargs))
+    client = DriveClient(str(credentials_file))
+
+    service = client.get_service()
+
+    assert client.mode == MODE_REAL
+    assert builds[0]["static_discovery"] is True
+    assert client.get_service() is service and len(builds) == 1
+    # Rebuilt only once the file changes
+    os.utime(credentials_file, ns=(0, 0))
+    assert client.get_service() is not service and len(builds) == 2
+
+
+def test_every_thread_gets_its_own_transport(credentials_file):
+    client = DriveClient(str(credentials_file))
+    request = client.get_service().files().list()
+    transports = []
+
+    def build_twice():
+        transports.append(client.get_service().files().list().http)
+        transports.append(client.get_service().files().get(fileId="x").http)
+
+    thread = threading.Thread(target=build_twice)
+    thread.start()
+    thread.join()
+
+    assert transports[0] is transports[1]
+    assert transports[0] is not request.http
+    assert client.get_service().files().list().http is request.http
+
+
+def test_placeholder_or_missing_credentials_mean_simulation(tmp_path):
+    placeholder = tmp_path / "credentials.json"
+    placeholder.write_text(json.dumps({"INSTRUCCIONES": "Pegue aquí su cuenta de servicio"}))
+
+    for path in [placeholder, tmp_path / "missing.json"]:
+        client = DriveClient(str(path))
+        assert client.get_service() is None
+        assert client.state()["mode"] == MODE_SIMULATION
+
+
+def test_callers_keep_the_old_service_during_a_rebuild(credentials_file, monkeypatch):
+    client = DriveClient(str(credentials_file))
+    service = client.get_service()
+    building = threading.Event()
+    build = client._build
+
+    def slow_build(signature):
+        building.set()
+        time.sleep(0.2)
+        return build(signature)
+
+    monkeypatch.setattr(client, "_build", slow_build)
+    client.refresh()
+    rebuilder = threading.Thread(target=client.get_service)
+    rebuilder.start()
+    building.wait(1)
+    monkeypatch.setattr(drive_client_module, "CHECK_INTERVAL", 60)
+
+    assert client.get_service() is service
+    rebuilder.join()
+    assert client.get_service() not in (None, service)
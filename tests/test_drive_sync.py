@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+from backend import drive_sync, leases, models
+from backend.drive_client import batch_uri
+from backend.drive_sync import DriveMirror, LeaseLost, get_state
+from fake_drive_server import FakeDrive
+
+
+@pytest.fixture
+def fake():
+    fake = FakeDrive().start()
+    yield fake
+    fake.stop()
+
+
+def mirror_for(fake, owner=None):
+    return DriveMirror(fake.build_service(), batch_uri=batch_uri(fake.api_endpoint), lease_owner=owner)
+
+
+def lease_age(db):
+    db.expire_all()
+    lease = db.get(models.Lease, drive_sync.SYNC_LEASE)
+    return int(time.time()) - (lease.expires_at - drive_sync.LEASE_SECONDS)
+
+
+def test_batch_uri_comes_from_the_discovery_document(fake):
+    assert batch_uri("") == "https://www.googleapis.com/batch/drive/v3"
+    assert batch_uri(fake.api_endpoint) == f"{fake.url}/batch/drive/v3"
+
+
+def test_lease_is_renewed_between_pages(fake, db, monkeypatch):
+    monkeypatch.setattr(drive_sync, "PAGE_SIZE", 2)
+    assert leases.acquire(db, drive_sync.SYNC_LEASE, "worker-a", drive_sync.LEASE_SECONDS)
+    mirror = mirror_for(fake, "worker-a")
+    mirror.sync(db)
+
+    juan = fake.find("JUAN_PEREZ")[0]['id']
+    for i in range(5):
+        fake.add_file(f"scan_{i}.pdf", [juan])
+    # The cycle started long ago: only renewals keep the lease alive
+    db.query(models.Lease).filter(models.Lease.name == drive_sync.SYNC_LEASE).update(
+        {"expires_at": int(time.time()) + 1})
+    db.commit()
+    result = mirror.sync(db)
+
+    assert result["changes"] == 5
+    assert lease_age(db) <= 1
+
+
+def test_cycle_stops_when_the_lease_was_taken_over(fake, db):
+    assert leases.acquire(db, drive_sync.SYNC_LEASE, "worker-a", drive_sync.LEASE_SECONDS)
+    mirror_for(fake, "worker-a").sync(db)
+    token = get_state(db, "page_token")
+
+    fake.add_file("scan.pdf", [fake.find("JUAN_PEREZ")[0]['id']])
+    db.query(models.Lease).filter(models.Lease.name == drive_sync.SYNC_LEASE).update(
+        {"owner": "worker-b", "expires_at": int(time.time()) + drive_sync.LEASE_SECONDS})
+    db.commit()
+    with pytest.raises(LeaseLost):
+        mirror_for(fake, "worker-a").sync(db)
+    db.rollback()
+
+    assert get_state(db, "page_token") == token
+    assert not db.query(models.DriveMirrorEntry).filter(models.DriveMirrorEntry.name == "scan.pdf").count()
+
+
+def test_sync_endpoint_runs_under_the_lease(fake, client, db, session_factory, monkeypatch):
+    service = fake.build_service()
+    syncer = drive_sync.DriveSyncer(session_factory=session_factory)
+    monkeypatch.setattr(drive_sync.drive_client, "get_service", lambda: service)
+    monkeypatch.setattr(drive_sync, "drive_batch_uri", lambda: batch_uri(fake.api_endpoint))
+    monkeypatch.setattr(drive_sync, "drive_syncer", syncer)
+    monkeypatch.setattr("backend.routers.drive.drive_syncer", syncer)
+
+    assert leases.acquire(db, drive_sync.SYNC_LEASE, "worker-b", drive_sync.LEASE_SECONDS)
+    assert client.post("/drive/sync").status_code == 409
+    assert syncer.run_once() is None
+
+    leases.release(db, drive_sync.SYNC_LEASE, "worker-b")
+    assert client.post("/drive/sync").status_code == 202
+    assert syncer.last_result["mode"] == "full"
+    # Released at the end of the cycle, so the next request is not refused
+    assert leases.holder(db, drive_sync.SYNC_LEASE) is None
+    assert client.post("/drive/sync").status_code == 202
+    assert syncer.last_result["mode"] == "incremental"
@@ -0,0 +1,108 @@
+import socket
+import time
+
+import pytest
+
+from backend import email_outbox, leases, models
+from backend.email_outbox import OutboxSender
+from backend.utils import email
+
+controller_module = pytest.importorskip("aiosmtpd.controller")
+
+
+class Collector:
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.rcpt_tos, envelope.content))
+        return "250 OK"
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    collector = Collector()
+    controller = controller_module.Controller(collector, hostname="127.0.0.1", port=port)
+    controller.start()
+    monkeypatch.setattr(email, "SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setattr(email, "SMTP_PORT", port)
+    monkeypatch.setattr(email, "SMTP_STARTTLS", False)
+    monkeypatch.setattr(email, "SMTP_USER", "") # No login, and not mock mode
+    monkeypatch.setattr(email, "SMTP_FROM", "licencias@example.org")
+    yield collector
+    controller.stop()
+
+
+def enqueue(db, count):
+    for i in range(count):
+        email.enqueue_email(db, f"persona{i}@example.org", f"Aviso {i}", "Su licencia está lista")
+    db.commit()
+
+
+def test_messages_are_delivered_over_smtp(session_factory, db, smtp_server):
+    enqueue(db, 3)
+    sender = OutboxSender(session_factory=session_factory, max_per_second=0)
+
+    assert sender.send_batch() == 3
+    assert sorted(rcpt[0] for rcpt, _ in smtp_server.messages) == [f"persona{i}@example.org" for i in range(3)]
+    assert db.query(models.EmailOutbox).filter(models.EmailOutbox.status == models.EmailStatus.SENT).count() == 3
+
+
+def test_only_the_lease_holder_sends(session_factory, db, smtp_server):
+    enqueue(db, 4)
+    workers = [OutboxSender(session_factory=session_factory, max_per_second=0, batch_size=2) for _ in range(4)]
+
+    # Every worker runs a cycle; only the first one to take the lease delivers
+    processed = [worker.send_batch() for worker in workers]
+    assert processed == [2, 0, 0, 0]
+    assert leases.holder(db, email_outbox.SENDER_LEASE) == workers[0].owner
+    assert workers[0].send_batch() == 2
+    assert len(smtp_server.messages) == 4
+
+
+def test_another_worker_takes_over_a_released_lease(session_factory, db, smtp_server):
+    enqueue(db, 2)
+    first, second = (OutboxSender(session_factory=session_factory, max_per_second=0, batch_size=1) for _ in range(2))
+    assert first.send_batch() == 1
+    assert second.send_batch() == 0
+
+    leases.release(db, email_outbox.SENDER_LEASE, first.owner)
+    assert second.send_batch() == 1
+    assert len(smtp_server.messages) == 2
+
+
+def test_rate_limit_applies_to_the_deployment(session_factory, db, smtp_server):
+    enqueue(db, 5)
+    workers = [OutboxSender(session_factory=session_factory, max_per_second=20) for _ in range(4)]
+    started = time.monotonic()
+    for worker in workers:
+        worker.send_batch()
+    # 5 messages at 20/s overall: at least 4 intervals of 50 ms
+    assert time.monotonic() - started >= 0.2
+    assert len(smtp_server.messages) == 5
+
+
+def test_batch_stops_when_the_lease_is_lost(session_factory, db, smtp_server, monkeypatch):
+    enqueue(db, 3)
+    first, second = (OutboxSender(session_factory=session_factory, max_per_second=0) for _ in range(2))
+    deliver = first._deliver
+
+    def stalled(server, message):
+        # The first send outlasts the lease and another worker takes over
+        monkeypatch.setattr(first, "_deliver", deliver)
+        other = session_factory()
+        leases.release(other, email_outbox.SENDER_LEASE, first.owner)
+        assert leases.acquire(other, email_outbox.SENDER_LEASE, second.owner, 60)
+        other.close()
+        deliver(server, message)
+
+    monkeypatch.setattr(first, "_deliver", stalled)
+    assert first.send_batch() == 3
+    assert first.sent == 1
+
+    assert second.send_batch() == 2
+    assert sorted(rcpt[0] for rcpt, _ in smtp_server.messages) == [f"persona{i}@example.org" for i in range(3)]
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from backend.utils import file_response
+
+CONTENT = bytes(range(256)) * 4
+ETAG = '"v1"'
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_response, "READ_CHUNK", 100) # Several reads per response
+    path = tmp_path / "scan.pdf"
+    path.write_bytes(CONTENT)
+    app = FastAPI()
+
+    @app.api_route("/file", methods=["GET", "HEAD"])
+    def get_file(request: Request):
+        return file_response.file_response(request, str(path), ETAG, "application/pdf", "escáner.pdf")
+
+    return TestClient(app)
+
+
+def get(client, **headers):
+    return client.get("/file", headers=headers)
+
+
+def test_whole_file(client):
+    response = get(client)
+
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["etag"] == ETAG and response.headers["accept-ranges"] == "bytes"
+    assert response.headers["content-disposition"] == "inline; filename*=utf-8''esc%C3%A1ner.pdf"
+
+
+@pytest.mark.parametrize("header, start, end", [
+    ("bytes=0-99", 0, 99),
+    ("bytes=250-", 250, 1023),
+    ("bytes=1000-5000", 1000, 1023),
+    ("bytes=-24", 1000, 1023),
+    ("bytes=-5000", 0, 1023),
+])
+def test_single_and_suffix_ranges(client, header, start, end):
+    response = get(client, range=header)
+
+    assert response.status_code == 206
+    assert response.content == CONTENT[start:end + 1]
+    assert response.headers["content-range"] == f"bytes {start}-{end}/{len(CONTENT)}"
+    assert response.headers["content-length"] == str(end - start + 1)
+
+
+@pytest.mark.parametrize("header", ["bytes=1024-", "bytes=2000-3000", "bytes=-0", "bytes=10-5"])
+def test_unsatisfiable_ranges(client, header):
+    response = get(client, range=header)
+
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(CONTENT)}"
+    assert response.content == b""
+
+
+@pytest.mark.parametrize("header", ["bytes=0-1,5-6", "items=0-5", "bytes=-"])
+def test_unsupported_ranges_send_the_whole_file(client, header):
+    response = get(client, range=header)
+
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+
+@pytest.mark.parametrize("header", [ETAG, f"W/{ETAG}", f'"v0", {ETAG}', "*"])
+def test_matching_etag_is_not_modified(client, header):
+    response = get(client, **{"if-none-match": header})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == ETAG
+
+
+def test_other_etag_is_sent_again(client):
+    assert get(client, **{"if-none-match": '"v0"'}).status_code == 200
+
+
+def test_if_range_for_another_version_sends_the_whole_file(client):
+    current = get(client, range="bytes=0-9", **{"if-range": ETAG})
+    stale = get(client, range="bytes=0-9", **{"if-range": '"v0"'})
+
+    assert current.status_code == 206 and current.content == CONTENT[:10]
+    assert stale.status_code == 200 and stale.content == CONTENT
+    assert "content-range" not in stale.headers
+
+
+def test_head_sends_headers_only(tmp_path):
+    # Called directly: the test client expects a body after HEAD
+    path = tmp_path / "scan.pdf"
+    path.write_bytes(CONTENT)
+    response = file_response.RangeFileResponse(str(path), 0, 9, 206, {}, send_body=False)
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(response({"type": "http"}, None, send))
+
+    assert messages[0]["status"] == 206
+    assert (b"content-length", b"10") in messages[0]["headers"]
+    assert [message["body"] for message in messages[1:]] == [b""]
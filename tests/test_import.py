@@ -0,0 +1,95 @@
+import datetime
+import io
+
+import pytest
+
+from backend import models
+from backend.routers import licenses
+from backend.utils.rut import check_digit, format_rut, normalize_rut, validate_rut
+
+
+def rut(body):
+    return f"{body}-{check_digit(str(body))}"
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(licenses, "IMPORT_CHUNK_SIZE", 2)
+
+
+def post(client, name, content):
+    return client.post("/licenses/import", files={"file": (name, content)})
+
+
+def test_csv_rows_are_inserted_across_chunks_and_errors_reported(client, db):
+    db.add(models.License(id="existing", rut=rut(9000000), rut_key=normalize_rut(rut(9000000)),
+                          full_name="YA EXISTE", upload_date=1, is_deleted=False))
+    db.commit()
+    lines = ["rut,nombre,clase,vencimiento"]
+    lines += [f"{rut(10000000 + i)},PERSONA {i},B,2030-01-01" for i in range(5)]
+    lines += [
+        "",                              # Skipped, not reported
+        f"{rut(10000000)},REPETIDA,B,",  # Row 8: duplicated in a later chunk
+        "12345678-0,RUT MALO,B,",        # Row 9: wrong check digit
+        f"{rut(9000000)},EXISTENTE,B,",  # Row 10
+    ]
+    report = post(client, "licencias.csv", ("\ufeff" + "\n".join(lines)).encode()).json()
+
+    assert report["inserted"] == 5
+    errors = {error["row"]: error["error"] for error in report["errors"]}
+    assert sorted(errors) == [8, 9, 10]
+    assert errors[8] == "RUT duplicado en el archivo" and errors[10] == "Licencia ya existe"
+    stored = db.query(models.License).filter(models.License.full_name.like("PERSONA%")).all()
+    assert len(stored) == 5
+    assert {row.category for row in stored} == {"B"} and {row.fecha_control for row in stored} == {"2030-01-01"}
+    assert all(row.rut_key for row in stored)
+
+
+def test_xlsx_date_cells_are_imported_as_iso_dates(client, db):
+    openpyxl = pytest.importorskip("openpyxl")
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["RUT", "Nombre", "Clase", "Vencimiento"])
+    for i in range(3):
+        sheet.append([rut(11000000 + i), f"PERSONA {i}", "A2", datetime.datetime(2031, 5, i + 1)])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+
+    report = post(client, "licencias.xlsx", buffer.getvalue()).json()
+
+    assert report == {"inserted": 3, "errors": []}
+    dates = sorted(row.fecha_control for row in db.query(models.License))
+    assert dates == ["2031-05-01", "2031-05-02", "2031-05-03"]
+
+
+def test_non_ascii_digits_are_an_invalid_rut():
+    assert validate_rut(rut(12345678))
+    assert not validate_rut("1²-9")
+    assert not validate_rut("١٢٣-4")
+
+
+def test_unsupported_format_is_rejected(client):
+    assert post(client, "licencias.txt", b"rut\n").status_code == 400
+
+
+def test_unreadable_files_are_rejected(client):
+    corrupt = post(client, "licencias.xlsx", b"PK\x03\x04 not really a workbook")
+    assert corrupt.status_code == 400 and "Excel" in corrupt.json()["detail"]
+
+    latin1 = post(client, "licencias.csv", "rut,nombre\n11111111-1,MUÑOZ\n".encode("latin-1"))
+    assert latin1.status_code == 400 and "UTF-8" in latin1.json()["detail"]
+
+
+def test_rows_that_fail_to_save_keep_their_row_number(client, db):
+    # Same id under another rut_key: passes validation, fails the insert
+    db.add(models.License(id=format_rut(rut(12000001)), rut=rut(12000001), full_name="OTRA", upload_date=1, is_deleted=False))
+    db.commit()
+    db.query(models.License).update({"rut_key": "x"})
+    db.commit()
+    lines = ["rut,nombre,clase", f"{rut(12000000)},PERSONA,B", f"{rut(12000001)},CHOCA,B"]
+
+    report = post(client, "licencias.csv", "\n".join(lines).encode()).json()
+
+    assert report["inserted"] == 0
+    assert [(error["row"], error["rut"]) for error in report["errors"]] == [(2, format_rut(rut(12000000))), (3, format_rut(rut(12000001)))]
+    assert all(error["error"].startswith("Error al guardar") for error in report["errors"])
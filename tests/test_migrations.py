@@ -0,0 +1,29 @@
+from sqlalchemy import create_engine, inspect, text
+
+from backend import migrations, models
+
+
+def test_a_worker_losing_the_migration_race_still_boots(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    models.License.__table__.create(engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_licenses_rut_key"))
+        conn.execute(text("ALTER TABLE licenses DROP COLUMN rut_key"))
+
+    # This worker inspected the old schema, then another one migrated it
+    stale = inspect(engine)
+    stale.get_table_names()
+    stale.get_columns("licenses")
+    stale.get_indexes("licenses")
+    migrations.add_missing_columns(engine)
+    migrations.create_missing_indexes(engine)
+    inspectors = iter([stale])
+    monkeypatch.setattr(migrations, "inspect", lambda bind: next(inspectors, None) or inspect(bind))
+
+    migrations.add_missing_columns(engine)
+    inspectors = iter([stale])
+    migrations.create_missing_indexes(engine)
+
+    assert "rut_key" in {column["name"] for column in inspect(engine).get_columns("licenses")}
+    assert "ix_licenses_rut_key" in {index["name"] for index in inspect(engine).get_indexes("licenses")}
+    engine.dispose()
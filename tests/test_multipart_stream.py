@@ -0,0 +1,70 @@
+import asyncio
+import os
+
+import pytest
+
+from backend.utils.multipart_stream import stream_multipart_to_disk, MultipartTooLarge
+
+BOUNDARY = "limite"
+
+
+class FakeRequest:
+
+    def __init__(self, body: bytes, chunk_size: int = 1000):
+        self.headers = {"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"}
+        self._body = body
+        self._chunk_size = chunk_size
+
+    async def stream(self):
+        for i in range(0, len(self._body), self._chunk_size):
+            yield self._body[i:i + self._chunk_size]
+
+
+def body(*parts):
+    out = b""
+    for disposition, content in parts:
+        out += f"--{BOUNDARY}\r\nContent-Disposition: form-data; {disposition}\r\n\r\n".encode() + content + b"\r\n"
+    return out + f"--{BOUNDARY}--\r\n".encode()
+
+
+def parse(tmp_path, payload, **kwargs):
+    return asyncio.run(stream_multipart_to_disk(FakeRequest(payload), str(tmp_path), **kwargs))
+
+
+def test_fields_and_files_are_separated(tmp_path):
+    fields, files = parse(tmp_path, body(
+        ('name="username"', b"ana"),
+        ('name="file"; filename="scan.pdf"', b"%PDF" * 1000),
+    ))
+    assert fields == {"username": "ana"}
+    assert [(f.filename, f.size) for f in files] == [("scan.pdf", 4000)]
+    assert os.path.getsize(files[0].path) == 4000
+
+
+def test_empty_file_inputs_are_skipped(tmp_path):
+    fields, files = parse(tmp_path, body(
+        ('name="file"; filename=""', b""),
+        ('name="file"; filename="scan.pdf"', b"%PDF"),
+        ('name="username"', b"ana"),
+    ))
+    assert fields == {"username": "ana"}
+    assert [f.filename for f in files] == ["scan.pdf"]
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_oversize_fields_are_rejected(tmp_path):
+    with pytest.raises(MultipartTooLarge):
+        parse(tmp_path, body(
+            ('name="file"; filename="scan.pdf"', b"%PDF"),
+            ('name="notes"', b"x" * 40_000),
+            ('name="more"', b"x" * 40_000),
+        ), max_field_bytes=64 * 1024)
+    assert os.listdir(tmp_path) == []
+
+
+def test_upload_batch_answers_413_for_an_oversize_field(client, tmp_path, monkeypatch):
+    from backend.routers import drive
+    monkeypatch.setattr(drive, "STAGING_PATH", str(tmp_path))
+    response = client.post("/drive/upload-batch", data={"username": "ana", "rut": "x" * 70_000},
+                           files={"file": ("scan.pdf", b"%PDF")})
+    assert response.status_code == 413
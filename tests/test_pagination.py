@@ -0,0 +1,67 @@
+import pytest
+
+from backend import models
+from backend.utils import pagination
+
+
+def add_licenses(db, count):
+    for i in range(count):
+        db.add(models.License(id=f"L{i:03d}", rut=f"{1_000_000 + i}-0", full_name=f"PERSONA {i}",
+                              upload_date=1000 + i // 2, is_deleted=False))
+    db.commit()
+
+
+def page_all(db, limit, descending=False):
+    query = db.query(models.License)
+    ids, cursor = [], None
+    while True:
+        rows, cursor = pagination.keyset_page(
+            query, models.License.upload_date, models.License.id, limit, cursor=cursor, descending=descending
+        )
+        ids.extend(row.id for row in rows)
+        if cursor is None:
+            return ids
+
+
+@pytest.mark.parametrize("limit", [1, 3, 5, 7, 10, 11])
+def test_pages_cover_every_row_once(db, limit):
+    # 10 rows: limits that divide it exactly end on a full last page
+    add_licenses(db, 10)
+    expected = [f"L{i:03d}" for i in range(10)]
+    assert page_all(db, limit) == expected
+    assert page_all(db, limit, descending=True) == expected[::-1]
+
+
+def test_last_full_page_has_no_cursor(db):
+    add_licenses(db, 4)
+    rows, cursor = pagination.keyset_page(db.query(models.License), models.License.upload_date, models.License.id, 4)
+    assert len(rows) == 4 and cursor is None
+
+
+@pytest.mark.parametrize("limit", [0, -1])
+def test_non_positive_limit_is_rejected(db, limit):
+    with pytest.raises(ValueError):
+        pagination.keyset_page(db.query(models.License), models.License.upload_date, models.License.id, limit)
+
+
+@pytest.mark.parametrize("values", [[{}, "x"], [[1], "x"], [None, "x"], [True, "x"]])
+def test_cursor_values_must_be_scalars(values):
+    with pytest.raises(ValueError):
+        pagination.decode_cursor(pagination.encode_cursor(*values))
+
+
+def test_malformed_cursor_is_rejected():
+    with pytest.raises(ValueError):
+        pagination.decode_cursor("not-a-cursor!")
+
+
+@pytest.mark.parametrize("path", ["/licenses/", "/purchases/", "/logs/", "/notifications/outbox", "/drive/list"])
+@pytest.mark.parametrize("limit", [0, -1, 1001])
+def test_list_endpoints_validate_limit(client, path, limit):
+    assert client.get(path, params={"limit": limit}).status_code == 422
+
+
+def test_list_endpoint_rejects_non_scalar_cursor(client):
+    cursor = pagination.encode_cursor({}, "x")
+    response = client.get("/licenses/", params={"cursor": cursor})
+    assert response.status_code == 400
@@ -0,0 +1,85 @@
+import datetime
+
+import pytest
+
+from backend import models, scheduler as scheduler_module
+from backend.scheduler import Resource, Scheduler, SchedulingConflict
+
+DAY = datetime.date(2030, 3, 5)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(scheduler_module, "BACKOFF_SECONDS", 0)
+
+
+def one_counter():
+    # A single unit: a lost race has to move to the next start
+    return Scheduler(resources={"meson": Resource("meson", "Mesón", 1, 20, {"mon-fri": ["09:00-10:00"]})},
+                     holidays=set())
+
+
+def race_once(monkeypatch, session_factory, scheduler, time=None):
+    """
+    Right after the first search, another worker takes the visit it found
+    (or the given time).
+    """
+    search = scheduler._search
+    rival = one_counter()
+
+    def searched_then_taken(*args, **kwargs):
+        monkeypatch.setattr(scheduler, "_search", search)
+        found = search(*args, **kwargs)
+        other = session_factory()
+        if time:
+            rival.reserve_at(other, "11.111.111-1", ["meson"], DAY, time)
+        else:
+            rival.schedule(other, "11.111.111-1", ["meson"], DAY)
+        other.close()
+        return found
+
+    monkeypatch.setattr(scheduler, "_search", searched_then_taken)
+
+
+def held(db):
+    return sorted((row.start_minute, row.appointment_id) for row in db.query(models.ResourceBooking))
+
+
+@pytest.mark.parametrize("booked_before", [0, 1])
+def test_lost_race_searches_again(monkeypatch, session_factory, db, booked_before):
+    # booked_before=0: both create the day's row; 1: both update it
+    scheduler = one_counter()
+    for i in range(booked_before):
+        scheduler.schedule(db, f"{20_000_000 + i}-0", ["meson"], DAY)
+    race_once(monkeypatch, session_factory, scheduler)
+
+    appointment, plan = scheduler.schedule(db, "12.345.678-5", ["meson"], DAY)
+
+    assert scheduler.stats()["conflicts"] == 1
+    assert plan["start"] == ["09:20", "09:40"][booked_before]
+    starts = [start for start, _ in held(db)]
+    assert len(starts) == len(set(starts)) == booked_before + 2
+    assert appointment.id in {appointment_id for _, appointment_id in held(db)}
+
+
+def test_change_elsewhere_on_the_unit_is_no_conflict(monkeypatch, session_factory, db):
+    scheduler = one_counter()
+    scheduler.schedule(db, "20.000.000-0", ["meson"], DAY)
+    race_once(monkeypatch, session_factory, scheduler, time="09:40")
+
+    _, plan = scheduler.schedule(db, "12.345.678-5", ["meson"], DAY)
+
+    assert plan["start"] == "09:20"
+    assert scheduler.stats()["conflicts"] == 0
+    assert [start for start, _ in held(db)] == [540, 560, 580]
+
+
+def test_gives_up_after_max_attempts(db, monkeypatch):
+    scheduler = one_counter()
+    monkeypatch.setattr(scheduler, "_claim", lambda *args: False)
+
+    with pytest.raises(SchedulingConflict):
+        scheduler.schedule(db, "12.345.678-5", ["meson"], DAY)
+
+    assert scheduler.stats()["conflicts"] == scheduler.max_attempts
+    assert db.query(models.Appointment).count() == 0
@@ -0,0 +1,65 @@
+import threading
+
+from backend import models, status_cache
+from backend.routers import public
+from backend.utils.cache import TTLCache
+
+
+def test_set_after_invalidation_during_load_is_dropped():
+    cache = TTLCache()
+    generation = cache.generation()
+    cache.invalidate("k") # A write commits while the value is being loaded
+    assert cache.set("k", "stale", generation) is False
+    assert cache.get("k") is None
+    assert cache.set("k", "fresh", cache.generation()) is True
+    assert cache.get("k") == "fresh"
+
+
+def test_invalidation_of_another_key_does_not_block_set():
+    cache = TTLCache()
+    generation = cache.generation()
+    cache.invalidate("other")
+    assert cache.set("k", "value", generation) is True
+
+
+def test_forgotten_invalidations_are_assumed_recent():
+    cache = TTLCache(max_size=2)
+    generation = cache.generation()
+    for key in ("a", "b", "c"): # "a" falls out of the invalidation record
+        cache.invalidate(key)
+    assert cache.set("a", "stale", generation) is False
+
+
+def test_clear_blocks_loads_in_progress():
+    cache = TTLCache()
+    generation = cache.generation()
+    cache.clear()
+    assert cache.set("k", "stale", generation) is False
+
+
+def test_status_is_not_cached_when_updated_during_load(client, session_factory, monkeypatch):
+    db = session_factory()
+    db.add(models.License(id="L1", rut="12.345.678-5", full_name="JUAN PEREZ", process_status="PENDIENTE",
+                          upload_date=1, is_deleted=False))
+    db.commit()
+    status_cache.status_cache.clear()
+
+    load_status = public._load_status
+    loaded = threading.Event()
+
+    def racing_load(rut_key):
+        status = load_status(rut_key) # Reads the old row...
+        # ...and an update commits and invalidates before the result is cached
+        db.query(models.License).filter(models.License.id == "L1").update({"process_status": "LISTA PARA ENTREGA"})
+        db.commit()
+        status_cache.invalidate_status(db, "12.345.678-5")
+        loaded.set()
+        return status
+
+    monkeypatch.setattr(public, "_load_status", racing_load)
+    first = client.get("/public/status/12345678-5").json()
+    assert loaded.is_set() and first["processStatus"] == "PENDIENTE"
+
+    monkeypatch.setattr(public, "_load_status", load_status)
+    assert client.get("/public/status/12345678-5").json()["processStatus"] == "LISTA PARA ENTREGA"
+    db.close()
@@ -0,0 +1,92 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from backend import blob_store, thumbnails
+from backend.thumbnails import ThumbnailPipeline
+
+Image = pytest.importorskip("PIL.Image")
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, "BLOB_PATH", str(tmp_path / ".blobs"))
+    monkeypatch.setattr(thumbnails, "WORK_PATH", str(tmp_path / ".blobs" / ".work"))
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    # Threads instead of spawned processes, which would not see the patched paths
+    pipeline = ThumbnailPipeline(max_pending=1)
+    executor = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(pipeline, "_pool", lambda: executor)
+    yield pipeline
+    executor.shutdown(wait=True)
+
+
+def stored_scan(tmp_path, fmt="JPEG", size=(3000, 2000)):
+    path = tmp_path / f"scan.{fmt.lower()}"
+    Image.new("RGB", size, (200, 30, 30)).save(path, fmt)
+    sha256, _, _ = blob_store.put_file(str(path))
+    return sha256
+
+
+@pytest.mark.parametrize("fmt, mime_type", [("JPEG", "image/jpeg"), ("PDF", "application/pdf")])
+def test_every_variant_is_rendered(tmp_path, fmt, mime_type):
+    if fmt == "PDF":
+        pytest.importorskip("pypdfium2")
+    sha256 = stored_scan(tmp_path, fmt)
+
+    written = thumbnails.render(blob_store.blob_path(sha256), sha256, mime_type, "jpeg")
+
+    sizes = {}
+    for path in written:
+        with Image.open(path) as image:
+            assert image.format == "JPEG"
+            sizes[path.split(".")[-2]] = max(image.size)
+    assert sizes["thumb"] <= 256 and 1000 < sizes["preview"] <= 1280
+    assert not [name for name in os.listdir(os.path.dirname(written[0])) if name.endswith(".part")]
+
+
+def test_ensure_generates_a_missing_rendition_once(tmp_path, pipeline):
+    sha256 = stored_scan(tmp_path)
+
+    path = pipeline.ensure(sha256, "image/jpeg", "thumb", "webp")
+
+    assert path == thumbnails.rendition_path(sha256, "thumb", "webp") and os.path.exists(path)
+    assert pipeline.ensure(sha256, "image/jpeg", "preview", "webp")
+    assert pipeline.stats()["generated"] == 1
+    with pytest.raises(thumbnails.UnsupportedType):
+        pipeline.ensure(sha256, "text/plain", "thumb", "webp")
+
+
+def test_full_queue_falls_back(tmp_path, pipeline, monkeypatch):
+    busy = stored_scan(tmp_path)
+    other = stored_scan(tmp_path, "PNG", (10, 10))
+    release = threading.Event()
+    render = thumbnails.render
+
+    def stuck(source, sha256, mime_type, fmt):
+        release.wait(5)
+        return render(source, sha256, mime_type, fmt)
+
+    monkeypatch.setattr(thumbnails, "render", stuck)
+    first = pipeline._submit(blob_store.blob_path(busy), busy, "image/jpeg", "webp")
+
+    # On demand: refused (503 at the endpoint) instead of waiting behind the queue
+    with pytest.raises(TimeoutError):
+        pipeline.ensure(other, "image/png", "thumb", "webp")
+    # After an upload: skipped, and the pipeline's copy of the upload is removed
+    upload = tmp_path / "upload.png"
+    upload.write_bytes(b"png")
+    assert pipeline.schedule(str(upload), "f" * 64, "image/png") is None
+    assert os.listdir(thumbnails.WORK_PATH) == []
+    # The same rendition in flight is shared, not refused
+    assert pipeline._submit(blob_store.blob_path(busy), busy, "image/jpeg", "webp") is first
+
+    release.set()
+    first.result(5)
+    assert pipeline.stats()["skipped"] == 2
+    assert pipeline.ensure(other, "image/png", "thumb", "webp")
@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+from backend import models
+from backend.upload_jobs import UploadManager, UploadRejected
+
+
+@pytest.fixture
+def manager(session_factory):
+    manager = UploadManager(max_workers=1, max_per_user=1, session_factory=session_factory)
+    yield manager
+    manager.shutdown()
+
+
+def test_requests_racing_for_the_last_slot_are_not_both_admitted(manager, db):
+    # Both pass the early check before either job exists
+    manager.check_user_limit(db, "ana")
+    manager.check_user_limit(db, "ana")
+    first = manager.create_job(db, "ana", "a.pdf", "application/pdf")
+    second = manager.create_job(db, "ana", "b.pdf", "application/pdf")
+
+    admitted = []
+    for job in (first, second):
+        try:
+            manager.enforce_user_limit(db, "ana", [job])
+            admitted.append(job.id)
+        except UploadRejected:
+            pass
+
+    assert admitted == [second.id]
+    assert [job.id for job in db.query(models.UploadJob)] == [second.id]
+
+
+def test_a_batch_counts_as_one_upload(manager, db):
+    jobs = [manager.create_job(db, "ana", f"{i}.pdf", "application/pdf", batch_id="lote") for i in range(3)]
+    manager.enforce_user_limit(db, "ana", jobs)
+    with pytest.raises(UploadRejected):
+        manager.check_user_limit(db, "ana")
+
+
+def test_batch_files_not_started_before_shutdown_are_failed(manager, db, tmp_path, monkeypatch):
+    running = threading.Event()
+    proceed = threading.Event()
+
+    def slow_run(job_id, staging_path, log=True):
+        running.set()
+        proceed.wait(5)
+        return models.UploadJobStatus.DONE
+
+    monkeypatch.setattr(manager, "_run", slow_run)
+    items = []
+    for i in range(3):
+        job = manager.create_job(db, "ana", f"{i}.pdf", "application/pdf", batch_id="lote")
+        path = tmp_path / job.id
+        path.write_bytes(b"%PDF")
+        items.append((job.id, str(path)))
+
+    manager.reserve(3)
+    manager.submit_batch("lote", "ana", items, parallelism=1)
+    assert running.wait(5)
+    shutdown = threading.Thread(target=manager.shutdown)
+    shutdown.start()
+    while not manager._executor._shutdown:
+        time.sleep(0.01)
+    proceed.set()
+    shutdown.join(5)
+
+    db.expire_all()
+    statuses = [db.get(models.UploadJob, job_id).status for job_id, _ in items]
+    # The first one ran (as a stub that leaves the row untouched); the others never started
+    assert statuses == [models.UploadJobStatus.QUEUED] + [models.UploadJobStatus.FAILED] * 2
+    assert not any((tmp_path / job_id).exists() for job_id, _ in items[1:])
+    assert manager._pending == 0
+    assert db.query(models.AuditLog).filter(models.AuditLog.action == "UPLOAD_BATCH").count() == 1
+
+
+@pytest.mark.parametrize("failing", ["stage_file", "submit"])
+def test_upload_that_cannot_be_queued_is_failed(client, db, manager, monkeypatch, tmp_path, failing):
+    from backend import upload_jobs
+    from backend.routers import drive
+
+    staging = tmp_path / "staging"
+    monkeypatch.setattr(drive, "upload_manager", manager)
+    monkeypatch.setattr(drive, "STAGING_PATH", str(staging))
+    monkeypatch.setattr(upload_jobs, "STAGING_PATH", str(staging))
+
+    def broken(*args):
+        raise OSError("No space left on device")
+
+    if failing == "stage_file":
+        monkeypatch.setattr(drive, "stage_file", broken)
+    else:
+        monkeypatch.setattr(manager, "submit", broken)
+
+    response = client.post("/drive/upload", data={"username": "ana"}, files={"file": ("a.pdf", b"%PDF")})
+
+    assert response.status_code == 500
+    job = db.query(models.UploadJob).one()
+    assert job.status == models.UploadJobStatus.FAILED and "No space left" in job.error
+    assert not staging.exists() or list(staging.iterdir()) == []
+    assert manager._pending == 0
+    # The failed job no longer counts against the user's limit
+    manager.check_user_limit(db, "ana")
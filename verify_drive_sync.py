@@ -0,0 +1,100 @@
+"""
+End-to-end check of the incremental Drive mirror (backend/drive_sync.py)
+against the in-process fake Drive server. Needs no credentials or network.
+
+    python verify_drive_sync.py
+"""
+import os
+import tempfile
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import models
+from backend.drive_client import batch_uri
+from backend.drive_sync import DriveMirror, FOLDER_MIME, ROOT_FOLDER, get_state
+from fake_drive_server import FakeDrive
+
+failures = 0
+
+def check(label, condition):
+    global failures
+    print(f"{'✅ PASS' if condition else '❌ FAIL'} | {label}")
+    if not condition:
+        failures += 1
+
+def mirrored(db):
+    return {entry.id: entry for entry in db.query(models.DriveMirrorEntry).all()}
+
+def main():
+    workdir = tempfile.mkdtemp()
+    engine = create_engine(f"sqlite:///{os.path.join(workdir, 'sync.db')}", connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+
+    fake = FakeDrive().start()
+    try:
+        mirror = DriveMirror(fake.build_service(), batch_uri=batch_uri(fake.api_endpoint))
+
+        print("Cycle 1: empty Drive, structure created and walked")
+        result = mirror.sync(db)
+        check("full sync on first run", result["mode"] == "full")
+        check("8 folders created", len([f for f in fake.files.values() if f['mimeType'] == FOLDER_MIME]) == 8)
+        check("folder creation batched (one batch per level, plus lookups)",
+              len([r for r in fake.requests if r == ("POST", "/batch/drive/v3")]) <= 8)
+        check("whole tree mirrored", len(mirrored(db)) == 8)
+        check("page token saved", get_state(db, "page_token") is not None)
+
+        print("Cycle 2: no changes")
+        fake.requests.clear()
+        result = mirror.sync(db)
+        check("incremental sync", result["mode"] == "incremental" and result["changes"] == 0)
+        check("only the changes feed is read", fake.requests == [("GET", "/drive/v3/changes")])
+
+        print("Cycle 3: deltas")
+        pending = fake.find("01_ESCANEADAS_PENDIENTES")[0]['id']
+        juan = fake.find("JUAN_PEREZ")[0]['id']
+        scan = fake.add_file("scan_001.pdf", [juan], size=2048)
+        fake.add_file("outside.pdf", [], size=1)
+        old = fake.add_file("old.pdf", [juan])
+        fake.trash(old)
+        outside_folder = fake.add_folder("LOTE_EXTERNO")
+        fake.add_file("lote_1.pdf", [outside_folder])
+        fake.move(outside_folder, pending)
+        fake.rename(scan, "scan_001_RUT_12345678-5.pdf")
+
+        fake.requests.clear()
+        result = mirror.sync(db)
+        entries = mirrored(db)
+        check("renamed scan mirrored", entries.get(scan) is not None and entries[scan].name == "scan_001_RUT_12345678-5.pdf")
+        check("scan size/parent kept", entries[scan].size == 2048 and entries[scan].parent_id == juan)
+        check("file outside the tree ignored", not any(e.name == "outside.pdf" for e in entries.values()))
+        check("trashed file not mirrored", old not in entries)
+        check("folder moved in brings its contents", any(e.name == "lote_1.pdf" for e in entries.values()))
+        check("no full resync", ("GET", "/drive/v3/changes/startPageToken") not in fake.requests)
+
+        print("Cycle 4: folder trashed")
+        fake.trash(outside_folder)
+        mirror.sync(db)
+        entries = mirrored(db)
+        check("trashed folder and contents removed", outside_folder not in entries
+              and not any(e.name == "lote_1.pdf" for e in entries.values()))
+
+        print("Cycle 5: structure folder deleted, recreated from the cache miss")
+        conaset = fake.find("03_SUBIDAS_CONASET")[0]['id']
+        fake.delete(conaset)
+        mirror.sync(db)
+        check("cached id dropped", get_state(db, f"folder:{ROOT_FOLDER}/03_SUBIDAS_CONASET") is None)
+        mirror.sync(db)
+        recreated = fake.find("03_SUBIDAS_CONASET")
+        check("folder recreated", len(recreated) == 1 and recreated[0]['id'] != conaset)
+        check("recreated folder mirrored", recreated[0]['id'] in mirrored(db))
+    finally:
+        fake.stop()
+        db.close()
+
+    print("Done." if not failures else f"{failures} check(s) failed.")
+    return failures
+
+if __name__ == "__main__":
+    raise SystemExit(1 if main() else 0)